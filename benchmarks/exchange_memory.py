@@ -0,0 +1,79 @@
+"""
+Measure the memory held per HttpExchange, once as loaded (raw messages only) and once after the request and response
+have been parsed and validated. Run from the root of the repository:
+
+    python benchmarks/exchange_memory.py [number of exchanges]
+"""
+import gc
+import sys
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'src')]
+
+from src.http_message.http_exchange import HttpExchange  # noqa: E402
+
+REQUEST = (b'POST /api/v1/orders?id=%d HTTP/1.1\r\n'
+           b'Host: shop.example.com\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n'
+           b'Accept: application/json\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\n'
+           b'Accept-Encoding: gzip, deflate, br\r\n'
+           b'Content-Type: application/json\r\n'
+           b'Content-Length: 27\r\n'
+           b'Cookie: session=5f2b8c1e9d; theme=dark\r\n'
+           b'Connection: keep-alive\r\n'
+           b'\r\n'
+           b'{"item": 42, "quantity": 1}')
+RESPONSE = (b'HTTP/1.1 201 Created\r\n'
+            b'Server: nginx/1.24.0\r\n'
+            b'Date: Tue, 02 May 2023 10:00:00 GMT\r\n'
+            b'Content-Type: application/json\r\n'
+            b'Content-Length: 16\r\n'
+            b'Connection: keep-alive\r\n'
+            b'\r\n'
+            b'{"status": "ok"}')
+
+
+def load(n: int) -> List[HttpExchange]:
+    exchanges = []
+    for i in range(n):
+        exchange = HttpExchange('10.0.0.1', '10.0.0.2', 1683021600. + i, raw_request=REQUEST % i, source='bench')
+        exchange.set_raw_response(RESPONSE, 1683021600.05 + i)
+        exchanges.append(exchange)
+    return exchanges
+
+
+def parse(exchange: HttpExchange) -> None:
+    request, response = exchange.get_request(), exchange.get_response()
+    exchange.num_headers, request.get_problems(), request.get_cookies(), request.get_body()
+    response.headers, response.get_problems()
+
+
+def measure(n: int, prepare: Callable[[HttpExchange], None]) -> float:
+    """:return: bytes allocated per exchange, which are still held after `prepare` was applied to all exchanges"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    exchanges = load(n)
+    for exchange in exchanges:
+        prepare(exchange)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del exchanges
+    return held / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    raw_size = len(REQUEST % 0) + len(RESPONSE)
+    print(f"{n} exchanges with {raw_size} bytes of raw messages each")
+    print(f"loaded:  {measure(n, lambda exchange: None):8.0f} bytes per exchange")
+    print(f"parsed:  {measure(n, parse):8.0f} bytes per exchange")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare reading a time window of a capture through the sidecar index with a full scan, which have to yield identical
+exchanges, also if the window ends between a request and its response. Run from the root of the repository:
+
+    python benchmarks/pcap_index.py [number of connections]
+"""
+import math
+import socket
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'src')]
+
+from src.datasource.capture_filter import CaptureFilter  # noqa: E402
+from src.datasource.pcap_reader import PcapReader  # noqa: E402
+
+CLIENT, SERVER = '10.0.0.1', '10.0.0.2'
+START = 999.995  # a connection starts 5ms before every full minute, i.e. the end of a bucket of the index
+INTERVAL = 0.5  # seconds between the connections
+REQUEST = b'GET /%d HTTP/1.1\r\nHost: example.com\r\n\r\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+
+def frame(src: str, src_port: int, dst: str, dst_port: int, seq: int, flags: int, payload: bytes) -> bytes:
+    tcp = struct.pack('!HHIIBBHHH', src_port, dst_port, seq, 0, 5 << 4, flags, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b'\x00' * 12 + b'\x08\x00' + ip + tcp + payload
+
+
+def write_capture(path: Path, n: int) -> None:
+    """Connections with a single exchange, whose response arrives 11ms after the request"""
+    frames = []
+    for i in range(n):
+        t, port, request = START + i * INTERVAL, 1024 + i, REQUEST % i
+        frames += [(t, frame(CLIENT, port, SERVER, 80, 0, 0x02, b'')),
+                   (t + 0.001, frame(CLIENT, port, SERVER, 80, 1, 0x18, request)),
+                   (t + 0.012, frame(SERVER, 80, CLIENT, port, 1, 0x18, RESPONSE)),
+                   (t + 0.013, frame(CLIENT, port, SERVER, 80, 1 + len(request), 0x11, b''))]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for t, data in frames:
+            f.write(struct.pack('<IIII', int(t), round(t % 1 * 1e6), len(data), len(data)) + data)
+
+
+def read(path: Path, capture_filter: CaptureFilter, use_index: bool) -> tuple:
+    """:return: the exchanges as (path, status code, rtt) and the seconds it took to read them"""
+    start = time.perf_counter()
+    reader = PcapReader(backend='native', capture_filter=capture_filter, use_index=use_index)
+    exchanges = [(e.path, e.get_response().status_code if e.get_response() else None, round(e.rtt, 3))
+                 for e in reader.iter_samples(path)]
+    return exchanges, time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'capture.pcap'
+        write_capture(path, n)
+        read(path, CaptureFilter(end_time=START), use_index=True)  # builds the index
+        middle = START + n // 2 * INTERVAL
+        minute = math.ceil(middle / 60) * 60  # its response is in the next bucket
+        windows = {
+            'window cutting a connection': CaptureFilter(start_time=minute - 0.01, end_time=minute - 0.001),
+            'one host, cutting a connection': CaptureFilter(src_ips=[CLIENT], start_time=minute - 0.01,
+                                                            end_time=minute - 0.001),
+            'last minute': CaptureFilter(start_time=START + n * INTERVAL - 60),
+            'one host, 10 minutes': CaptureFilter(src_ips=[CLIENT], start_time=middle, end_time=middle + 600),
+        }
+        print(f"{n} connections")
+        for name, capture_filter in windows.items():
+            indexed, indexed_time = read(path, capture_filter, use_index=True)
+            scanned, scan_time = read(path, capture_filter, use_index=False)
+            if indexed != scanned:
+                raise AssertionError(f"{name}: indexed read differs from full scan: {indexed[:3]} != {scanned[:3]}")
+            print(f"{name:31s}: {len(indexed):6d} exchanges, indexed {indexed_time:6.3f}s, full scan {scan_time:6.3f}s")
+
+
+if __name__ == '__main__':
+    main()
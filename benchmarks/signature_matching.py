@@ -0,0 +1,61 @@
+"""
+Measure the requests scanned per second by the signature matcher with the default signatures and with additional
+random signatures, which shows that the cost per request doesn't depend on the number of signatures. Run from the
+root of the repository:
+
+    python benchmarks/signature_matching.py [number of requests]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'src')]
+
+from src.http_message.parsing import parse_request  # noqa: E402
+from src.preprocessing.signatures import Signature, SignatureMatcher, load_signatures  # noqa: E402
+
+REQUEST = (b'POST /api/v1/orders?id=42&sort=date HTTP/1.1\r\n'
+           b'Host: shop.example.com\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n'
+           b'Accept: application/json\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\n'
+           b'Accept-Encoding: gzip, deflate, br\r\n'
+           b'Content-Type: application/json\r\n'
+           b'Content-Length: 27\r\n'
+           b'Cookie: session=5f2b8c1e9d; theme=dark\r\n'
+           b'Connection: keep-alive\r\n'
+           b'\r\n'
+           b'{"item": 42, "quantity": 1}')
+
+
+def random_signatures(n: int) -> list:
+    alphabet = b'abcdefghijklmnopqrstuvwxyz0123456789_(<'
+    return [Signature(f'random.s{i}', bytes(random.choice(alphabet) for _ in range(8))) for i in range(n)]
+
+
+def measure(n: int, matcher: SignatureMatcher) -> float:
+    """:return: requests scanned per second, where the request has been parsed already"""
+    parsed = parse_request(REQUEST)
+    start = time.perf_counter()
+    for _ in range(n):
+        matcher.scan_request(REQUEST, parsed)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    signatures = load_signatures()
+    print(f"{n} requests of {len(REQUEST)} bytes")
+    for extra in (0, 1000, 10000):
+        start = time.perf_counter()
+        matcher = SignatureMatcher(signatures + random_signatures(extra))
+        build = time.perf_counter() - start
+        print(f"{len(matcher.signatures):6d} signatures: {measure(n, matcher):8.0f} requests/s "
+              f"(built in {build:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,94 @@
 from pathlib import Path
-from typing import List, Union, Generator
+from typing import List, Union, Generator, Optional, Iterable
 
+from .access_log_reader import AccessLogReader
 from .csv_reader import CsvReader
+from .har_reader import HarReader
 from .pcap_reader import PcapReader
 from .datasource_base import DataSourceBase
+from .capture_filter import CaptureFilter
+from .parallel import load_files_parallel, load_pcap_sharded, ORDER_BY_FILE, ORDER_BY_TIMESTAMP
+from .merge import merge_by_timestamp
+from .sniffing import format_suffix, sniff_format
 
 
-def get_dataset_reader(extension: str) -> DataSourceBase:
+def get_dataset_reader(extension: str, capture_filter: Optional[CaptureFilter] = None,
+                       streaming: bool = False) -> DataSourceBase:
+    """
+    :param streaming: the reader yields the samples one by one instead of returning a list (all readers but the
+        PcapReader always do)
+    """
     if extension.startswith('.'):
         extension = extension[1:]
     if extension in ['pcapng', 'pcap']:
-        return PcapReader()
+        return PcapReader(streaming=streaming, capture_filter=capture_filter, use_index=True)
     elif extension == 'csv':
-        return CsvReader()
+        return CsvReader(capture_filter)
+    elif extension == 'log':
+        return AccessLogReader(capture_filter)
+    elif extension == 'har':
+        return HarReader(capture_filter)
+    elif extension == 'parquet':
+        from .parquet_store import ParquetReader  # pyarrow is only required for Parquet files
+        return ParquetReader(capture_filter)
     else:
         raise NotImplementedError
 
 
-def load_samples_from_files(file_paths: List[Union[Path, str]], src_dir: str = '.') -> List:
+def get_file_reader(file_path: Path, capture_filter: Optional[CaptureFilter] = None,
+                    streaming: bool = False) -> DataSourceBase:
     """
-    Load all the samples from the given files. The kind of dataset is inferred by the extension of every file
-    :return: List of loaded HttpExchanges
+    Reader for the given file, which is chosen by the extension of the file (ignoring the one of a compression) or
+    by sniffing its content if the extension is unknown.
     """
+    try:
+        return get_dataset_reader(format_suffix(file_path), capture_filter, streaming)
+    except NotImplementedError:
+        detected = sniff_format(file_path)
+        if detected is None:
+            raise
+        return get_dataset_reader(detected, capture_filter, streaming)
+
+
+def load_samples_from_files(file_paths: List[Union[Path, str]], src_dir: str = '.', workers: Optional[int] = 1,
+                            order: str = ORDER_BY_FILE, capture_filter: Optional[CaptureFilter] = None,
+                            reorder_window: float = 0.) -> Union[List, Iterable]:
+    """
+    Load all the samples from the given files. The kind of dataset is inferred by the extension or the content of
+    every file, which may be compressed (gzip, bzip2 or xz)
+    :param capture_filter: only load the traffic matching this filter
+    :param workers: number of worker processes (one per CPU core if None). With more than one worker, the files are
+        loaded in parallel, or the connections are split across the workers if a single capture is loaded.
+    :param order: order of the samples, either ORDER_BY_FILE or ORDER_BY_TIMESTAMP. ORDER_BY_TIMESTAMP lazily merges
+        the samples of the files, which have to be ordered by time (e.g. multiple capture points or rotated files),
+        holding only the next sample of every file in memory.
+    :param reorder_window: samples of a file may be up to this many seconds out of order when merged lazily, e.g. as
+        exchanges of a capture are yielded once their response is complete
+    :return: List of loaded HttpExchanges, or a generator of them if loaded in parallel or merged
+    """
+    paths = [Path(src_dir) / p for p in file_paths]
+    if workers is None or workers > 1:
+        if len(paths) == 1 and isinstance(get_file_reader(paths[0]), PcapReader):
+            return load_pcap_sharded(paths[0], workers, capture_filter=capture_filter)
+        readers = [get_file_reader(p, capture_filter, streaming=True) for p in paths]
+        return load_files_parallel(paths, readers, workers, order, reorder_window)
+
+    if order == ORDER_BY_TIMESTAMP:
+        sources = [get_file_reader(p, capture_filter, streaming=True).load_samples(p) for p in paths]
+        return merge_by_timestamp(sources, reorder_window)
+
     samples = []
-    for p in file_paths:
-        samples += load_samples_from_file(Path(src_dir) / p)
+    for p in paths:
+        samples += load_samples_from_file(p, capture_filter)
     return samples
 
 
-def load_samples_from_file(file_path: Path) -> Generator:
+def load_samples_from_file(file_path: Path, capture_filter: Optional[CaptureFilter] = None) -> Generator:
     """
-    Load all the samples from the given `file_path`. The kind of dataset is inferred by the extension of the file
+    Load all the samples from the given `file_path`. The kind of dataset is inferred by the extension or the content
+    of the file
+    :param capture_filter: only load the traffic matching this filter
     :return: List of loaded HttpExchanges
     """
-    reader = get_dataset_reader(file_path.suffix)
-    return reader.load_samples(file_path)
\ No newline at end of file
+    reader = get_file_reader(file_path, capture_filter)
+    return reader.load_samples(file_path)
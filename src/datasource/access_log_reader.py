@@ -0,0 +1,186 @@
+import json
+import re
+from datetime import datetime
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterator, List, Optional, Union
+
+import dateutil.parser as date_parser
+
+from src.http_message.http_exchange import HttpExchange
+from .capture_filter import CaptureFilter
+from .sniffing import open_text
+
+# Access logs are written by the server itself, which is therefore the local host
+LOCAL_SERVER = '127.0.0.1'
+BLOCK_SIZE = 1 << 22  # characters parsed at once
+
+# Common/combined log format of nginx and Apache, optionally followed by the request time, which is given in seconds
+# by nginx ($request_time, with a fraction) or in microseconds by Apache (%D)
+_QUOTED = r'[^"\\]*(?:\\.[^"\\]*)*'  # content of a quoted field with escaped quotes (unrolled to avoid backtracking)
+COMBINED_PATTERN = re.compile(
+    r'^(?P<client>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<request>' + _QUOTED + r')" (?P<status>\d{3}) (?P<size>\d+|-)'
+    r'(?: "(?P<referer>' + _QUOTED + r')" "(?P<user_agent>' + _QUOTED + r')")?'
+    r'(?: (?P<latency>\d+(?:\.\d+)?))?[^\n]*', re.MULTILINE)
+_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+# alternative field names of JSON access logs (nginx `escape=json` log formats, Apache, log shippers)
+_JSON_FIELDS = {
+    'client': ('remote_addr', 'client_ip', 'clientip', 'remote_ip', 'client'),
+    'time': ('time_iso8601', 'time_local', '@timestamp', 'timestamp', 'time'),
+    'request': ('request', 'request_line'),
+    'method': ('request_method', 'method'),
+    'uri': ('request_uri', 'uri', 'path'),
+    'protocol': ('server_protocol', 'protocol'),
+    'status': ('status', 'status_code'),
+    'size': ('body_bytes_sent', 'bytes_sent', 'size'),
+    'latency': ('request_time', 'duration', 'latency'),
+    'referer': ('http_referer', 'referer', 'referrer'),
+    'user_agent': ('http_user_agent', 'user_agent', 'agent'),
+    'host': ('host', 'http_host', 'server_name'),
+    'server': ('server_addr', 'server_ip'),
+}
+
+
+def _unescape(value: str) -> str:
+    return value.replace('\\"', '"').replace('\\\\', '\\') if '\\' in value else value
+
+
+class AccessLogReader:
+    """
+    A reader for web server access logs in the combined log format or with one JSON object per line, which is detected
+    by the first line. Every line results in an exchange of the logged request without response; the status code and
+    size of the response are kept as `status_code` and `response_size` of the exchange and the request time as rtt.
+    The log is parsed in blocks of many lines, where a combined log is matched by a single precompiled pattern and a
+    JSON log is decoded as a single array per block.
+    """
+
+    def __init__(self, capture_filter: Optional[CaptureFilter] = None, server_ip: str = LOCAL_SERVER,
+                 block_size: int = BLOCK_SIZE):
+        self.capture_filter = capture_filter
+        self.server_ip = server_ip
+        self.block_size = block_size
+        self._timestamps: Dict[str, float] = {}
+        self._json_names: Dict[tuple, Dict[str, Optional[str]]] = {}
+
+    def load_samples(self, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
+        blocks = self._iter_blocks(path)
+        first = next(blocks, '')
+        records = self._iter_json if first.lstrip().startswith('{') else self._iter_combined
+        for fields in records(chain([first], blocks)):
+            exchange = self._to_exchange(fields)
+            if exchange is not None:
+                yield exchange
+
+    def _iter_blocks(self, path: Union[str, Path]) -> Iterator[str]:
+        """Blocks of complete lines"""
+        with open_text(path, errors='backslashreplace') as f:
+            rest = ''
+            while True:
+                data = f.read(self.block_size)
+                if not data:
+                    break
+                end = data.rfind('\n')
+                if end < 0:
+                    rest += data
+                    continue
+                yield rest + data[:end + 1]
+                rest = data[end + 1:]
+            if rest:
+                yield rest
+
+    def _iter_combined(self, blocks: Iterator[str]) -> Iterator[Dict[str, Any]]:
+        for block in blocks:
+            for m in COMBINED_PATTERN.finditer(block):
+                yield m.groupdict()
+
+    def _iter_json(self, blocks: Iterator[str]) -> Iterator[Dict[str, Any]]:
+        for block in blocks:
+            lines = list(filter(None, block.split('\n')))
+            try:
+                objects = json.loads('[' + ','.join(lines) + ']')
+            except json.JSONDecodeError:  # skip the malformed lines of this block
+                objects = []
+                for line in lines:
+                    try:
+                        objects.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass
+            for obj in objects:
+                if isinstance(obj, dict):
+                    yield self._normalize_json(obj)
+
+    def _normalize_json(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        keys = tuple(obj)
+        names = self._json_names.get(keys)
+        if names is None:  # the lines of a log share the same keys, so the lookup of the field names is cached
+            names = {field: next((n for n in candidates if n in obj), None)
+                     for field, candidates in _JSON_FIELDS.items()}
+            self._json_names[keys] = names
+        fields = {field: obj[name] if name is not None and obj[name] not in ('', '-') else None
+                  for field, name in names.items()}
+        if fields['request'] is None and fields['method'] is not None:
+            fields['request'] = f"{fields['method']} {fields['uri'] or '/'} {fields['protocol'] or 'HTTP/1.1'}"
+        return fields
+
+    def _timestamp(self, time: Union[str, int, float]) -> Optional[float]:
+        """
+        Timestamp of a logged time, which is either a date or seconds since the epoch (a JSON number or a string of
+        digits). Parsed times are cached, as the lines of a busy server share the same second.
+        :return: None if the time can't be parsed
+        """
+        if isinstance(time, (int, float)):
+            return float(time)
+        timestamp = self._timestamps.get(time)
+        if timestamp is None:
+            try:
+                if time.replace('.', '', 1).isdigit():
+                    timestamp = float(time)
+                else:
+                    try:
+                        timestamp = datetime.strptime(time, _TIME_FORMAT).timestamp()
+                    except ValueError:
+                        timestamp = date_parser.parse(time).timestamp()
+            except (ValueError, OverflowError):  # dateutil's ParserError is a ValueError
+                return None
+            if len(self._timestamps) > 1 << 16:
+                self._timestamps.clear()
+            self._timestamps[time] = timestamp
+        return timestamp
+
+    @staticmethod
+    def _latency(latency: Union[str, float, None]) -> float:
+        """
+        Request time in milliseconds, which is logged in seconds (fractional) or microseconds (integer), no matter
+        whether it is a string or a JSON number
+        """
+        if latency is None:
+            return -1.
+        if isinstance(latency, str):
+            return float(latency) * 1000 if '.' in latency else int(latency) / 1000
+        return latency / 1000 if float(latency).is_integer() else latency * 1000
+
+    def _to_exchange(self, fields: Dict[str, Any]) -> Optional[HttpExchange]:
+        if fields['time'] is None or fields['request'] is None:
+            return None
+        timestamp = self._timestamp(fields['time'])
+        if timestamp is None:  # skipped like malformed lines
+            return None
+        client = fields['client'] or ''
+        server = fields.get('server') or self.server_ip
+        if self.capture_filter is not None and not self.capture_filter.matches_exchange(client, server, timestamp):
+            return None
+
+        headers: List[str] = [_unescape(fields['request'])]
+        for name, field in (('Host', 'host'), ('Referer', 'referer'), ('User-Agent', 'user_agent')):
+            value = fields.get(field)
+            if value not in (None, '', '-'):
+                headers.append(f"{name}: {_unescape(value)}")
+        raw_request = ('\r\n'.join(headers) + '\r\n\r\n').encode('utf-8')
+
+        exchange = HttpExchange(client, server, timestamp, raw_request=raw_request, source='AccessLog',
+                                rtt=self._latency(fields['latency']))
+        exchange.status_code = int(fields['status']) if fields['status'] is not None else None
+        size = fields['size']
+        exchange.response_size = int(size) if size not in (None, '-') else None
+        return exchange
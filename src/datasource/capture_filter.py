@@ -0,0 +1,77 @@
+import ipaddress
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Union
+
+from .pcap_decoder import TcpSegment
+
+IpNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+@dataclass
+class CaptureFilter:
+    """
+    Selection of the traffic to load, which is applied to the frames/records before any HTTP parsing.
+    IPs may be given as single addresses or as CIDR networks. The source is the client of an exchange and the
+    destination the server; a frame matches in either direction. All given criteria have to match.
+    """
+    src_ips: Optional[List[str]] = None
+    dst_ips: Optional[List[str]] = None
+    ports: Optional[List[int]] = None  # client or server port
+    start_time: Optional[float] = None  # timestamps as seconds since the epoch (inclusive)
+    end_time: Optional[float] = None
+
+    _src_networks: Optional[List[IpNetwork]] = field(default=None, init=False, repr=False)
+    _dst_networks: Optional[List[IpNetwork]] = field(default=None, init=False, repr=False)
+    _src_matches: Dict[str, bool] = field(default_factory=dict, init=False, repr=False)
+    _dst_matches: Dict[str, bool] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self._src_networks = self._parse_networks(self.src_ips)
+        self._dst_networks = self._parse_networks(self.dst_ips)
+        if self.ports is not None:
+            self.ports = frozenset(self.ports)
+
+    @staticmethod
+    def _parse_networks(ips: Optional[List[str]]) -> Optional[List[IpNetwork]]:
+        if ips is None:
+            return None
+        return [ipaddress.ip_network(ip, strict=False) for ip in ips]
+
+    @staticmethod
+    def _matches_ip(ip: str, networks: Optional[List[IpNetwork]], cache: Dict[str, bool]) -> bool:
+        if networks is None:
+            return True
+        result = cache.get(ip)
+        if result is None:
+            try:
+                address = ipaddress.ip_address(ip)
+                result = any(address in n for n in networks)
+            except ValueError:  # e.g. a host name instead of an IP
+                result = False
+            cache[ip] = result
+        return result
+
+    @property
+    def filters_endpoints(self) -> bool:
+        return self.src_ips is not None or self.dst_ips is not None or self.ports is not None
+
+    def matches_time(self, timestamp: float) -> bool:
+        return (self.start_time is None or timestamp >= self.start_time) and \
+               (self.end_time is None or timestamp <= self.end_time)
+
+    def is_after(self, timestamp: float) -> bool:
+        return self.end_time is not None and timestamp > self.end_time
+
+    def matches_hosts(self, src_ip: str, dst_ip: str) -> bool:
+        return self._matches_ip(src_ip, self._src_networks, self._src_matches) and \
+               self._matches_ip(dst_ip, self._dst_networks, self._dst_matches)
+
+    def matches_segment(self, segment: TcpSegment) -> bool:
+        """Check the addresses and ports of a TCP segment sent in either direction"""
+        if self.ports is not None and segment.src_port not in self.ports and segment.dst_port not in self.ports:
+            return False
+        return self.matches_hosts(segment.src_ip, segment.dst_ip) or \
+            self.matches_hosts(segment.dst_ip, segment.src_ip)
+
+    def matches_exchange(self, src_ip: str, dst_ip: str, timestamp: float) -> bool:
+        return self.matches_time(timestamp) and self.matches_hosts(src_ip, dst_ip)
@@ -0,0 +1,87 @@
+from typing import List, Optional, Union
+
+MAX_LINE_LENGTH = 1 << 12  # upper bound for chunk size and trailer lines
+
+BytesLike = Union[bytes, bytearray]
+
+
+class ChunkedDecoder:
+    """
+    Incremental decoder for bodies with chunked transfer encoding
+    (see https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Transfer-Encoding#Directives).
+    Successive parts of the encoded body are passed to `feed`; the chunk data is copied once from a `memoryview` of
+    the part into `body`, which is a single `bytearray`. The state (remaining length of the current chunk, partial size
+    or trailer lines) is carried over between the parts, thus decoding takes linear time in the size of the body.
+    """
+    _SIZE, _DATA, _DATA_END, _TRAILER, _DONE = range(5)
+
+    def __init__(self):
+        self.body = bytearray()
+        self.trailers: List[bytes] = []  # header lines sent after the last chunk
+        self.error: Optional[str] = None
+        self._state = self._SIZE
+        self._remaining = 0  # bytes of the current chunk (or its terminating CRLF) still to be read
+        self._line = bytearray()  # part of a size or trailer line received so far
+
+    @property
+    def done(self) -> bool:
+        return self._state == self._DONE
+
+    def feed(self, data: BytesLike, start: int = 0) -> int:
+        """
+        Decode the bytes of `data` starting at `start`.
+        :return: the position after the last consumed byte; bytes after the end of the body are not consumed
+        """
+        view = memoryview(data)
+        end = len(data)
+        pos = start
+        try:
+            while pos < end and self._state != self._DONE:
+                if self._state == self._DATA:
+                    n = min(self._remaining, end - pos)
+                    self.body += view[pos:pos + n]
+                    pos += n
+                    self._remaining -= n
+                    if self._remaining == 0:
+                        self._state, self._remaining = self._DATA_END, 2
+                elif self._state == self._DATA_END:  # CRLF after the chunk data
+                    n = min(self._remaining, end - pos)
+                    pos += n
+                    self._remaining -= n
+                    if self._remaining == 0:
+                        self._state = self._SIZE
+                else:
+                    line_end = data.find(b'\n', pos, end)
+                    if line_end < 0:
+                        self._append_line(view[pos:end])
+                        pos = end
+                        break
+                    self._append_line(view[pos:line_end + 1])
+                    pos = line_end + 1
+                    line = bytes(self._line).rstrip(b'\r\n')
+                    self._line.clear()
+                    if self._state == self._SIZE:
+                        self._start_chunk(line)
+                    elif len(line) == 0:  # empty line terminates the trailer
+                        self._state = self._DONE
+                    else:
+                        self.trailers.append(line)
+        finally:
+            view.release()
+        return pos
+
+    def _append_line(self, part: memoryview) -> None:
+        if len(self._line) + len(part) > MAX_LINE_LENGTH:
+            raise ValueError(f"Line in chunked body exceeds {MAX_LINE_LENGTH} bytes")
+        self._line += part
+
+    def _start_chunk(self, line: bytes) -> None:
+        size_field = line.split(b';', 1)[0].strip()  # ignore chunk extensions
+        try:
+            size = int(size_field, 16)
+        except ValueError:
+            raise ValueError(f"'{size_field.decode('iso-8859-1')}' is not a valid chunk size")
+        if size == 0:
+            self._state = self._TRAILER
+        else:
+            self._state, self._remaining = self._DATA, size
@@ -1,26 +1,44 @@
+import binascii
+import io
 from pathlib import Path
-from typing import Union, Generator, Dict
+from typing import Union, Generator, Dict, Optional, Iterator, List
 
 # from DataWeaver.dataset_reader import BaseReader
 from .datasource_base import DataSourceBase
+from .capture_filter import CaptureFilter
+from .sniffing import open_text
 from src.http_message.http_exchange import HttpExchange
 import pandas as pd
 import dateutil.parser as date_parser
+from dateutil.tz import tzlocal
 import re
 import math
 import csv
 
+DEFAULT_CHUNK_SIZE = 10000  # rows parsed at once when reading CSV files in chunks
+
+# The C parser of pandas cuts cells at NUL bytes, hence they are replaced by a character of the private use area while
+# reading and restored afterwards
+_NUL = '\x00'
+_NUL_SENTINEL = '\ue000'
+
+_DELAY_PATTERN = r'(?:(\d+)s\s)?(\d+)ms'
+
 
 class CsvReader:
+	def __init__(self, capture_filter: Optional[CaptureFilter] = None, chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE):
+		self.capture_filter = capture_filter
+		self.chunk_size = chunk_size
+
 	def load_samples(self, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
-		with open(path, 'r') as f:
+		with open_text(path) as f:
 			column_name_line = f.readline()
 			column_names = set([c.strip() for c in column_name_line.split(',')])
 		if all(c in column_names for c in BurpLogReader.column_names):
 			# TODO use intersection of most important columns as order of columns can change in burp
-			return BurpLogReader.load_samples(path)
-		elif all(c in column_names for c in BurpLogReader.column_names):
-			return ProcessedCsvReader.load_samples(path)
+			return BurpLogReader.load_samples(path, self.capture_filter, self.chunk_size)
+		elif all(c in column_names for c in ProcessedCsvReader.column_names):
+			return ProcessedCsvReader.load_samples(path, self.capture_filter, self.chunk_size)
 		else:
 			# print('Columns: ' + column_name_line + 'not in ')
 			# df = pd.read_csv(path)  # TODO fix bug when reading cells containing null-bytes
@@ -40,6 +58,53 @@ def _read_csv(path: Path) -> Generator[Dict[str, str], None, None]:
 			yield dict(line)
 
 
+class _NulEscapingFile(io.TextIOBase):
+	"""Text file, which replaces NUL characters by `_NUL_SENTINEL` while reading"""
+	
+	def __init__(self, f: io.TextIOBase):
+		self._f = f
+	
+	def readable(self) -> bool:
+		return True
+	
+	def read(self, size: Optional[int] = -1) -> str:
+		return self._f.read(size).replace(_NUL, _NUL_SENTINEL)
+	
+	def readline(self, size: Optional[int] = -1) -> str:
+		return self._f.readline(size).replace(_NUL, _NUL_SENTINEL)
+
+
+def read_csv_chunks(path: Union[str, Path], chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+					**kwargs) -> Iterator[pd.DataFrame]:
+	"""
+	Read a (compressed) CSV file, which may contain NUL bytes in its cells, in chunks of `chunk_size` rows.
+	NUL characters are escaped as `_NUL_SENTINEL`, see `restore_nul`.
+	:param chunk_size: number of rows per chunk; the whole file is read as a single chunk if None
+	"""
+	with open_text(path, newline='') as f:
+		chunks = pd.read_csv(_NulEscapingFile(f), chunksize=chunk_size, **kwargs)
+		if chunk_size is None:
+			yield chunks
+		else:
+			with chunks:
+				yield from chunks
+
+
+def restore_nul(column: pd.Series) -> pd.Series:
+	"""Undo the escaping of NUL characters done by `read_csv_chunks` for a column of strings"""
+	return column.str.replace(_NUL_SENTINEL, _NUL, regex=False)
+
+
+def _select(capture_filter: CaptureFilter, timestamps: pd.Series, src_ips: pd.Series, dst_ips: pd.Series) -> pd.Series:
+	"""Boolean mask of the rows matching the capture filter"""
+	start, end = capture_filter.start_time, capture_filter.end_time
+	selected = timestamps.between(-math.inf if start is None else start, math.inf if end is None else end)
+	if capture_filter.filters_endpoints:
+		hosts = pd.Series(list(zip(src_ips.astype(str), dst_ips.astype(str))), index=src_ips.index)
+		selected &= hosts.map(lambda h: capture_filter.matches_hosts(*h))
+	return selected
+
+
 class BurpLogReader:
 	"""A reader for responses and requests stored in a full csv export of the Burps Logger++ plugin"""
 	column_names = ["Number", "Complete", "Tool", "Host", "Method", 'Path', "Query", "Params", "Status",
@@ -51,17 +116,38 @@ class BurpLogReader:
 	def _burp_time_str_to_timestamp(time_str: str) -> float:
 		dt = date_parser.parse(time_str)
 		return dt.timestamp()
-
+	
+	@classmethod
+	def _burp_times_to_timestamps(cls, times: pd.Series) -> pd.Series:
+		"""Vectorized version of `_burp_time_str_to_timestamp`, where times without time zone are in local time"""
+		dt = pd.to_datetime(times, errors='coerce')
+		if dt.dt.tz is None:
+			dt = dt.dt.tz_localize(tzlocal(), ambiguous='NaT', nonexistent='shift_forward')
+		timestamps = (dt - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+		invalid = timestamps.isna()
+		if invalid.any():  # e.g. mixed formats, which are not inferred by pandas
+			timestamps[invalid] = times[invalid].map(cls._burp_time_str_to_timestamp)
+		return timestamps
+	
 	@staticmethod
 	def _parse_delay_string(delay: Union[str, float]) -> float:
 		if isinstance(delay, float):
 			return -1. if math.isnan(delay) else delay
 		else:
-			pattern = r'(?:(\d+)s\s)?(\d+)ms'
-			m = re.search(pattern, delay)
+			m = re.search(_DELAY_PATTERN, delay)
 			sec, ms = m.groups()
-			return (int(sec) * 60 if sec else 0) + int(ms)
-
+			return (int(sec) * 1000 if sec else 0) + int(ms)
+	
+	@staticmethod
+	def _parse_delay_strings(delays: pd.Series) -> pd.Series:
+		"""Vectorized version of `_parse_delay_string`, returns the delays in milliseconds or -1 if missing"""
+		if pd.api.types.is_numeric_dtype(delays):  # only numbers or missing values
+			return delays.astype(float).fillna(-1.)
+		parts = delays.astype(str).str.extract(_DELAY_PATTERN).astype(float)
+		rtt = parts[0].fillna(0.) * 1000 + parts[1]
+		numeric = pd.to_numeric(delays, errors='coerce')
+		return rtt.fillna(numeric).fillna(-1.)
+	
 	@staticmethod
 	def _fix_http_message(msg: Union[bytes, str]) -> bytes:
 		"""Workaround for CSV reader, which converts \r\n line delimeters to \n resulting in malformed requests"""
@@ -71,31 +157,93 @@ class BurpLogReader:
 		else:
 			# msg = msg.replace('\n', '\r\n')
 			return msg.encode('utf-8')
-
+	
 	@classmethod
-	def load_samples(cls, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
-		# rows = _read_csv(path)
-		df = pd.read_csv(path)  # TODO fix bug when reading cells containing null-bytes
-
-		for index, row in df.iterrows():
-			req_time = cls._burp_time_str_to_timestamp(row['RequestTime'])
+	def load_samples(cls, path: Union[str, Path], capture_filter: Optional[CaptureFilter] = None,
+					 chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE) -> Generator[HttpExchange, None, None]:
+		"""
+		Read the export in chunks of `chunk_size` rows and yield the exchanges of every chunk. Times, delays and the
+		capture filter are evaluated once per chunk on the whole columns.
+		"""
+		columns = ['Tool', 'Host', 'RequestTime', 'ResponseDelay', 'Request', 'Response']
+		for chunk in read_csv_chunks(path, chunk_size, usecols=columns):
+			req_times = cls._burp_times_to_timestamps(chunk['RequestTime'])
+			if capture_filter is not None:
+				# Burp only logs the host, which is used as source and destination of the exchange
+				selected = _select(capture_filter, req_times, chunk['Host'], chunk['Host'])
+				chunk, req_times = chunk[selected], req_times[selected]
+				if len(chunk) == 0:
+					continue
 			# delay is more precise than calculating difference between request and response
-			rtt = cls._parse_delay_string(row['ResponseDelay'])
-			res_entry = row['Response']
-			response = cls._fix_http_message(res_entry) if isinstance(res_entry, str) else None
-			exchange = HttpExchange(row['Host'], row['Host'], req_time,
-									raw_request=cls._fix_http_message(row['Request']),
-									raw_response=response,
-									note=row['RequestTime'],
-									rtt=rtt, source='BurpLog')
-			exchange.tags = ['from_extension' if row['Tool'] == 'Extender' else '']
-			yield exchange
+			rtts = cls._parse_delay_strings(chunk['ResponseDelay'])
+			requests = restore_nul(chunk['Request'].astype(str))
+			has_response = chunk['Response'].notna()
+			responses = restore_nul(chunk['Response'].where(has_response, '').astype(str))
+			from_extension = chunk['Tool'] == 'Extender'
+			for host, req_time, note, rtt, request, response, responded, extender in zip(
+					chunk['Host'], req_times, chunk['RequestTime'], rtts, requests, responses, has_response,
+					from_extension):
+				exchange = HttpExchange(host, host, req_time,
+										raw_request=cls._fix_http_message(request),
+										raw_response=cls._fix_http_message(response) if responded else None,
+										note=note,
+										rtt=rtt, source='BurpLog')
+				exchange.tags = ['from_extension' if extender else '']
+				yield exchange
 
 
 class ProcessedCsvReader(DataSourceBase):
+	"""
+	A reader for exchanges exported with `HttpExchange.to_csv_entry`, which allows reloading a (labeled) corpus
+	without parsing the original captures again. The base64 encoded messages of a chunk are decoded at once.
+	"""
 	column_names = ['source_ip', 'destination_ip', 'request_ts', 'response_ts',
 					'request_b64', 'response_b64', 'source', 'note', 'tags', 'label']
-
+	optional_column_names = ['status_code', 'response_size']  # missing in files written by earlier versions
+	
+	@staticmethod
+	def _decode_base64(column: pd.Series) -> List[Optional[bytes]]:
+		"""
+		Decode a column of base64 strings with a single call, empty cells are returned as None.
+		Decoding stops at padding, hence every value is padded with zero bits instead, which are cut off again.
+		"""
+		values = column.str.removeprefix("b'").str.removesuffix("'").str.rstrip('=')  # bytes written as repr
+		lengths = values.str.len().tolist()
+		data = binascii.a2b_base64(''.join(v + 'A' * (-n % 4) for v, n in zip(values, lengths)))
+		decoded = []
+		start = 0
+		for n in lengths:
+			decoded.append(data[start:start + n * 3 // 4] if n > 0 else None)
+			start += (n + 3) // 4 * 3
+		return decoded
+	
 	@classmethod
-	def load_samples(cls, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
-		pass
+	def load_samples(cls, path: Union[str, Path], capture_filter: Optional[CaptureFilter] = None,
+					 chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE) -> Generator[HttpExchange, None, None]:
+		columns = set(cls.column_names + cls.optional_column_names)
+		for chunk in read_csv_chunks(path, chunk_size, usecols=lambda c: c in columns, dtype=str,
+									 keep_default_na=False):
+			req_times = pd.to_numeric(chunk['request_ts'], errors='coerce').fillna(0.)
+			if capture_filter is not None:
+				selected = _select(capture_filter, req_times, chunk['source_ip'], chunk['destination_ip'])
+				chunk, req_times = chunk[selected], req_times[selected]
+				if len(chunk) == 0:
+					continue
+			res_times = pd.to_numeric(chunk['response_ts'], errors='coerce')
+			requests = cls._decode_base64(chunk['request_b64'])
+			responses = cls._decode_base64(chunk['response_b64'])
+			notes = restore_nul(chunk['note'])
+			status_codes, response_sizes = (pd.to_numeric(chunk[c], errors='coerce').astype('Int64').tolist()
+											if c in chunk else [None] * len(chunk) for c in cls.optional_column_names)
+			for src_ip, dst_ip, req_time, res_time, request, response, status_code, response_size, source, note, tags, \
+					label in zip(chunk['source_ip'], chunk['destination_ip'], req_times, res_times, requests, responses,
+								 status_codes, response_sizes, chunk['source'], notes, chunk['tags'], chunk['label']):
+				exchange = HttpExchange(src_ip, dst_ip, req_time, raw_request=request or b'', source=source, note=note)
+				if response is not None:
+					exchange.set_raw_response(response, req_time if math.isnan(res_time) else res_time)
+				else:
+					exchange.status_code = status_code if status_code is not pd.NA else None
+					exchange.response_size = response_size if response_size is not pd.NA else None
+				exchange.tags = tags.split(';') if tags else []
+				exchange.label = label
+				yield exchange
@@ -0,0 +1,56 @@
+import time
+from pathlib import Path
+from typing import Optional, BinaryIO, Iterable
+
+CAPTURE_SUFFIXES = ('.pcap', '.pcapng')
+
+
+def next_rotated_file(current: Path, suffixes: Iterable[str] = CAPTURE_SUFFIXES) -> Optional[Path]:
+    """
+    Find the file which follows `current` in its directory. Rotated captures are expected to have names which sort
+    chronologically, e.g. as created by `tcpdump -G <seconds> -w 'capture-%Y%m%d%H%M%S.pcap'`.
+    """
+    candidates = [p for p in current.parent.iterdir() if p.suffix in suffixes and p.name > current.name]
+    return min(candidates, key=lambda p: p.name) if candidates else None
+
+
+def latest_file(directory: Path, suffixes: Iterable[str] = CAPTURE_SUFFIXES) -> Optional[Path]:
+    candidates = [p for p in directory.iterdir() if p.suffix in suffixes]
+    return max(candidates, key=lambda p: p.name) if candidates else None
+
+
+class FollowedFile:
+    """
+    Read-only binary file, which waits for appended data instead of reporting the end of the file.
+    The end of the file is only reported once the file has been rotated, i.e. a newer file showed up in the same
+    directory, or if no data was appended for `stop_after` seconds.
+    """
+
+    def __init__(self, path: Path, poll_interval: float = 1., stop_after: Optional[float] = None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.stop_after = stop_after
+        self.rotated_to: Optional[Path] = None
+        self._f: BinaryIO = open(path, 'rb')
+
+    def read(self, size: int = -1) -> bytes:
+        idle_since = time.monotonic()
+        while True:
+            data = self._f.read(size)
+            if data:
+                return data
+            self.rotated_to = next_rotated_file(self.path)
+            if self.rotated_to is not None:
+                return self._f.read(size)  # bytes written before the capture switched to the next file
+            if self.stop_after is not None and time.monotonic() - idle_since >= self.stop_after:
+                return b''
+            time.sleep(self.poll_interval)
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,182 @@
+import base64
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional, TextIO, Union
+from urllib.parse import urlsplit
+
+import dateutil.parser as date_parser
+
+from src.http_message.http_exchange import HttpExchange
+from .capture_filter import CaptureFilter
+from .sniffing import open_text
+
+# A HAR file is recorded by the client itself, which is therefore the local host
+LOCAL_CLIENT = '127.0.0.1'
+# HTTP/2 and HTTP/3 messages are represented as HTTP/1.1 messages, as only those can be parsed
+PARSED_VERSION = 'HTTP/1.1'
+
+_WHITESPACE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+
+class _JsonStream:
+    """
+    Incremental access to a JSON document, which is read in chunks. Only the value at the current position has to fit
+    into the buffer, which is released once the value has been decoded.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._eof = False
+        self.buf = ''
+        self.pos = 0
+
+    def _read(self, size: int) -> bool:
+        data = self._f.read(size)
+        if not data:
+            self._eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character after any whitespace or '' at the end of the document"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read(self._chunk_size):
+                return ''
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid HAR file: expected '{char}' but found '{found}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the value at the current position, more data is read until the value is complete"""
+        size = self._chunk_size
+        while True:
+            self.peek()
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self._eof:  # a number could continue in the next chunk
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read(size)
+            size *= 2  # reading in growing steps keeps the decoding attempts of large values linear
+
+
+def _iter_array(stream: _JsonStream, keys: List[str]) -> Generator[Any, None, None]:
+    """Yield the elements of the array at the path `keys` within the object at the current position"""
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == keys[0]:
+            if len(keys) > 1:
+                yield from _iter_array(stream, keys[1:])
+                return
+            stream.expect('[')
+            if stream.peek() == ']':
+                return
+            while True:
+                yield stream.value()
+                if stream.peek() != ',':
+                    stream.expect(']')
+                    return
+                stream.pos += 1
+        stream.value()  # skip any other member
+        if stream.peek() != ',':
+            stream.expect('}')
+            return
+        stream.pos += 1
+
+
+class HarReader:
+    """
+    A reader for HAR (HTTP Archive) files exported by browsers and proxies
+    (see http://www.softwareishard.com/blog/har-12-spec/).
+    The JSON document is parsed incrementally, thus only a single entry is held in memory at a time, and an exchange
+    is yielded for every entry. The timestamp is the start of the request and the rtt is the time spent on sending
+    the request, waiting for and receiving the response.
+    """
+
+    def __init__(self, capture_filter: Optional[CaptureFilter] = None, chunk_size: int = 1 << 16):
+        self.capture_filter = capture_filter
+        self.chunk_size = chunk_size
+
+    def load_samples(self, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
+        with open_text(path, encoding='utf-8-sig') as f:
+            for entry in _iter_array(_JsonStream(f, self.chunk_size), ['log', 'entries']):
+                exchange = self._to_exchange(entry)
+                if exchange is not None:
+                    yield exchange
+
+    def _to_exchange(self, entry: Dict[str, Any]) -> Optional[HttpExchange]:
+        request, response = entry['request'], entry.get('response') or {}
+        url = urlsplit(request['url'])
+        dst_ip = entry.get('serverIPAddress') or url.hostname or ''
+        timestamp = date_parser.isoparse(entry['startedDateTime']).timestamp()
+        if self.capture_filter is not None and \
+                not self.capture_filter.matches_exchange(LOCAL_CLIENT, dst_ip.strip('[]'), timestamp):
+            return None
+
+        target = url.path or '/'
+        if url.query:
+            target += '?' + url.query
+        headers = self._headers(request, [('Host', url.netloc)])
+        body = self._text((request.get('postData') or {}).get('text'))
+        raw_request = self._message(f"{request['method']} {target} {PARSED_VERSION}", headers, body)
+
+        raw_response = None
+        if response.get('status', 0) > 0:  # status 0 if the request failed or was blocked
+            content = response.get('content') or {}
+            body = self._text(content.get('text'), content.get('encoding'))
+            status_line = f"{PARSED_VERSION} {response['status']} {response.get('statusText', '')}"
+            raw_response = self._message(status_line, self._headers(response), body)
+
+        exchange = HttpExchange(LOCAL_CLIENT, dst_ip.strip('[]'), timestamp, raw_request=raw_request, source='HAR',
+                                note=entry.get('comment', ''), raw_response=raw_response, rtt=self._rtt(entry))
+        version = request.get('httpVersion', '')
+        if version and version.upper() not in ('HTTP/1.1', 'HTTP/1.0'):
+            exchange.tags.append(version)  # keep the original version, e.g. 'h2' or 'HTTP/2.0'
+        return exchange
+
+    @staticmethod
+    def _headers(message: Dict[str, Any], defaults: Optional[List] = None) -> List:
+        """Headers of the message without HTTP/2 pseudo-headers, where missing defaults are added in front"""
+        headers = [(h['name'], h['value']) for h in message.get('headers', []) if not h['name'].startswith(':')]
+        names = {name.lower() for name, _ in headers}
+        return [d for d in defaults or [] if d[0].lower() not in names] + headers
+
+    @staticmethod
+    def _text(text: Optional[str], encoding: Optional[str] = None) -> bytes:
+        if not text:
+            return b''
+        if encoding == 'base64':
+            return base64.b64decode(text)
+        return text.encode('utf-8')
+
+    @staticmethod
+    def _message(start_line: str, headers: List, body: bytes) -> bytes:
+        head = '\r\n'.join([start_line] + [f"{name}: {value}" for name, value in headers])
+        return head.encode('utf-8') + b'\r\n\r\n' + body
+
+    @staticmethod
+    def _rtt(entry: Dict[str, Any]) -> float:
+        """Time in milliseconds from sending the request until the response is received; -1 denotes a missing timing"""
+        timings = entry.get('timings') or {}
+        parts = [timings.get(t, -1) for t in ('send', 'wait', 'receive')]
+        if all(p is None or p < 0 for p in parts):
+            return float(entry.get('time', -1))
+        return float(sum(p for p in parts if p is not None and p > 0))
@@ -0,0 +1,142 @@
+import re
+from collections import deque
+from typing import NamedTuple, List, Optional, Deque, Union
+
+from src.http_message.http_request import HTTP_METHODS
+from .chunked_decoder import ChunkedDecoder
+
+HEADER_END = b'\r\n\r\n'
+MAX_HEAD_SIZE = 1 << 16  # a message head which is not completed within this size is treated as garbage
+
+_REQUEST_STARTS = tuple(m.encode('ascii') + b' ' for m in HTTP_METHODS)
+_RESPONSE_START = b'HTTP/'
+_CONTENT_LENGTH = re.compile(rb'\r\ncontent-length[ \t]*:[ \t]*(\d+)', re.IGNORECASE)
+_CHUNKED = re.compile(rb'\r\ntransfer-encoding[ \t]*:[^\r\n]*chunked', re.IGNORECASE)
+_STATUS_CODE = re.compile(rb'HTTP/\d\.\d (\d{3})')
+
+
+class HttpStreamMessage(NamedTuple):
+    raw: bytes  # message as sent over the wire
+    head_len: int  # length of the start line and headers including the terminating empty line
+    body: Union[bytes, bytearray]  # body with removed transfer encoding
+    timestamp: float  # time of the first byte of the message
+    complete: bool = True
+
+    @property
+    def head(self) -> bytes:
+        return self.raw[:self.head_len]
+
+
+class HttpStreamParser:
+    """
+    Split the byte stream of one direction of a TCP connection into HTTP messages.
+    The stream has to be fed in order; the message boundaries are derived from the Content-Length and
+    Transfer-Encoding headers. For the response direction, the methods of the requests sent on the connection
+    have to be appended to `request_methods`, since responses to HEAD requests never have a body.
+    """
+    _HEAD, _BODY, _CHUNKED, _UNTIL_CLOSE = range(4)
+
+    def __init__(self, is_request: bool):
+        self.is_request = is_request
+        self._buf = bytearray()
+        self._state = self._HEAD
+        self._pos = 0  # parse position within the current message
+        self._head_len = 0
+        self._body_end = 0  # end of a body with known length
+        self._chunks: Optional[ChunkedDecoder] = None
+        self._timestamp = 0.
+        self.request_methods: Deque[bytes] = deque()
+
+    def feed(self, data: bytes, timestamp: float) -> List[HttpStreamMessage]:
+        """Append the next bytes of the stream and return all messages completed by them"""
+        if not self._buf:
+            self._timestamp = timestamp
+        self._buf += data
+        messages = []
+        while True:
+            message = self._parse_next()
+            if message is None:
+                break
+            messages.append(message)
+            if self._buf:
+                self._timestamp = timestamp
+        return messages
+
+    def close(self) -> Optional[HttpStreamMessage]:
+        """End of the stream: return the message still being read (if any)"""
+        if self._state == self._HEAD or not self._buf:
+            return None
+        return self._emit(len(self._buf), complete=self._state == self._UNTIL_CLOSE)
+
+    def _parse_next(self) -> Optional[HttpStreamMessage]:
+        buf = self._buf
+        if self._state == self._HEAD:
+            if not self._sync():
+                return None
+            head_end = buf.find(HEADER_END)
+            if head_end < 0:
+                if len(buf) > MAX_HEAD_SIZE:
+                    buf.clear()
+                return None
+            self._head_len = self._pos = head_end + len(HEADER_END)
+            head = bytes(buf[:self._head_len])
+            if not self.is_request and not self._response_has_body(head):
+                return self._emit(self._pos)
+            if _CHUNKED.search(head):
+                self._state, self._chunks = self._CHUNKED, ChunkedDecoder()
+            else:
+                m = _CONTENT_LENGTH.search(head)
+                if m is not None:
+                    self._state, self._body_end = self._BODY, self._head_len + int(m.group(1))
+                elif self.is_request:
+                    return self._emit(self._pos)
+                else:
+                    self._state = self._UNTIL_CLOSE
+
+        if self._state == self._BODY:
+            return self._emit(self._body_end) if len(buf) >= self._body_end else None
+        elif self._state == self._CHUNKED:
+            try:
+                self._pos = self._chunks.feed(buf, self._pos)
+            except ValueError:  # not a valid chunk -> take everything received as the body
+                return self._emit(len(buf), complete=False)
+            return self._emit(self._pos) if self._chunks.done else None
+        return None  # _UNTIL_CLOSE
+
+    def _sync(self) -> bool:
+        """Skip leading bytes which can not be the start of a message"""
+        buf = self._buf
+        starts = _REQUEST_STARTS if self.is_request else (_RESPONSE_START,)
+        if buf.startswith(starts):
+            return True
+        if len(buf) < 8 and any(s.startswith(bytes(buf)) for s in starts):
+            return False  # wait for more data
+        candidates = [i for i in (buf.find(s) for s in starts) if i >= 0]
+        if not candidates:
+            del buf[:max(0, len(buf) - 8)]
+            return False
+        del buf[:min(candidates)]
+        return True
+
+    def _response_has_body(self, head: bytes) -> bool:
+        m = _STATUS_CODE.match(head)
+        status = int(m.group(1)) if m is not None else 0
+        if 100 <= status < 200:  # interim response, the final response to the request is still to come
+            return False
+        method = self.request_methods.popleft() if self.request_methods else None
+        if method == b'HEAD' or (method == b'CONNECT' and 200 <= status < 300):
+            return False
+        return status not in (204, 304)
+
+    def _emit(self, end: int, complete: bool = True) -> HttpStreamMessage:
+        end = min(end, len(self._buf))
+        with memoryview(self._buf) as view:
+            raw = bytes(view[:end])
+        if self._state == self._CHUNKED:
+            body = self._chunks.body
+        else:
+            body = raw[self._head_len:end]
+        message = HttpStreamMessage(raw, self._head_len, body, self._timestamp, complete)
+        del self._buf[:end]
+        self._state, self._chunks = self._HEAD, None
+        return message
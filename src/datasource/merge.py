@@ -0,0 +1,34 @@
+import heapq
+from operator import attrgetter
+from typing import Generator, Iterable, List, Tuple
+
+from src.http_message.http_exchange import HttpExchange
+
+by_timestamp = attrgetter('timestamp')
+
+
+def _reorder(source: Iterable[HttpExchange], window: float) -> Generator[HttpExchange, None, None]:
+    """
+    Sort a source, whose exchanges are delayed by at most `window` seconds, e.g. as exchanges of a capture are yielded
+    once their response is complete. Only the exchanges of the last `window` seconds are buffered.
+    """
+    pending: List[Tuple[float, int, HttpExchange]] = []
+    for i, exchange in enumerate(source):
+        heapq.heappush(pending, (exchange.timestamp, i, exchange))
+        while pending[0][0] < exchange.timestamp - window:
+            yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def merge_by_timestamp(sources: Iterable[Iterable[HttpExchange]], reorder_window: float = 0.) \
+        -> Generator[HttpExchange, None, None]:
+    """
+    Lazily merge the exchanges of multiple sources into a single stream ordered by timestamp. The exchanges of every
+    source have to be in order, so only the next exchange of each source is held in memory.
+    :param sources: e.g. the generators of the samples of multiple files
+    :param reorder_window: if greater than zero, every source is sorted within this many seconds before merging
+    """
+    if reorder_window > 0:
+        sources = [_reorder(source, reorder_window) for source in sources]
+    yield from heapq.merge(*sources, key=by_timestamp)
@@ -0,0 +1,122 @@
+import os
+import pickle
+import struct
+import tempfile
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import List, Generator, Optional
+
+from src.http_message.http_exchange import HttpExchange
+from .capture_filter import CaptureFilter
+from .datasource_base import DataSourceBase
+from .merge import merge_by_timestamp
+from .pcap_index import index_path, try_build_index
+from .pcap_reader import PcapReader
+from .sniffing import is_compressed
+
+ORDER_BY_FILE = 'file'
+ORDER_BY_TIMESTAMP = 'timestamp'
+CHUNK_SIZE = 1000  # samples pickled at once by a worker
+CAPTURE_REORDER_WINDOW = 120.  # exchanges of a capture are yielded at most the idle timeout of the reader late
+POLL_INTERVAL = 0.05
+
+# The workers don't return the samples of a file at once, but append them in chunks to a spool file, from which the
+# main process reads them while the file is still being loaded. Unlike a bounded queue, the spool file never blocks a
+# worker, so merging by timestamp can't dead-lock if there are more files than workers, and the samples waiting to be
+# consumed are kept on disk instead of in memory. Every chunk is stored as its length followed by the pickled list.
+_CHUNK_HEADER = struct.Struct('<Q')
+
+
+def _spool(reader: DataSourceBase, file_path: Path, spool_path: Path) -> None:
+    """Entry point of the worker processes"""
+    samples = iter(reader.load_samples(file_path))
+    with open(spool_path, 'ab') as f:
+        while True:
+            chunk = list(islice(samples, CHUNK_SIZE))
+            if not chunk:
+                break
+            data = pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+            f.write(_CHUNK_HEADER.pack(len(data)) + data)
+            f.flush()
+
+
+def _read_spool(spool_path: Path, future: Future) -> Generator[HttpExchange, None, None]:
+    """Yield the samples of a spool file as they are appended, until its worker has finished"""
+    with open(spool_path, 'rb') as f:
+        pos = 0
+        while True:
+            finished = future.done()  # checked before reading, so no chunk written before finishing is missed
+            f.seek(pos)
+            header = f.read(_CHUNK_HEADER.size)
+            if len(header) == _CHUNK_HEADER.size:
+                size = _CHUNK_HEADER.unpack(header)[0]
+                data = f.read(size)
+                if len(data) == size:
+                    pos = f.tell()
+                    yield from pickle.loads(data)
+                    continue
+            if finished:
+                future.result()  # raises the exception of the worker
+                return
+            time.sleep(POLL_INTERVAL)
+
+
+def resolve_workers(workers: Optional[int]) -> int:
+    """Number of worker processes to use, where `None` means one process per CPU core"""
+    return max(1, os.cpu_count() or 1) if workers is None else max(1, workers)
+
+
+def load_files_parallel(file_paths: List[Path], readers: List[DataSourceBase], workers: Optional[int] = None,
+                        order: str = ORDER_BY_FILE, reorder_window: float = 0.) \
+        -> Generator[HttpExchange, None, None]:
+    """
+    Load every file in a separate worker process. The samples are streamed from the workers in chunks, so they are
+    yielded while the files are still being loaded.
+    :param file_paths: files to load
+    :param readers: the reader for each of the files
+    :param workers: number of worker processes (one per CPU core if None)
+    :param order: ORDER_BY_FILE yields the samples file after file in the given order of files; ORDER_BY_TIMESTAMP
+        lazily merges the samples of the files by their timestamp (see `merge_by_timestamp`)
+    :param reorder_window: samples of a file may be up to this many seconds out of order when merged by timestamp
+    :return: generator of the loaded HttpExchanges
+    """
+    if order not in (ORDER_BY_FILE, ORDER_BY_TIMESTAMP):
+        raise ValueError(f"'{order}' is not a valid order!")
+    with tempfile.TemporaryDirectory(prefix='spool-') as spool_dir:
+        pool = ProcessPoolExecutor(max_workers=resolve_workers(workers))
+        try:
+            sources = []
+            for i, (reader, file_path) in enumerate(zip(readers, file_paths)):
+                spool_path = Path(spool_dir) / f'{i}.spool'
+                spool_path.touch()
+                sources.append(_read_spool(spool_path, pool.submit(_spool, reader, file_path, spool_path)))
+            if order == ORDER_BY_TIMESTAMP:
+                yield from merge_by_timestamp(sources, reorder_window)
+            else:
+                for source in sources:
+                    yield from source
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+def load_pcap_sharded(file_path: Path, workers: Optional[int] = None, backend: str = 'native',
+                      capture_filter: Optional[CaptureFilter] = None,
+                      reorder_window: float = CAPTURE_REORDER_WINDOW) -> Generator[HttpExchange, None, None]:
+    """
+    Split the processing of a single capture across worker processes. With the native backend the capture is indexed
+    first and every worker only decodes the byte range of the TCP connections starting in its share of the capture
+    (see `PcapIndex.shard`). Compressed captures, captures which can't be indexed and the scapy backend fall back to
+    sharding by flow hash, where every worker reads the whole file, but only reassembles and parses the connections of
+    its share of the hashes.
+    :param reorder_window: see `load_files_parallel`
+    :return: generator of all HttpExchanges of the capture sorted by their timestamp
+    """
+    workers = resolve_workers(workers)
+    use_index = backend == 'native' and not is_compressed(file_path)
+    if use_index:  # once, before the workers read it, which would otherwise index the capture each on its own
+        use_index = try_build_index(file_path) is not None and index_path(file_path).is_file()
+    readers = [PcapReader(backend=backend, shard=(i, workers), capture_filter=capture_filter, use_index=use_index)
+               for i in range(workers)]
+    return load_files_parallel([file_path] * workers, readers, workers, ORDER_BY_TIMESTAMP, reorder_window)
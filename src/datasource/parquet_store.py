@@ -0,0 +1,235 @@
+import ipaddress
+from pathlib import Path
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Union, Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.http_message.http_exchange import HttpExchange
+from .capture_filter import CaptureFilter
+
+# Columnar storage of HTTP exchanges in Parquet files.
+# IPs are stored as 16 byte binaries (IPv4 addresses mapped to IPv6), thus a network corresponds to a range of values,
+# which can be pushed down to the row groups just like time ranges. Host names (e.g. logged by Burp) are kept in the
+# host columns instead. Method, source and status code are dictionary encoded and read as categoricals.
+
+ROW_GROUP_SIZE = 64 * 1024
+FeatureFunction = Callable[[HttpExchange], Dict[str, Any]]
+
+_IP = pa.binary(16)
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ('source_ip', _IP),
+    ('destination_ip', _IP),
+    ('source_host', pa.string()),  # only set if the source is not an IP
+    ('destination_host', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('rtt', pa.float64()),
+    ('method', _CATEGORY),
+    ('path', pa.string()),
+    ('version', _CATEGORY),
+    ('status_code', pa.dictionary(pa.int32(), pa.int16())),
+    ('response_size', pa.int64()),
+    ('source', _CATEGORY),
+    ('note', pa.string()),
+    ('tags', pa.list_(pa.string())),
+    ('label', _CATEGORY),
+    ('raw_request', pa.large_binary()),
+    ('raw_response', pa.large_binary()),
+])
+IP_COLUMNS = {'source_ip': 'source_host', 'destination_ip': 'destination_host'}
+
+
+def pack_ip(ip: str) -> Optional[bytes]:
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:  # e.g. host names logged by Burp
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b'\x00' * 10 + b'\xff\xff' + address.packed)
+    return address.packed
+
+
+def unpack_ip(packed: Optional[bytes]) -> Optional[str]:
+    if packed is None:
+        return None
+    address = ipaddress.IPv6Address(packed)
+    return str(address.ipv4_mapped or address)
+
+
+def _network_range(network: str) -> tuple:
+    network = ipaddress.ip_network(network, strict=False)
+    return pack_ip(str(network.network_address)), pack_ip(str(network.broadcast_address))
+
+
+def _exchange_to_row(exchange: HttpExchange) -> Dict[str, Any]:
+    response = exchange.get_response()
+    raw_response = response.to_bytes() if response is not None else None
+    # without response, status code and size may still be known (e.g. from an access log)
+    status_code = response.status_code if response is not None else exchange.status_code
+    response_size = len(raw_response) if raw_response is not None else exchange.response_size
+    src_ip, dst_ip = pack_ip(exchange.src_ip), pack_ip(exchange.dst_ip)
+    return {
+        'source_ip': src_ip,
+        'destination_ip': dst_ip,
+        'source_host': exchange.src_ip if src_ip is None else None,
+        'destination_host': exchange.dst_ip if dst_ip is None else None,
+        'timestamp': int(exchange.timestamp * 1e6),
+        'rtt': exchange.rtt,
+        'method': exchange.method,
+        'path': exchange.path,
+        'version': exchange.version,
+        'status_code': status_code or None,
+        'response_size': response_size,
+        'source': exchange.source,
+        'note': exchange.note,
+        'tags': [t for t in exchange.tags if t],
+        'label': exchange.label,
+        'raw_request': exchange.get_raw_request(),
+        'raw_response': raw_response,
+    }
+
+
+def write_exchanges(path: Union[str, Path], exchanges: Iterable[HttpExchange],
+                    feature_fn: Optional[FeatureFunction] = None, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    """
+    Write the exchanges to a Parquet file, one row group at a time, so the exchanges may be a generator of any length.
+    :param feature_fn: computes additional feature columns for an exchange (has to return the same keys every time)
+    :param row_group_size: number of exchanges per row group, which is the unit of reading and filtering
+    :return: the number of written exchanges
+    """
+    writer = None
+    rows: List[Dict[str, Any]] = []
+    count = 0
+
+    def flush():
+        nonlocal writer
+        table = pa.Table.from_pylist(rows, schema=_schema(rows[0]))
+        if writer is None:
+            writer = pq.ParquetWriter(str(path), table.schema)
+        writer.write_table(table, row_group_size=row_group_size)
+        rows.clear()
+
+    try:
+        for exchange in exchanges:
+            row = _exchange_to_row(exchange)
+            if feature_fn is not None:
+                row.update(feature_fn(exchange))
+            rows.append(row)
+            count += 1
+            if len(rows) >= row_group_size:
+                flush()
+        if rows:
+            flush()
+        elif writer is None:  # no exchanges at all
+            pq.write_table(SCHEMA.empty_table(), str(path))
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _schema(row: Dict[str, Any]) -> pa.Schema:
+    """Fixed schema of the exchange columns extended by the types of the feature columns"""
+    features = [k for k in row if k not in SCHEMA.names]
+    if not features:
+        return SCHEMA
+    inferred = pa.Table.from_pylist([{k: row[k] for k in features}]).schema
+    return pa.schema(list(SCHEMA) + list(inferred))
+
+
+def _filter_expression(capture_filter: Optional[CaptureFilter] = None,
+                       status_codes: Optional[Iterable[int]] = None) -> Optional[ds.Expression]:
+    """
+    Translate the filter to an expression, which is checked against the statistics of the row groups before reading
+    them. Unlike for captures, source and destination are not swapped, as the source is always the client.
+    """
+    conditions = []
+    if capture_filter is not None:
+        if capture_filter.start_time is not None:
+            conditions.append(ds.field('timestamp') >= pa.scalar(int(capture_filter.start_time * 1e6),
+                                                                  SCHEMA.field('timestamp').type))
+        if capture_filter.end_time is not None:
+            conditions.append(ds.field('timestamp') <= pa.scalar(int(capture_filter.end_time * 1e6),
+                                                                  SCHEMA.field('timestamp').type))
+        for column, networks in (('source_ip', capture_filter.src_ips), ('destination_ip', capture_filter.dst_ips)):
+            if networks is None:
+                continue
+            ranges = [_network_range(n) for n in networks]
+            condition = None
+            for low, high in ranges:
+                in_range = (ds.field(column) >= pa.scalar(low, _IP)) & (ds.field(column) <= pa.scalar(high, _IP))
+                condition = in_range if condition is None else condition | in_range
+            conditions.append(condition)
+    if status_codes is not None:
+        conditions.append(ds.field('status_code').isin(pa.array(list(status_codes), pa.int16())))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def read_table(path: Union[str, Path], columns: Optional[List[str]] = None,
+               capture_filter: Optional[CaptureFilter] = None,
+               status_codes: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """
+    Read the given columns of the rows matching the filters into a DataFrame. Only the required columns are read from
+    the file and row groups, which can't match the filters, are skipped.
+    IPs are converted back to strings (or the host name) and the timestamp to seconds since the epoch.
+    :param columns: the columns to load, all if None
+    """
+    dataset = ds.dataset(str(path), format='parquet')
+    if columns is not None:
+        columns = columns + [IP_COLUMNS[c] for c in IP_COLUMNS if c in columns and IP_COLUMNS[c] not in columns]
+    table = dataset.to_table(columns=columns, filter=_filter_expression(capture_filter, status_codes))
+    df = table.to_pandas()
+    for column, host_column in IP_COLUMNS.items():
+        if column in df.columns:
+            df[column] = df[column].map(unpack_ip).fillna(df[host_column])
+            df = df.drop(columns=host_column)
+    if 'timestamp' in df.columns:
+        df['timestamp'] = (df['timestamp'] - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+    if 'status_code' in df.columns:  # only dictionaries of strings are restored by Arrow
+        df['status_code'] = df['status_code'].astype('Int16').astype('category')
+    if 'response_size' in df.columns:
+        df['response_size'] = df['response_size'].astype('Int64')
+    return df
+
+
+class ParquetReader:
+    """Load the HttpExchanges stored in a Parquet file with `write_exchanges`, one row group at a time"""
+
+    def __init__(self, capture_filter: Optional[CaptureFilter] = None, status_codes: Optional[Iterable[int]] = None):
+        self.capture_filter = capture_filter
+        self.status_codes = status_codes
+
+    def load_samples(self, path: Union[str, Path]) -> Generator[HttpExchange, None, None]:
+        dataset = ds.dataset(str(path), format='parquet')
+        # files written by earlier versions lack the response size
+        names = [name for name in SCHEMA.names if name in dataset.schema.names]
+        scanner = dataset.scanner(columns=names, filter=_filter_expression(self.capture_filter, self.status_codes))
+        for batch in scanner.to_batches():
+            columns = batch.to_pydict()
+            timestamps = batch.column('timestamp').cast(pa.int64()).to_pylist()
+            response_sizes = columns.get('response_size', [None] * batch.num_rows)
+            for src_ip, dst_ip, src_host, dst_host, timestamp, rtt, request, response, status_code, response_size, \
+                    source, note, tags, label in zip(
+                        columns['source_ip'], columns['destination_ip'], columns['source_host'],
+                        columns['destination_host'], timestamps, columns['rtt'], columns['raw_request'],
+                        columns['raw_response'], columns['status_code'], response_sizes, columns['source'],
+                        columns['note'], columns['tags'], columns['label']):
+                timestamp = timestamp / 1e6
+                exchange = HttpExchange(unpack_ip(src_ip) or src_host, unpack_ip(dst_ip) or dst_host, timestamp,
+                                        raw_request=request, source=source, note=note)
+                if response is not None:
+                    exchange.set_raw_response(response, timestamp + max(rtt, 0.) / 1000)
+                else:
+                    exchange.status_code, exchange.response_size = status_code, response_size
+                exchange.rtt = rtt
+                exchange.tags = tags
+                exchange.label = label or ''
+                yield exchange
@@ -0,0 +1,330 @@
+import socket
+import struct
+from typing import NamedTuple, Optional, Iterator, List, Tuple, BinaryIO, Container
+
+# Decoder for pcap and pcapng files, which works directly on slices of the read file content.
+# Only the headers required to find TCP payloads are parsed, everything else is skipped without any dissection.
+# pcap:   https://wiki.wireshark.org/Development/LibpcapFileFormat
+# pcapng: https://pcapng.github.io/pcapng/
+
+LINKTYPE_NULL = 0  # BSD loopback
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108  # OpenBSD loopback
+LINKTYPE_LINUX_SLL = 113  # 'cooked' capture on all interfaces
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+_VLAN_ETHERTYPES = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_TCP = 6
+_IPV6_EXTENSION_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options
+_IPV6_FRAGMENT_HEADER = 44
+
+PCAPNG_SHB = 0x0A0D0D0A  # section header block
+PCAPNG_IDB = 0x00000001  # interface description block
+PCAPNG_OPB = 0x00000002  # obsolete packet block
+PCAPNG_SPB = 0x00000003  # simple packet block
+PCAPNG_EPB = 0x00000006  # enhanced packet block
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+OPT_ENDOFOPT = 0
+OPT_COMMENT = 1
+IF_TSRESOL = 9
+IF_TSOFFSET = 14
+
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+
+_TCP_HEADER = struct.Struct('!HHIIBB')
+
+
+class Frame(NamedTuple):
+    timestamp: float
+    link_type: int
+    data: memoryview
+    options: List[Tuple[int, bytes]]  # pcapng options of the packet as (option code, value)
+    offset: int  # position of the record/block within the file
+
+
+class TcpSegment(NamedTuple):
+    src_ip: str
+    src_port: int
+    dst_ip: str
+    dst_port: int
+    seq: int
+    ack: int
+    flags: int
+    payload: memoryview
+
+
+class Interface(NamedTuple):
+    link_type: int
+    ts_unit: float  # seconds per timestamp tick
+    ts_offset: int
+
+
+class CaptureContext(NamedTuple):
+    """State required to decode the records/blocks at some position within a capture"""
+    is_pcapng: bool
+    byte_order: str
+    interfaces: Tuple[Interface, ...]  # a pcap file has a single interface
+
+
+class _BlockStream:
+    """Buffered view on a binary file, which hands out zero-copy slices of the read data"""
+
+    def __init__(self, f: BinaryIO, chunk_size: int, offset: int = 0):
+        self._f = f
+        self._chunk_size = chunk_size
+        self.buf = b''
+        self.view = memoryview(self.buf)
+        self.pos = 0
+        self.offset = offset  # file offset of buf[0]
+
+    def ensure(self, n: int) -> bool:
+        """Make sure that at least `n` bytes are available at the current position"""
+        available = len(self.buf) - self.pos
+        if available >= n:
+            return True
+        parts = [self.buf[self.pos:]]
+        self.offset += self.pos
+        self.pos = 0
+        while available < n:
+            data = self._f.read(max(self._chunk_size, n - available))
+            if not data:
+                break
+            parts.append(data)
+            available += len(data)
+        self.buf = b''.join(parts)
+        self.view = memoryview(self.buf)
+        return available >= n
+
+    @property
+    def file_offset(self) -> int:
+        return self.offset + self.pos
+
+
+class PcapDecoder:
+    """
+    Iterate over the frames of a pcap or pcapng file. The data of a frame is a `memoryview` into the read buffer,
+    which stays valid after the iteration moved on, but has to be copied if it is kept for a long time.
+    While iterating, `context` holds the state required to continue decoding at `offset`, which is the position
+    after the last complete record/block. Both allow to resume decoding later on, e.g. once the capture has grown.
+    """
+
+    def __init__(self, chunk_size: int = 1 << 20):
+        self.chunk_size = chunk_size
+        self.context: Optional[CaptureContext] = None
+        self.offset = 0
+
+    def iter_frames(self, f: BinaryIO, context: Optional[CaptureContext] = None,
+                    end: Optional[int] = None) -> Iterator[Frame]:
+        """
+        :param f: the capture opened in binary mode
+        :param context: decode from the current position of `f` with this context instead of reading the file header
+        :param end: stop at the first record/block which starts at or after this offset
+        """
+        stream = _BlockStream(f, self.chunk_size, f.tell() if context is not None else 0)
+        self.offset = stream.offset
+        if context is None:
+            if not stream.ensure(4):
+                return
+            magic = stream.buf[:4]
+            if magic == b'\x0a\x0d\x0d\x0a':
+                context = CaptureContext(True, '<', ())
+            elif magic in _PCAP_MAGIC:
+                if not stream.ensure(24):
+                    return
+                byte_order, ts_unit = _PCAP_MAGIC[magic]
+                link_type = struct.unpack_from(byte_order + 'I', stream.buf, 20)[0] & 0x0FFFFFFF
+                context = CaptureContext(False, byte_order, (Interface(link_type, ts_unit, 0),))
+                stream.pos += 24
+            else:
+                raise ValueError(f"Unknown capture format (magic number {magic.hex()})")
+        self.context = context
+        limit = end if end is not None else float('inf')
+        try:
+            if context.is_pcapng:
+                yield from self._iter_pcapng(stream, limit)
+            else:
+                yield from self._iter_pcap(stream, limit)
+        finally:
+            self.offset = stream.file_offset
+
+    def _iter_pcap(self, stream: _BlockStream, limit: float) -> Iterator[Frame]:
+        byte_order = self.context.byte_order
+        link_type, ts_unit, _ = self.context.interfaces[0]
+        record = struct.Struct(byte_order + 'IIII')
+        while stream.ensure(16):
+            offset = stream.file_offset
+            if offset >= limit:
+                break
+            ts_sec, ts_frac, cap_len, _ = record.unpack_from(stream.buf, stream.pos)
+            if not stream.ensure(16 + cap_len):
+                break  # truncated record at the end of the file
+            start = stream.pos + 16
+            stream.pos = start + cap_len
+            yield Frame(ts_sec + ts_frac * ts_unit, link_type, stream.view[start:stream.pos], [], offset)
+
+    def _iter_pcapng(self, stream: _BlockStream, limit: float) -> Iterator[Frame]:
+        byte_order = self.context.byte_order
+        interfaces = list(self.context.interfaces)
+        while stream.ensure(12):
+            offset = stream.file_offset
+            if offset >= limit:
+                break
+            buf, pos = stream.buf, stream.pos
+            if buf[pos:pos + 4] == b'\x0a\x0d\x0d\x0a':  # new section, which may switch the byte order
+                byte_order = '<' if buf[pos + 8:pos + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+                interfaces = []
+                self.context = CaptureContext(True, byte_order, ())
+            block_type, block_len = struct.unpack_from(byte_order + 'II', buf, pos)
+            if block_len < 12 or not stream.ensure(block_len):
+                break  # corrupt or truncated block
+            buf, pos, view = stream.buf, stream.pos, stream.view
+            stream.pos += block_len
+            body_start, body_end = pos + 8, pos + block_len - 4
+
+            if block_type == PCAPNG_EPB or block_type == PCAPNG_OPB:
+                if block_type == PCAPNG_EPB:
+                    if_id, ts_high, ts_low, cap_len = struct.unpack_from(byte_order + 'IIII', buf, body_start)
+                else:
+                    if_id, _, ts_high, ts_low, cap_len = struct.unpack_from(byte_order + 'HHIII', buf, body_start)
+                data_start = body_start + 20
+                data_end = min(data_start + cap_len, body_end)
+                options_start = data_start + ((cap_len + 3) & ~3)
+                options = self._parse_options(buf, options_start, body_end, byte_order) \
+                    if options_start < body_end else []
+                if if_id >= len(interfaces):
+                    continue
+                interface = interfaces[if_id]
+                timestamp = (((ts_high << 32) | ts_low) * interface.ts_unit) + interface.ts_offset
+                yield Frame(timestamp, interface.link_type, view[data_start:data_end], options, offset)
+            elif block_type == PCAPNG_SPB:
+                if len(interfaces) == 0:
+                    continue
+                orig_len = struct.unpack_from(byte_order + 'I', buf, body_start)[0]
+                data_start = body_start + 4
+                data_end = min(data_start + orig_len, body_end)
+                yield Frame(0., interfaces[0].link_type, view[data_start:data_end], [], offset)
+            elif block_type == PCAPNG_IDB:
+                link_type = struct.unpack_from(byte_order + 'H', buf, body_start)[0]
+                ts_unit, ts_offset = 1e-6, 0
+                for code, value in self._parse_options(buf, body_start + 8, body_end, byte_order):
+                    if code == IF_TSRESOL and len(value) > 0:
+                        resolution = value[0]
+                        ts_unit = 2. ** -(resolution & 0x7F) if resolution & 0x80 else 10. ** -resolution
+                    elif code == IF_TSOFFSET and len(value) >= 8:
+                        ts_offset = struct.unpack_from(byte_order + 'q', value)[0]
+                interfaces.append(Interface(link_type, ts_unit, ts_offset))
+                self.context = CaptureContext(True, byte_order, tuple(interfaces))
+
+    @staticmethod
+    def _parse_options(buf: bytes, pos: int, end: int, byte_order: str) -> List[Tuple[int, bytes]]:
+        options = []
+        while pos + 4 <= end:
+            code, length = struct.unpack_from(byte_order + 'HH', buf, pos)
+            if code == OPT_ENDOFOPT:
+                break
+            pos += 4
+            options.append((code, buf[pos:pos + length]))
+            pos += (length + 3) & ~3
+        return options
+
+
+def decode_tcp(link_type: int, data: memoryview, ports: Optional[Container[int]] = None) -> Optional[TcpSegment]:
+    """
+    Decode the link, network and transport layer headers of a frame.
+    :param link_type: the link layer type of the capture interface
+    :param data: captured bytes of the frame
+    :param ports: if given, only segments from or to one of these ports are decoded
+    :return: the TCP segment or None if the frame does not carry a (matching) TCP segment
+    """
+    size = len(data)
+    if link_type == LINKTYPE_ETHERNET:
+        if size < 14:
+            return None
+        ether_type = (data[12] << 8) | data[13]
+        off = 14
+        while ether_type in _VLAN_ETHERTYPES and size >= off + 4:
+            ether_type = (data[off + 2] << 8) | data[off + 3]
+            off += 4
+    elif link_type == LINKTYPE_LINUX_SLL:
+        if size < 16:
+            return None
+        ether_type = (data[14] << 8) | data[15]
+        off = 16
+    elif link_type == LINKTYPE_LINUX_SLL2:
+        if size < 20:
+            return None
+        ether_type = (data[0] << 8) | data[1]
+        off = 20
+    elif link_type in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_NULL, LINKTYPE_LOOP):
+        off = 4 if link_type in (LINKTYPE_NULL, LINKTYPE_LOOP) else 0
+        if size <= off:
+            return None
+        version = data[off] >> 4
+        ether_type = ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else 0
+    else:
+        return None
+
+    if ether_type == ETHERTYPE_IPV4:
+        if size < off + 20 or data[off] >> 4 != 4 or data[off + 9] != IPPROTO_TCP:
+            return None
+        if ((data[off + 6] << 8) | data[off + 7]) & 0x1FFF:  # not the first fragment of a datagram
+            return None
+        total_len = (data[off + 2] << 8) | data[off + 3]
+        end = min(off + total_len, size) if total_len else size  # total length is 0 for TSO captures
+        src, dst = data[off + 12:off + 16], data[off + 16:off + 20]
+        family = socket.AF_INET
+        off += (data[off] & 0x0F) * 4
+    elif ether_type == ETHERTYPE_IPV6:
+        if size < off + 40:
+            return None
+        next_header = data[off + 6]
+        payload_len = (data[off + 4] << 8) | data[off + 5]
+        end = min(off + 40 + payload_len, size) if payload_len else size
+        src, dst = data[off + 8:off + 24], data[off + 24:off + 40]
+        family = socket.AF_INET6
+        off += 40
+        while next_header in _IPV6_EXTENSION_HEADERS or next_header == _IPV6_FRAGMENT_HEADER:
+            if size < off + 8:
+                return None
+            if next_header == _IPV6_FRAGMENT_HEADER:
+                if ((data[off + 2] << 8) | data[off + 3]) & 0xFFF8:  # not the first fragment
+                    return None
+                hdr_len = 8
+            else:
+                hdr_len = (data[off + 1] + 1) * 8
+            next_header = data[off]
+            off += hdr_len
+        if next_header != IPPROTO_TCP:
+            return None
+    else:
+        return None
+
+    if end < off + 20:
+        return None
+    src_port, dst_port, seq, ack, data_offset, flags = _TCP_HEADER.unpack_from(data, off)
+    if ports is not None and src_port not in ports and dst_port not in ports:
+        return None
+    payload_start = off + (data_offset >> 4) * 4
+    return TcpSegment(socket.inet_ntop(family, src), src_port, socket.inet_ntop(family, dst), dst_port,
+                      seq, ack, flags, data[payload_start:end])
+
+
+def iter_tcp_segments(f: BinaryIO, ports: Optional[Container[int]] = None) \
+        -> Iterator[Tuple[Frame, TcpSegment]]:
+    """Iterate over all frames of the capture in `f`, which carry a TCP segment from or to one of the `ports`"""
+    for frame in PcapDecoder().iter_frames(f):
+        segment = decode_tcp(frame.link_type, frame.data, ports)
+        if segment is not None:
+            yield frame, segment
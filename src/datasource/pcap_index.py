@@ -0,0 +1,257 @@
+import ipaddress
+import logging
+import math
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union, BinaryIO
+
+from .capture_filter import CaptureFilter
+from .pcap_decoder import PcapDecoder, CaptureContext, Interface, decode_tcp
+from .tcp_reassembly import FlowKey, flow_key
+
+# Sidecar index for a capture, which maps time buckets and TCP flows to the offsets of their first and last frame.
+# The index is stored next to the capture as '<capture>.idx' in the following binary (little-endian) format:
+#   magic, header (bucket width, indexed size, capture prefix), contexts, buckets, flows
+# The indexed size is the offset after the last indexed block, from where the index can be continued once the
+# capture has grown, using the decoder context stored for that position.
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'HADXIDX1'
+PREFIX_SIZE = 32  # bytes of the capture stored to detect a replaced capture
+MERGE_GAP = 1 << 20  # ranges closer than this are read in one go instead of seeking
+
+_HEADER = struct.Struct('<dq32sI')
+_CONTEXT = struct.Struct('<q?cH')
+_INTERFACE = struct.Struct('<Idq')
+_COUNT = struct.Struct('<I')
+_BUCKET = struct.Struct('<qqq')
+_FLOW = struct.Struct('<16sH16sHqqdd')
+
+logger = logging.getLogger(__name__)
+
+
+def index_path(capture_path: Union[str, Path]) -> Path:
+    capture_path = Path(capture_path)
+    return capture_path.with_name(capture_path.name + INDEX_SUFFIX)
+
+
+def _pack_ip(ip: str) -> bytes:
+    address = ipaddress.ip_address(ip)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b'\x00' * 10 + b'\xff\xff' + address.packed)
+    return address.packed
+
+
+def _unpack_ip(packed: bytes) -> str:
+    address = ipaddress.IPv6Address(packed)
+    return str(address.ipv4_mapped or address)
+
+
+class PcapIndex:
+    """
+    Index of the blocks of a capture by time bucket and by TCP flow.
+    `contexts` holds the decoder context for offsets from which on it is valid, `resume_context` the context to
+    continue indexing at `indexed_size`.
+    """
+
+    def __init__(self, bucket_width: float = 60.):
+        self.bucket_width = bucket_width
+        self.indexed_size = 0
+        self.prefix = b''
+        self.contexts: List[Tuple[int, CaptureContext]] = []
+        self.resume_context: Optional[CaptureContext] = None
+        self.buckets: Dict[int, List[int]] = {}  # bucket -> [first offset, last offset]
+        self.flows: Dict[FlowKey, List] = {}  # flow -> [first offset, last offset, first timestamp, last timestamp]
+
+    def update(self, f: BinaryIO) -> bool:
+        """
+        Index the part of the capture, which has not been indexed yet.
+        :return: True if the index changed
+        """
+        prefix = f.read(PREFIX_SIZE)
+        if self.indexed_size > 0 and prefix[:len(self.prefix)] != self.prefix:  # capture has been replaced
+            self.__init__(self.bucket_width)
+        self.prefix = prefix
+        size = f.seek(0, 2)
+        if size < self.indexed_size:  # capture has been truncated
+            self.__init__(self.bucket_width)
+        if size == self.indexed_size:
+            return False
+
+        decoder = PcapDecoder()
+        f.seek(self.indexed_size)
+        context = self.resume_context
+        buckets, flows, width = self.buckets, self.flows, self.bucket_width
+        for frame in decoder.iter_frames(f, context):
+            if decoder.context is not context:  # new section or interface
+                context = decoder.context
+                self.contexts.append((frame.offset, context))
+            offset, timestamp = frame.offset, frame.timestamp
+            bucket_key = math.floor(timestamp / width)
+            bucket = buckets.get(bucket_key)
+            if bucket is None:
+                buckets[bucket_key] = [offset, offset]
+            else:
+                bucket[1] = offset
+            segment = decode_tcp(frame.link_type, frame.data)
+            if segment is None:
+                continue
+            key = flow_key(segment)
+            flow = flows.get(key)
+            if flow is None:
+                flows[key] = [offset, offset, timestamp, timestamp]
+            else:
+                flow[1] = offset
+                flow[2] = min(flow[2], timestamp)
+                flow[3] = max(flow[3], timestamp)
+        if decoder.context is None:  # not even the file header is complete yet
+            return False
+        self.indexed_size = decoder.offset
+        self.resume_context = decoder.context
+        return True
+
+    def context_at(self, offset: int) -> Optional[CaptureContext]:
+        """Decoder context for a block starting at `offset`"""
+        return next((c for o, c in reversed(self.contexts) if o <= offset), None)
+
+    def ranges(self, capture_filter: CaptureFilter, overrun: float = 0.) -> List[Tuple[int, int]]:
+        """
+        Byte ranges of the capture, which contain all frames matching the filter. The frames of the flows in the time
+        range are included up to their last frame, as well as the frames up to `overrun` seconds after the end of the
+        time range, so responses and the ends of connections cut by the filter are read just like in a full scan.
+        :param overrun: seconds to read past the end of the time range, e.g. the idle timeout of the reader
+        :return: sorted list of (first block offset, last block offset)
+        """
+        start = capture_filter.start_time if capture_filter.start_time is not None else -math.inf
+        end = capture_filter.end_time if capture_filter.end_time is not None else math.inf
+        time_ranges = [(first, last) for bucket, (first, last) in self.buckets.items()
+                       if start < (bucket + 1) * self.bucket_width and bucket * self.bucket_width <= end + overrun]
+        if not time_ranges:
+            return []
+        lower, upper = min(r[0] for r in time_ranges), max(r[1] for r in time_ranges)
+
+        ranges = [] if capture_filter.filters_endpoints else [(lower, upper)]
+        for (_, ip_a, port_a, ip_b, port_b), (first, last, first_ts, last_ts) in self.flows.items():
+            if last_ts < start or first_ts > end:
+                continue
+            if capture_filter.filters_endpoints:
+                if capture_filter.ports is not None and port_a not in capture_filter.ports and \
+                        port_b not in capture_filter.ports:
+                    continue
+                if not capture_filter.matches_hosts(ip_a, ip_b) and not capture_filter.matches_hosts(ip_b, ip_a):
+                    continue
+            ranges.append((max(first, lower), last))
+        return self._merge(ranges)
+
+    def shard(self, shard_index: int, shard_count: int) -> Tuple[Set[FlowKey], Optional[Tuple[int, int]]]:
+        """
+        Split the capture into `shard_count` byte ranges of equal size, where every flow belongs to the range its
+        first frame is in. The frames of a flow may reach into the following ranges.
+        :return: the flows of the shard and the offsets of their first and last frame (None if there are no flows)
+        """
+        size = max(self.indexed_size, 1)
+        flows = set()
+        lower, upper = math.inf, -1
+        for key, (first, last, _, _) in self.flows.items():
+            if first * shard_count // size == shard_index:
+                flows.add(key)
+                lower, upper = min(lower, first), max(upper, last)
+        return flows, ((lower, upper) if flows else None)
+
+    @staticmethod
+    def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        merged: List[Tuple[int, int]] = []
+        for first, last in sorted(ranges):
+            if merged and first - merged[-1][1] <= MERGE_GAP:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    def save(self, path: Path) -> None:
+        parts = [INDEX_MAGIC, _HEADER.pack(self.bucket_width, self.indexed_size, self.prefix, len(self.contexts) + 1)]
+        for offset, context in self.contexts + [(self.indexed_size, self.resume_context)]:
+            parts.append(_CONTEXT.pack(offset, context.is_pcapng, context.byte_order.encode('ascii'),
+                                       len(context.interfaces)))
+            parts += [_INTERFACE.pack(*interface) for interface in context.interfaces]
+        parts.append(_COUNT.pack(len(self.buckets)))
+        parts += [_BUCKET.pack(bucket, first, last) for bucket, (first, last) in self.buckets.items()]
+        parts.append(_COUNT.pack(len(self.flows)))
+        parts += [_FLOW.pack(_pack_ip(ip_a), port_a, _pack_ip(ip_b), port_b, *entry)
+                  for (_, ip_a, port_a, ip_b, port_b), entry in self.flows.items()]
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(parts))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['PcapIndex']:
+        """Read the index from `path` or return None if there is no valid index"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(INDEX_MAGIC):
+            return None
+        try:
+            return cls._parse(data)
+        except (struct.error, ValueError) as e:  # e.g. truncated or corrupted on disk
+            logger.warning(f"Ignoring invalid index {path}: {e}")
+            return None
+
+    @classmethod
+    def _parse(cls, data: bytes) -> 'PcapIndex':
+        pos = len(INDEX_MAGIC)
+        bucket_width, indexed_size, prefix, num_contexts = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        index = cls(bucket_width)
+        index.indexed_size, index.prefix = indexed_size, prefix[:min(PREFIX_SIZE, indexed_size)]
+        for _ in range(num_contexts):
+            offset, is_pcapng, byte_order, num_interfaces = _CONTEXT.unpack_from(data, pos)
+            pos += _CONTEXT.size
+            interfaces = tuple(Interface(*_INTERFACE.unpack_from(data, pos + i * _INTERFACE.size))
+                               for i in range(num_interfaces))
+            pos += num_interfaces * _INTERFACE.size
+            index.contexts.append((offset, CaptureContext(is_pcapng, byte_order.decode('ascii'), interfaces)))
+        index.resume_context = index.contexts.pop()[1]
+
+        num_buckets = _COUNT.unpack_from(data, pos)[0]
+        pos += _COUNT.size
+        for bucket, first, last in _BUCKET.iter_unpack(data[pos:pos + num_buckets * _BUCKET.size]):
+            index.buckets[bucket] = [first, last]
+        pos += num_buckets * _BUCKET.size
+        num_flows = _COUNT.unpack_from(data, pos)[0]
+        pos += _COUNT.size
+        for ip_a, port_a, ip_b, port_b, *entry in _FLOW.iter_unpack(data[pos:pos + num_flows * _FLOW.size]):
+            index.flows[(6, _unpack_ip(ip_a), port_a, _unpack_ip(ip_b), port_b)] = entry
+        if pos + num_flows * _FLOW.size != len(data):
+            raise ValueError("unexpected size")
+        return index
+
+
+def build_index(capture_path: Union[str, Path], bucket_width: float = 60.) -> PcapIndex:
+    """
+    Load the sidecar index of the capture and bring it up to date, i.e. only the blocks appended since the last
+    update are indexed. The index is (re)written if it changed. An invalid index is rebuilt; if the index can't be
+    written (e.g. read-only directory), it is only kept in memory.
+    """
+    path = index_path(capture_path)
+    index = PcapIndex.load(path) or PcapIndex(bucket_width)
+    with open(capture_path, 'rb') as f:
+        changed = index.update(f)
+    if changed:
+        try:
+            index.save(path)
+        except OSError as e:
+            logger.warning(f"Can't write index {path}: {e}")
+    return index
+
+
+def try_build_index(capture_path: Union[str, Path], bucket_width: float = 60.) -> Optional[PcapIndex]:
+    """`build_index`, which logs the error and returns None if the index can't be built (the capture is read in full)"""
+    try:
+        return build_index(capture_path, bucket_width)
+    except (OSError, struct.error) as e:
+        logger.warning(f"Reading {capture_path} without index: {e}")
+        return None
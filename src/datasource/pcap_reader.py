@@ -1,148 +1,215 @@
-from typing import Optional, Tuple, List
+import time
+from pathlib import Path
+from typing import Container, Generator, Iterable, Iterator, Tuple, List, Optional
 
 from scapy.all import *
+from scapy.utils import PcapReader as ScapyPcapReader
 from src.http_message.http_exchange import HttpExchange
+from .capture_filter import CaptureFilter
+from .follow import FollowedFile, latest_file
+from .pcap_decoder import Frame, PcapDecoder, TcpSegment, decode_tcp
+from .pcap_index import PcapIndex, try_build_index
+from .sniffing import open_binary, is_compressed
+from .tcp_reassembly import FlowKey, TcpReassembler, flow_key, flow_hash
 
 
 # TODO  timestamp: int
 #       Content_Length: int
 # TODO  tests for DoS attacks if sessions are not ended (input from Martin)
 
-CRLF = b'\r\n'
+HTTP_PORTS = (80, 8000, 8080)
 
 
 class PcapReader:
     """
     Parse frames within a given PCAP file and extract HTTP requests and corresponding responses.
+    The TCP segments from or to one of the given `ports` are reassembled per connection and the resulting byte streams
+    are parsed as HTTP. In streaming mode the capture is read packet by packet and exchanges are yielded as soon as
+    they are complete. The state of a TCP connection is dropped once it is closed (FIN/RST) or has been idle for
+    `idle_timeout` seconds, so the memory usage depends on the number of concurrent connections rather than on the size
+    of the capture.
+
+    The 'scapy' backend dissects every frame with scapy, whereas the 'native' backend decodes the pcap/pcapng blocks
+    and the packet headers itself.
+
+    With `shard=(index, count)` only the connections whose flow hash modulo `count` equals `index` are processed,
+    which allows splitting a single capture across multiple workers. With `use_index` the capture is split into
+    `count` byte ranges instead and a shard only decodes the frames from the first to the last frame of the
+    connections starting in its range (see `PcapIndex.shard`).
+
+    The `capture_filter` is checked for every frame before its segment is reassembled; the timestamp is even checked
+    before the packet headers are decoded. Once the end of the time range has passed, no new connections are tracked
+    and the capture is not read any further after the remaining connections have ended.
+
+    With `use_index` a sidecar index is kept next to the capture (see `pcap_index`), which is built on first use and
+    extended as the capture grows. If a `capture_filter` is given, only the byte ranges of the capture containing
+    matching time buckets and flows are read, which are always decoded by the native decoder. Compressed captures are
+    always read in full and sharded by flow hash, as are captures whose index can't be read.
     """
-    def __init__(self):
-        load_layer("http")
+    def __init__(self, streaming: bool = False, idle_timeout: float = 120., backend: str = 'scapy',
+                 ports: Iterable[int] = HTTP_PORTS, shard: Optional[Tuple[int, int]] = None,
+                 capture_filter: Optional[CaptureFilter] = None, use_index: bool = False):
+        if backend not in ('scapy', 'native'):
+            raise ValueError(f"'{backend}' is not a valid backend!")
+        self.streaming = streaming
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self.ports = frozenset(ports)
+        self.shard = shard
+        self.capture_filter = capture_filter
+        self.use_index = use_index
 
     def load_samples(self, file_path):
-        packets = rdpcap(str(file_path))
-        # tcp_pakets = packets[TCP]
-        # bind_layers(TCP, HttpRequest, dport=80)
-        exchanges = []  # combinations of request/response
-
-        http_traffic = packets[HTTP]
-        is_request = False
-        remaining_len = 0
-        for title, session in http_traffic.sessions(self._full_duplex).items():
-            waiting_for_content = False
-            exchange, res = None, None
-            for raw_pkt in session:
-                http = raw_pkt.getlayer('HTTP')
-                if raw_pkt.haslayer('HTTPRequest'):
-                    is_request = True
-                    exchange, waiting_for_content = self._process_request(raw_pkt)
-                    exchanges.append(exchange)
-                elif raw_pkt.haslayer('HTTPResponse'):
-                    is_request = False
-                    res = raw_pkt.getlayer('HTTPResponse')
-                    res.is_chunked = res.Transfer_Encoding is not None and b'chunked' in res.Transfer_Encoding
-                    if res.is_chunked:
-                        # TODO res.payload.original should be the used attribute, but scapy has a bug, where length of 1st chunk is being dropped
-                        chunks, remaining_len, waiting_for_content = read_chunks(res.original)
-                        if not waiting_for_content:  # final chunk received -> add to content as to request
-                            exchange.set_response(res.original, b''.join(chunks), res)
-                            res.is_chunked = False
-                            res, exchange = None, None
-                    elif res.Content_Length and int(res.Content_Length) > 0:
-                        waiting_for_content = True
-                elif raw_pkt.haslayer('HTTP'):       # probably a subsequent fragment for a request/response
-                    if is_request and exchange and waiting_for_content:
-                        try:
-                            exchange.set_content(raw_pkt.getlayer('HTTP').original)
-                        except UnicodeDecodeError as exc:
-                            print(exc)
-                    elif waiting_for_content:
-                        if res and res.is_chunked:
-                            # TODO see other todo with res.payload.original
-                            new_chunks, remaining_len, waiting_for_content = read_chunks(http.original, remaining_len)
-                            chunks += new_chunks
-                            if not waiting_for_content:  # final chunk received -> add to content as to request
-                                exchange.set_response(res.original, b''.join(chunks), res)
-                                res.is_chunked = False
-                                res, exchange = None, None
-        return exchanges
+        samples = self.iter_samples(file_path)
+        return samples if self.streaming else list(samples)
+
+    def iter_samples(self, file_path) -> Generator[HttpExchange, None, None]:
+        """
+        Read the capture one packet at a time and yield every exchange as soon as its response is complete.
+        Exchanges without (complete) response are yielded once their connection ends.
+        """
+        yield from self._reassemble(self._iter_segments(file_path))
+
+    def follow(self, path, poll_interval: float = 1., stop_after: Optional[float] = None) \
+            -> Generator[HttpExchange, None, None]:
+        """
+        Follow a capture, which is still being written, and yield the exchanges with a latency of about
+        `poll_interval` seconds. New blocks are parsed as they are appended and once a newer file appears in the
+        directory of the capture (rotation, e.g. `tcpdump -G`), the reader switches to it. Always uses the native
+        decoder.
+        :param path: the capture to start with, or a directory in which case its newest capture is used
+        :param poll_interval: seconds to wait before checking for new data again
+        :param stop_after: stop if no new data arrived for this many seconds; follow forever if None
+        """
+        yield from self._reassemble(self._iter_followed_segments(Path(path), poll_interval, stop_after))
+
+    def _reassemble(self, segments: Iterable[Tuple[float, List, TcpSegment]]) -> Generator[HttpExchange, None, None]:
+        reassembler = TcpReassembler(self.ports, self.idle_timeout)
+        capture_filter = self.capture_filter
+        for timestamp, options, segment in segments:
+            open_new = True
+            if capture_filter is not None and capture_filter.is_after(timestamp):
+                if len(reassembler.connections) == 0 and \
+                        capture_filter.is_after(timestamp - self.idle_timeout):
+                    break  # all connections of the time range have ended
+                open_new = False
+            exchanges = reassembler.process(segment, timestamp, self._parse_comments(options), open_new)
+            yield from self._select(exchanges)
+        yield from self._select(reassembler.close_all())
+
+    def _select(self, exchanges: List[HttpExchange]) -> List[HttpExchange]:
+        if self.capture_filter is None:
+            return exchanges
+        return [e for e in exchanges if self.capture_filter.matches_exchange(e.src_ip, e.dst_ip, e.timestamp)]
+
+    def _in_shard(self, segment: TcpSegment) -> bool:
+        return self.shard is None or flow_hash(flow_key(segment)) % self.shard[1] == self.shard[0]
+
+    def _decode_frames(self, frames: Iterable[Frame], flows: Optional[Container[FlowKey]] = None) \
+            -> Iterator[Tuple[float, List, TcpSegment]]:
+        """:param flows: only decode the segments of these flows instead of the ones of the shard's flow hashes"""
+        capture_filter = self.capture_filter
+        start_time = capture_filter.start_time if capture_filter is not None else None
+        check_endpoints = capture_filter is not None and capture_filter.filters_endpoints
+        for frame in frames:
+            if start_time is not None and frame.timestamp < start_time:
+                continue
+            segment = decode_tcp(frame.link_type, frame.data, self.ports)
+            if segment is None or (check_endpoints and not capture_filter.matches_segment(segment)):
+                continue
+            if not (self._in_shard(segment) if flows is None else flow_key(segment) in flows):
+                continue
+            yield frame.timestamp, frame.options, segment
+
+    def _iter_followed_segments(self, path: Path, poll_interval: float, stop_after: Optional[float]) \
+            -> Iterator[Tuple[float, List, TcpSegment]]:
+        current = path
+        if path.is_dir():
+            waiting_since = time.monotonic()
+            current = latest_file(path)
+            while current is None:  # wait for the capture to start
+                if stop_after is not None and time.monotonic() - waiting_since >= stop_after:
+                    return
+                time.sleep(poll_interval)
+                current = latest_file(path)
+        while current is not None:
+            with FollowedFile(current, poll_interval, stop_after) as f:
+                yield from self._decode_frames(PcapDecoder().iter_frames(f))
+                current = f.rotated_to
+
+    def _iter_indexed_segments(self, file_path, index: PcapIndex) -> Iterator[Tuple[float, List, TcpSegment]]:
+        flows = None
+        ranges = index.ranges(self.capture_filter, self.idle_timeout) if self.capture_filter is not None else None
+        if self.shard is not None:
+            flows, shard_range = index.shard(*self.shard)
+            if shard_range is None:
+                return
+            lower, upper = shard_range
+            if ranges is None:
+                ranges = [shard_range]
+            ranges = [(max(first, lower), min(last, upper)) for first, last in ranges
+                      if first <= upper and last >= lower]
+        yield from self._decode_frames(self._iter_ranges(file_path, index, ranges), flows)
+
+    @staticmethod
+    def _iter_ranges(file_path, index: PcapIndex, ranges: List[Tuple[int, int]]) -> Iterator[Frame]:
+        decoder = PcapDecoder()
+        with open(file_path, 'rb') as f:
+            for start, last in ranges:
+                f.seek(start)
+                yield from decoder.iter_frames(f, index.context_at(start), end=last + 1)
+
+    def _iter_segments(self, file_path) -> Iterator[Tuple[float, List, TcpSegment]]:
+        if self.use_index and (self.capture_filter is not None or self.shard is not None) and \
+                not is_compressed(file_path):
+            index = try_build_index(file_path)
+            if index is not None:
+                yield from self._iter_indexed_segments(file_path, index)
+                return
+        if self.backend == 'native':
+            with open_binary(file_path) as f:
+                yield from self._decode_frames(PcapDecoder().iter_frames(f))
+            return
+
+        capture_filter = self.capture_filter
+        with ScapyPcapReader(open_binary(file_path)) as packets:
+            for raw_pkt in packets:
+                timestamp = float(raw_pkt.time)
+                if capture_filter is not None and capture_filter.start_time is not None and \
+                        timestamp < capture_filter.start_time:
+                    continue
+                if 'TCP' not in raw_pkt:
+                    continue
+                tcp = raw_pkt[TCP]
+                if tcp.sport not in self.ports and tcp.dport not in self.ports:
+                    continue
+                ip = raw_pkt[IP] if 'IP' in raw_pkt else raw_pkt[IPv6]
+                segment = TcpSegment(ip.src, tcp.sport, ip.dst, tcp.dport, tcp.seq, tcp.ack, int(tcp.flags),
+                                     self._tcp_payload(ip, tcp))
+                if capture_filter is not None and not capture_filter.matches_segment(segment):
+                    continue
+                if not self._in_shard(segment):
+                    continue
+                yield timestamp, getattr(raw_pkt, 'options', None), segment
 
     @staticmethod
-    def _full_duplex(p):
-        # From here https://pen-testing.sans.org/blog/2017/10/13/scapy-full-duplex-stream-reassembly
-        sess = "Other"
-        if 'Ether' in p or 'CookedLinux' in p:  # CookedLinux = capture from all interfaces
-            if 'IP' in p:
-                if 'TCP' in p:
-                    sess = str(sorted(["TCP", p[IP].src, p[TCP].sport, p[IP].dst, p[TCP].dport], key=str))
-                elif 'UDP' in p:
-                    sess = str(sorted(["UDP", p[IP].src, p[UDP].sport, p[IP].dst, p[UDP].dport], key=str))
-                elif 'ICMP' in p:
-                    sess = str(sorted(["ICMP", p[IP].src, p[IP].dst, p[ICMP].code, p[ICMP].type, p[ICMP].id], key=str))
-                else:
-                    sess = str(sorted(["IP", p[IP].src, p[IP].dst, p[IP].proto], key=str))
-            elif 'ARP' in p:
-                sess = str(sorted(["ARP", p[ARP].psrc, p[ARP].pdst], key=str))
-            else:
-                sess = p.sprintf("Ethernet type=%04xr,Ether.type%")
-        return sess
-
-    @classmethod
-    def _process_request(cls, raw_pkt):
-        pkt = raw_pkt.getlayer('HTTPRequest')
-        src_ip, dst_ip = raw_pkt[IP].src, raw_pkt[IP].dst
-        timestamp = float(raw_pkt.time)
-        fields = pkt.fields
-        notes = cls._parse_comments(raw_pkt.options)
-        exchange = HttpExchange(src_ip, dst_ip, timestamp, pkt.original, source='PCAP', note=notes)
-        waiting_for_content = False
-        if pkt.TE and b'chunked' in pkt.TE:
-            waiting_for_content = True
-        if 'Content_Length' in fields:
-            waiting_for_content = int(fields.get('Content_Length', 0)) > 0
-        return exchange, waiting_for_content
+    def _tcp_payload(ip, tcp) -> bytes:
+        """
+        Payload of the segment cut to the length given by the IP header, as scapy keeps the padding of short frames
+        (e.g. Ethernet frames of pure ACKs are padded to 60 bytes) as part of it
+        """
+        payload = bytes(tcp.payload)
+        ip_payload_len = ip.len - ip.ihl * 4 if ip.version == 4 else ip.plen
+        if not ip_payload_len:  # length is 0 for TSO captures
+            return payload
+        # IPv6 extension headers between the IP and the TCP header are part of the IPv6 payload length
+        header_len = len(ip.payload) - len(tcp) + tcp.dataofs * 4
+        return payload[:max(ip_payload_len - header_len, 0)]
 
     @staticmethod
     def _parse_comments(pkt_options):
         # https://pcapng.github.io/pcapng/#section_opt
         if pkt_options is None or len(pkt_options) == 0:
             return ''
-        notes = [opt[1].decode('utf-8') for opt in pkt_options if opt[0] == 1]  # opt_code 1 = OPT_COMMENT
+        notes = [bytes(opt[1]).decode('utf-8') for opt in pkt_options if opt[0] == 1]  # opt_code 1 = OPT_COMMENT
         return ';\n'.join(notes)
-
-
-def read_chunks(body: bytes, remaining_len: int = 0, trailer: Optional[str] = None) -> Tuple[List[bytes], int, bool]:
-    """
-    Splits the given bytearray into chunks. Each chunk is represented as chunk length as hex and the chunk itself.
-    The last chunk is indicated by length = 0 (see https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Transfer-Encoding#Directives)
-    :param body: the chunks which have to be read
-    :param remaining_len: number of bytes belonging to the previous chunk without having a length specified
-    :param trailer: trailer with header fields as stated in the request
-    :return: list of extracted chunks, number pending bytes in the next fragment, flag if the last chunk has been read
-    """
-    # TODO support trailer (stated in request)-> should that be handled?
-    # workaround for scapy bug where length of 1st chunk is being dropped -> parse raw packet
-    crlfcrlf = b"\r\n\r\n"
-    crlfcrlfIndex = body.find(crlfcrlf)
-    if crlfcrlfIndex != -1:
-        body = body[crlfcrlfIndex + len(crlfcrlf):]
-
-    if remaining_len:  # bytes are part of chunk from previous packet
-        chunk, body2 = body[:remaining_len], body[remaining_len:]
-        # prepend remaining chunk length to match expected format
-        body = b''.join([hex(remaining_len).encode('utf-8'), b'\r\n', chunk, body2])
-
-    chunks = []
-    length, rem_len = 0, remaining_len
-    while body:
-        length, _, body = body.partition(CRLF)
-        try:
-            length = int(length, 16)
-        except ValueError as exc:  # Not a valid chunk. Ignore
-            raise ValueError(f"'{length.decode('utf-8')}' is not a valid chunk size")
-        else:
-            chunk = body[:length]
-            body = body[length + 2:]
-            rem_len = length - len(chunk)
-            if length > 0:  # final chunk has length 0
-                chunks.append(chunk)
-    return chunks, rem_len, length != 0
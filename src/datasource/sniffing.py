@@ -0,0 +1,80 @@
+import bz2
+import gzip
+import io
+import lzma
+import re
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, TextIO, Union
+
+# Compressed files are decompressed while they are read, thus every reader can open archived datasets directly.
+# The format of a dataset is given by its extension (ignoring the one of the compression) or else sniffed from the
+# first bytes of its decompressed content.
+
+COMPRESSIONS: Dict[bytes, Callable[..., BinaryIO]] = {
+    b'\x1f\x8b': gzip.open,
+    b'BZh': bz2.open,
+    b'\xfd7zXZ\x00': lzma.open,
+}
+COMPRESSION_SUFFIXES = ['.gz', '.bz2', '.xz']
+SNIFF_SIZE = 1 << 12
+
+_BINARY_FORMATS = {
+    b'\xd4\xc3\xb2\xa1': 'pcap',
+    b'\xa1\xb2\xc3\xd4': 'pcap',
+    b'\x4d\x3c\xb2\xa1': 'pcap',
+    b'\xa1\xb2\x3c\x4d': 'pcap',
+    b'\x0a\x0d\x0d\x0a': 'pcapng',
+    b'PAR1': 'parquet',
+}
+_HAR_START = re.compile(rb'^(?:\xef\xbb\xbf)?\s*\{\s*"log"\s*:')
+_LOG_LINE = re.compile(rb'^\S+ \S+ \S+ \[[^\]]+\] "')
+
+
+def _compression(path: Union[str, Path]) -> Optional[Callable[..., BinaryIO]]:
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    return next((opener for m, opener in COMPRESSIONS.items() if magic.startswith(m)), None)
+
+
+def is_compressed(path: Union[str, Path]) -> bool:
+    return _compression(path) is not None
+
+
+def open_binary(path: Union[str, Path]) -> BinaryIO:
+    """Open the file for reading, where compressed files are decompressed on the fly"""
+    opener = _compression(path)
+    return open(path, 'rb') if opener is None else opener(path, 'rb')
+
+
+def open_text(path: Union[str, Path], encoding: str = 'utf-8', errors: str = 'strict',
+              newline: Optional[str] = None) -> TextIO:
+    """Text mode version of `open_binary`"""
+    return io.TextIOWrapper(open_binary(path), encoding=encoding, errors=errors, newline=newline)
+
+
+def format_suffix(path: Union[str, Path]) -> str:
+    """Extension of the file without the one of the compression, e.g. '.pcap' for 'capture.pcap.gz'"""
+    path = Path(path)
+    if path.suffix in COMPRESSION_SUFFIXES:
+        path = path.with_suffix('')
+    return path.suffix
+
+
+def sniff_format(path: Union[str, Path]) -> Optional[str]:
+    """
+    Detect the format of the file by the first bytes of its (decompressed) content.
+    :return: the extension of the format without leading dot or None if unknown
+    """
+    with open_binary(path) as f:
+        head = f.read(SNIFF_SIZE)
+    detected = _BINARY_FORMATS.get(head[:4])
+    if detected is not None:
+        return detected
+    if _HAR_START.match(head):
+        return 'har'
+    first_line = head.lstrip(b'\xef\xbb\xbf').split(b'\n', 1)[0]
+    if first_line.lstrip().startswith(b'{') or _LOG_LINE.match(first_line):
+        return 'log'  # JSON lines or combined access log
+    if b',' in first_line:
+        return 'csv'
+    return None
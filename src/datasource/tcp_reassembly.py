@@ -0,0 +1,263 @@
+import zlib
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Deque, Container
+
+from src.http_message.http_exchange import HttpExchange
+from .http_stream import HttpStreamParser, HttpStreamMessage
+from .pcap_decoder import TcpSegment
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+_SEQ_MASK = 0xFFFFFFFF
+_SEQ_HALF = 0x80000000  # sequence numbers are compared with serial number arithmetic (RFC 1982)
+MAX_OUT_OF_ORDER_BYTES = 1 << 22  # per direction; once exceeded, the missing data is considered lost
+
+FlowKey = Tuple[int, str, int, str, int]
+
+
+def flow_key(segment: TcpSegment) -> FlowKey:
+    """Normalized 5-tuple of the connection, which is identical for both directions"""
+    a, b = (segment.src_ip, segment.src_port), (segment.dst_ip, segment.dst_port)
+    if b < a:
+        a, b = b, a
+    return 6, a[0], a[1], b[0], b[1]
+
+
+def flow_hash(key: FlowKey) -> int:
+    """Hash of the flow key, which (unlike `hash`) is identical in every process"""
+    return zlib.crc32(f"{key[1]}|{key[2]}|{key[3]}|{key[4]}".encode('ascii'))
+
+
+class _HalfStream:
+    """
+    Bytes sent in one direction of a TCP connection. Segments are delivered in sequence number order;
+    retransmitted data is dropped and overlapping segments are trimmed to the bytes not seen yet.
+    """
+
+    def __init__(self):
+        self.next_seq: Optional[int] = None
+        self.fin = False
+        self._pending: Dict[int, Tuple[bytes, float]] = {}  # out-of-order segments by sequence number
+        self._pending_bytes = 0
+
+    def add(self, seq: int, payload, timestamp: float, syn: bool = False) -> List[Tuple[bytes, float]]:
+        """
+        Add a segment of the stream.
+        :return: the data, which can be delivered in order now, together with the timestamps of their segments
+        """
+        if syn:
+            seq = (seq + 1) & _SEQ_MASK  # SYN occupies one sequence number
+            if self.next_seq is None:
+                self.next_seq = seq
+        if len(payload) == 0:
+            return []
+        if self.next_seq is None:  # capture started in the middle of the connection
+            self.next_seq = seq
+
+        offset = (seq - self.next_seq) & _SEQ_MASK
+        if offset >= _SEQ_HALF:  # segment starts before the next expected byte: retransmission or overlap
+            overlap = (self.next_seq - seq) & _SEQ_MASK
+            if overlap >= len(payload):
+                return []
+            payload, offset = payload[overlap:], 0
+        if offset > 0:
+            self._buffer(seq, payload, timestamp)
+            if self._pending_bytes > MAX_OUT_OF_ORDER_BYTES:
+                return self._skip_gap()
+            return []
+
+        self.next_seq = (self.next_seq + len(payload)) & _SEQ_MASK
+        data = [(payload, timestamp)]
+        if self._pending:
+            data += self._drain()
+        return data
+
+    def _buffer(self, seq: int, payload, timestamp: float) -> None:
+        existing = self._pending.get(seq)
+        if existing is not None:
+            if len(existing[0]) >= len(payload):
+                return
+            self._pending_bytes -= len(existing[0])
+        self._pending[seq] = (bytes(payload), timestamp)
+        self._pending_bytes += len(payload)
+
+    def _drain(self) -> List[Tuple[bytes, float]]:
+        data = []
+        while self._pending:
+            item = self._pending.pop(self.next_seq, None)
+            if item is None:
+                item = self._pop_overlapping()
+                if item is None:
+                    break
+            else:
+                self._pending_bytes -= len(item[0])
+            data.append(item)
+            self.next_seq = (self.next_seq + len(item[0])) & _SEQ_MASK
+        return data
+
+    def _pop_overlapping(self) -> Optional[Tuple[bytes, float]]:
+        """Remove buffered segments, which start before the next expected byte, and return the first useful one"""
+        for seq in [s for s in self._pending if (s - self.next_seq) & _SEQ_MASK >= _SEQ_HALF]:
+            payload, timestamp = self._pending.pop(seq)
+            self._pending_bytes -= len(payload)
+            overlap = (self.next_seq - seq) & _SEQ_MASK
+            if overlap < len(payload):
+                return payload[overlap:], timestamp
+        return None
+
+    def _skip_gap(self) -> List[Tuple[bytes, float]]:
+        """Give up on the missing data and continue with the first buffered segment"""
+        self.next_seq = min(self._pending, key=lambda s: (s - self.next_seq) & _SEQ_MASK)
+        return self._drain()
+
+
+class TcpConnection:
+    """
+    HTTP conversation over a single TCP connection. The reassembled byte streams of both directions are split into
+    messages and every response is assigned to the oldest request still waiting for an answer, which also covers
+    pipelined requests on keep-alive connections.
+    """
+
+    def __init__(self, client_ip: str, client_port: int, server_ip: str, server_port: int):
+        self.client = (client_ip, client_port)
+        self.server = (server_ip, server_port)
+        self.last_seen = 0.
+        self.closed = False
+        self._client_stream = _HalfStream()
+        self._server_stream = _HalfStream()
+        self._requests = HttpStreamParser(is_request=True)
+        self._responses = HttpStreamParser(is_request=False)
+        self._pending: Deque[HttpExchange] = deque()
+        self._notes: List[str] = []  # comments of the frames of the request currently being read
+
+    def process(self, segment: TcpSegment, timestamp: float, note: str = '') -> List[HttpExchange]:
+        """
+        Feed the next segment of the connection.
+        :return: exchanges which are completed by this segment
+        """
+        self.last_seen = timestamp
+        from_client = segment.src_port == self.client[1] and segment.src_ip == self.client[0]
+        stream = self._client_stream if from_client else self._server_stream
+        chunks = stream.add(segment.seq, segment.payload, timestamp, syn=bool(segment.flags & TCP_SYN))
+
+        finished = []
+        if from_client:
+            if note and len(segment.payload) > 0:
+                self._notes.append(note)
+            for data, ts in chunks:
+                for message in self._requests.feed(data, ts):
+                    self._add_request(message)
+        else:
+            for data, ts in chunks:
+                for message in self._responses.feed(data, ts):
+                    finished += self._add_response(message)
+
+        if segment.flags & TCP_FIN:
+            stream.fin = True
+        if segment.flags & TCP_RST or (self._client_stream.fin and self._server_stream.fin):
+            self.closed = True
+        return finished
+
+    def is_reused_by(self, segment: TcpSegment) -> bool:
+        """Check if the SYN `segment` opens a new connection with the same 5-tuple (not a retransmitted SYN)"""
+        return self._client_stream.next_seq != (segment.seq + 1) & _SEQ_MASK
+
+    def close(self) -> List[HttpExchange]:
+        """End the connection and release all exchanges, including those without response"""
+        request = self._requests.close()
+        if request is not None:
+            self._add_request(request)
+        response = self._responses.close()
+        finished = self._add_response(response) if response is not None else []
+        finished += self._pending
+        self._pending.clear()
+        return finished
+
+    def _add_request(self, message: HttpStreamMessage) -> None:
+        exchange = HttpExchange(self.client[0], self.server[0], message.timestamp, message.raw,
+                                source='PCAP', note=';\n'.join(self._notes))
+        self._notes = []
+        self._pending.append(exchange)
+        self._responses.request_methods.append(message.raw.split(b' ', 1)[0])
+
+    def _add_response(self, message: HttpStreamMessage) -> List[HttpExchange]:
+        if len(self._pending) == 0 or message.raw[9:10] == b'1':  # unsolicited or interim (1xx) response
+            return []
+        exchange = self._pending.popleft()
+        exchange.set_response(message.head, message.body, message.timestamp)
+        return [exchange]
+
+
+class TcpReassembler:
+    """
+    Table of the open TCP connections keyed by their normalized 5-tuple. A connection is removed once it has been
+    closed (RST or FIN in both directions) or has been idle for `idle_timeout` seconds, thus the memory usage
+    depends on the number of concurrent connections only.
+    """
+
+    def __init__(self, server_ports: Container[int], idle_timeout: float = 120.):
+        self.server_ports = server_ports
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[FlowKey, TcpConnection] = {}
+        self._last_sweep: Optional[float] = None
+
+    def process(self, segment: TcpSegment, timestamp: float, note: str = '', open_new: bool = True) \
+            -> List[HttpExchange]:
+        """
+        Add the next captured segment.
+        :param open_new: whether a segment of an unknown connection starts tracking it
+        :return: exchanges which have been completed by this segment or due to the eviction of idle connections
+        """
+        finished = []
+        if self._last_sweep is None:
+            self._last_sweep = timestamp
+        elif timestamp - self._last_sweep >= self.idle_timeout:
+            finished += self.evict_idle(timestamp)
+            self._last_sweep = timestamp
+
+        key = flow_key(segment)
+        connection = self.connections.get(key)
+        is_syn = segment.flags & (TCP_SYN | TCP_ACK) == TCP_SYN
+        if connection is not None and is_syn and connection.is_reused_by(segment):
+            finished += self.connections.pop(key).close()
+            connection = None
+        if connection is None:
+            if not open_new or segment.flags & TCP_RST or not (segment.flags & TCP_SYN or len(segment.payload) > 0):
+                return finished
+            connection = self.connections[key] = self._open(segment)
+        finished += connection.process(segment, timestamp, note)
+        if connection.closed:
+            finished += self.connections.pop(key).close()
+        return finished
+
+    def evict_idle(self, now: float) -> List[HttpExchange]:
+        idle = [k for k, c in self.connections.items() if now - c.last_seen > self.idle_timeout]
+        finished = []
+        for key in idle:
+            finished += self.connections.pop(key).close()
+        return finished
+
+    def close_all(self) -> List[HttpExchange]:
+        finished = []
+        for connection in self.connections.values():
+            finished += connection.close()
+        self.connections.clear()
+        return finished
+
+    def _open(self, segment: TcpSegment) -> TcpConnection:
+        """Create the connection and figure out which side is the client"""
+        flags, payload = segment.flags, segment.payload
+        if flags & TCP_SYN:
+            from_client = not flags & TCP_ACK
+        elif bytes(payload[:5]) == b'HTTP/':
+            from_client = False
+        elif segment.dst_port in self.server_ports or segment.src_port not in self.server_ports:
+            from_client = True
+        else:
+            from_client = False
+        if from_client:
+            return TcpConnection(segment.src_ip, segment.src_port, segment.dst_ip, segment.dst_port)
+        return TcpConnection(segment.dst_ip, segment.dst_port, segment.src_ip, segment.src_port)
@@ -59,7 +59,7 @@ class HeaderConstraints:
 		if is_valid and self.allowed_values is not None:
 			is_valid = self._is_allowed_value(header_value)
 			if not is_valid:
-				allowed_vals_str = ', '.join(self.allowed_values)
+				allowed_vals_str = ', '.join(v.pattern if isinstance(v, re.Pattern) else v for v in self.allowed_values)
 				reason = f"'{header_value}' is not one of [{allowed_vals_str}]"
 
 		return is_valid, reason
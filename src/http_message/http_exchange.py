@@ -1,7 +1,9 @@
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Tuple
 from src.http_message.http_request import HttpRequest
+from src.http_message.parsing import count_header_names, parse_request, parse_request_line
 from src.http_message.http_response import HttpResponse
 from collections import OrderedDict
+from base64 import b64encode
 from typing import Dict
 from utils import flatten_list
 
@@ -13,6 +15,8 @@ class HttpExchange:
 	and `dst_ip` the IP address of the responding service. The `timestamp` is the start of the exchange, which equals
 	the timestamp of the request.
 	"""
+	__slots__ = ('src_ip', 'dst_ip', 'timestamp', 'rtt', 'tags', 'label', 'source', 'note', 'status_code',
+				 'response_size', '_raw_request', '_request', '_request_line', '_raw_response', '_response')
 	
 	def __init__(self, src_ip: str, dst_ip: str, timestamp: float, raw_request: bytes,
 	             source: str = '', note: str = '', raw_response: Optional[bytes] = None, rtt: float = -1):
@@ -21,23 +25,21 @@ class HttpExchange:
 		self.timestamp = timestamp
 		self.rtt = rtt
 		self.tags: List[str] = []
+		self.label: str = ''
 		self.source = source
 		self.note: str = note
-		self._response = None
-		if raw_response is not None:
-			self._response: Optional[HttpResponse] = HttpResponse(raw_response)
-			if rtt < 0:
-				self._calculate_rtt()
-		
-		r = HttpRequest(raw_request, self.src_ip, self.dst_ip)
-		self._request = r
-		self._request._timestamp = self.timestamp  # exchange starts with request  # TODO properly set timestamp
-		
-		self.method = r.method
-		self.path = r.path
-		self.version = r.http_version
-		hdrs = dict(r.headers)
-		self.num_headers = len(hdrs)
+		# status code and size of the response, if only these are known (e.g. from an access log)
+		self.status_code: Optional[int] = None
+		self.response_size: Optional[int] = None
+		# The messages are kept raw and only parsed once they are accessed, so views which only need the metadata
+		# (IPs, timestamps, method, ...) skip almost all parsing.
+		self._raw_request = raw_request.encode('iso-8859-1') if isinstance(raw_request, str) else raw_request
+		self._request: Optional[HttpRequest] = None
+		self._request_line: Optional[Tuple[str, str, str]] = None
+		self._raw_response: Optional[Tuple[bytes, Optional[bytes], float]] = None  # raw headers, body and timestamp
+		self._response: Optional[HttpResponse] = None
+		if raw_response is not None:  # without its timestamp, so the rtt stays unknown unless given
+			self._raw_response = (raw_response, None, 0.)
 	
 	def __eq__(self, other):
 		return self.src_ip == other.src_ip and \
@@ -50,31 +52,84 @@ class HttpExchange:
 	
 	def __hash__(self):
 		return hash((self.src_ip, self.dst_ip, self.path, self.method,
-		             hash(self._request), hash(self._response)))
+		             hash(self.get_request()), hash(self.get_response())))
+	
+	def _get_request_line(self) -> Tuple[str, str, str]:
+		if self._request is not None:
+			return self._request.method, self._request.path, self._request.http_version
+		if self._request_line is None:
+			self._request_line = parse_request_line(self._raw_request)
+		return self._request_line
+	
+	@property
+	def method(self) -> str:
+		return self._get_request_line()[0]
+	
+	@property
+	def path(self) -> str:
+		return self._get_request_line()[1]
+	
+	@property
+	def version(self) -> str:
+		return self._get_request_line()[2]
+	
+	@property
+	def num_headers(self) -> int:
+		"""Number of distinct header names, which doesn't require building (and validating) the request"""
+		return count_header_names(parse_request(self._raw_request).headers)
 	
 	def set_content(self, content, for_request=True):
 		if for_request:
-			self._request.set_body(content)
+			self.get_request().set_body(content)
 		else:
-			if self._response is None:
+			if self.get_response() is None:
 				self._response = HttpResponse(b'')
 			self._response.set_body(content)
 	
-	def get_request(self):
+	def get_request(self) -> HttpRequest:
+		if self._request is None:
+			self._request = HttpRequest(self._raw_request, self.src_ip, self.dst_ip)
+			self._request._timestamp = self.timestamp  # exchange starts with request  # TODO properly set timestamp
 		return self._request
 	
-	def get_response(self):
+	def get_raw_request(self) -> bytes:
+		"""The raw request without parsing it"""
+		return self._raw_request
+	
+	def get_raw_response(self) -> Optional[bytes]:
+		"""The raw response without parsing it, i.e. the headers followed by the (decoded) body"""
+		if self._response is not None:
+			return self._response.to_bytes()
+		if self._raw_response is None:
+			return None
+		raw_headers, raw_body, _ = self._raw_response
+		return raw_headers + raw_body if raw_body is not None else raw_headers
+	
+	def get_response(self) -> Optional[HttpResponse]:
+		if self._response is None and self._raw_response is not None:
+			raw_headers, raw_body, timestamp = self._raw_response
+			self._response = HttpResponse(raw_headers, timestamp)
+			if raw_body is not None:
+				self._response.set_body(raw_body)
+			self._raw_response = None
 		return self._response
 	
-	def set_response(self, raw_headers, raw_body, tmp_scapy_response=None):
+	def set_response(self, raw_headers, raw_body, timestamp: float):
 		if isinstance(raw_headers, bytes):
-			self._response = HttpResponse(raw_headers)
-			self._response.set_body(raw_body)
-			self._response._timestamp = tmp_scapy_response.time  # TODO properly set timestamp
+			self._response = None
+			self._raw_response = (raw_headers, raw_body, timestamp)
 			self._calculate_rtt()
 		else:
 			raise ValueError('Response is of types bytes')
 	
+	def set_raw_response(self, raw_response: bytes, timestamp: float):
+		"""Set the response from the complete raw message, i.e. the headers followed by the body"""
+		head_end = raw_response.find(b'\r\n\r\n')
+		if head_end < 0:  # truncated headers
+			self.set_response(raw_response + b'\r\n\r\n', b'', timestamp)
+		else:
+			self.set_response(raw_response[:head_end + 4], raw_response[head_end + 4:], timestamp)
+	
 	def get(self, field: str, default: Optional[Any] = None):
 		"""
 		Generic getter for attributes on the HTTP exchange, HTTP request or HTTP response.
@@ -85,7 +140,7 @@ class HttpExchange:
 		:return: the value of the attribute or the default value if no such attribute was found.
 		"""
 		# priority of objects on which to look for the field
-		for obj in [self, self._request, self._response]:
+		for obj in [self, self.get_request(), self.get_response()]:
 			if obj:
 				attr = getattr(obj, field, None)
 				if attr:
@@ -93,7 +148,9 @@ class HttpExchange:
 		return default
 	
 	def _calculate_rtt(self):
-		self.rtt = (self._response.get_time() - self._request.get_time()) * 1000  # use milliseconds
+		# the request starts at the timestamp of the exchange, so neither message has to be parsed
+		response_time = self._response.get_time() if self._response is not None else self._raw_response[2]
+		self.rtt = (response_time - self.timestamp) * 1000  # use milliseconds
 	
 	def set_note(self, note):
 		self.note = note if note is not None else ''
@@ -137,15 +194,26 @@ class HttpExchange:
 	# 	return mapping
 	
 	def to_csv_entry(self, label: Optional[str] = None) -> Dict[str, str]:
+		"""
+		Row of the processed CSV format, which is read by `ProcessedCsvReader`.
+		The response timestamp is derived from the rtt, as not every source provides it.
+		:param label: overrides the label of the exchange
+		"""
+		response = self.get_response()
 		mapping = OrderedDict()
 		mapping['source_ip'] = self.src_ip
 		mapping['destination_ip'] = self.dst_ip
-		mapping['request_ts'] = self.get_request().get_time()
-		mapping['response_ts'] = self.get_response().get_time()
-		mapping['request_b64'] = self.get_request().encode_base64()
-		mapping['response_b64'] = self.get_request().encode_base64()
+		mapping['request_ts'] = self.timestamp
+		mapping['response_ts'] = self.timestamp + self.rtt / 1000 if response is not None and self.rtt >= 0 else ''
+		mapping['request_b64'] = b64encode(self.get_raw_request()).decode('ascii')
+		mapping['response_b64'] = response.encode_base64().decode('ascii') if response is not None else ''
+		# without response, status code and size may still be known (e.g. from an access log)
+		status_code, response_size = (response.status_code, response.get_size()) if response is not None \
+			else (self.status_code, self.response_size)
+		mapping['status_code'] = status_code if status_code is not None else ''
+		mapping['response_size'] = response_size if response_size is not None else ''
 		mapping['source'] = self.source
 		mapping['note'] = self.note
 		mapping['tags'] = ';'.join(self.tags)
-		mapping['label'] = '' if label is None else label
+		mapping['label'] = self.label if label is None else label
 		return mapping
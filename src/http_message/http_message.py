@@ -1,7 +1,61 @@
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+
+from src.http_message.parsing import header_value
+
 
 class HttpMessage:
-    def __init__(self, raw):
+    """
+    Base of requests and responses, which keep the raw message and the offsets of its headers into it (see
+    `parsing.header_offsets`)
+    """
+    __slots__ = ('_raw', '_offsets', '_header_index')
+
+    def __init__(self, raw, offsets: Optional[array] = None):
         self._raw = raw
+        self._offsets = offsets if offsets is not None else array('I', [len(raw)])  # i.e. without headers
+        self._header_index: Optional[Dict[str, Union[int, Tuple[int, ...]]]] = None
 
     def get_size(self):
         return len(self._raw)
+
+    def to_bytes(self) -> bytes:
+        """The raw message"""
+        return self._raw
+
+    def _get_header_index(self) -> Dict[str, Union[int, Tuple[int, ...]]]:
+        """
+        Position of the headers by their lower case name, which is built on the first lookup. The index covers all
+        headers as sent, i.e. including duplicates (kept as tuple of positions) and names with surrounding whitespace.
+        """
+        if self._header_index is None:
+            raw, offsets = self._raw, self._offsets
+            index: Dict[str, Union[int, Tuple[int, ...]]] = {}
+            for position, i in enumerate(range(1, len(offsets), 4)):
+                name = sys.intern(raw[offsets[i]:offsets[i + 1]].decode('iso-8859-1').strip().lower())
+                previous = index.get(name)
+                if previous is None:
+                    index[name] = position
+                else:
+                    index[name] = (previous, position) if isinstance(previous, int) else previous + (position,)
+            self._header_index = index
+        return self._header_index
+
+    def has_header(self, header_name: str) -> bool:
+        return header_name.lower() in self._get_header_index()
+
+    def get_header(self, header_name: str, default: Optional[str] = None) -> Optional[str]:
+        """Retrieve the (first) value of the header with the given name, which is compared case-insensitively"""
+        position = self._get_header_index().get(header_name.lower())
+        if position is None:
+            return default
+        return header_value(self._raw, self._offsets, position if isinstance(position, int) else position[0])
+
+    def get_header_values(self, header_name: str) -> List[str]:
+        """All values of the header with the given name, e.g. of Set-Cookie or of a duplicated header"""
+        position = self._get_header_index().get(header_name.lower())
+        if position is None:
+            return []
+        positions = (position,) if isinstance(position, int) else position
+        return [header_value(self._raw, self._offsets, p) for p in positions]
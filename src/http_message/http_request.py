@@ -1,118 +1,53 @@
-import io
-import re
-from http.server import BaseHTTPRequestHandler
-from http import HTTPStatus
-from typing import Union, Optional, List
+import sys
+from typing import Union, Optional, List, Dict, Tuple
 from base64 import b64encode
-import logging
 
 from .http_message import HttpMessage
-from src.http_message.validation import evaluate_headers, HeaderProblem, RequestProblem
+from src.http_message.parsing import parse_request, parse_request_line, ParsedRequest, header_offsets, decode_headers
+from src.http_message.validation import evaluate_headers, HeaderProblem
 
 HTTP_METHODS = ['GET', 'POST', 'HEAD', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE']
 
 
-class _HttpRequestHandler(BaseHTTPRequestHandler):
-	def __init__(self, raw_request: Union[bytes, str]):
-		# super().__init__(request, client_address, server)
-		if isinstance(raw_request, bytes):
-			self.rfile = io.BytesIO(raw_request)
-		else:
-			self.rfile = io.BytesIO(raw_request.encode('iso-8859-1'))
-		self.headers = []
-		self.raw_requestline = self.rfile.readline()
-		self.error_code = self.error_message = None
-		if self.parse_request():
-			self._fix_headers()
-		else:
-			if self.error_code == HTTPStatus.BAD_REQUEST:
-				self._fix_requestline()
-				if self.parse_request():
-					self._fix_headers()
-				else:
-					print(f"Error while parsing {self.error_code}: {self.error_message}")
-
-	def _fix_requestline(self):
-		try:
-			# fix request line and try parsing again
-			requestline = str(self.raw_requestline, 'iso-8859-1')
-			requestline = requestline.rstrip('\r\n')
-			self.requestline = requestline
-			words = requestline.split()
-			if len(words) > 3:
-				fixed_requestline = f"{words[0]} {'%20'.join(words[1:-1])} {words[-1]}"
-				self.raw_requestline = fixed_requestline.encode('iso-8859-1')
-		except:
-			print(f"Error while parsing {self.error_code}: {self.error_message}")
-	
-	def send_error(self, code, message):
-		self.error_code = code
-		self.error_message = message
-	
-	def _fix_headers(self):
-		"""Fix bugged wrongly parsed headers"""
-		logger = logging.getLogger("")
-		fixed_headers = []
-		# BaseHTTPRequestHandler has trouble parsing a header with a leading space (header is part of previous entry)
-		for header_name, value in self.headers._headers:
-			if '\r\n' in value:
-				# TODO move this correction to 'fix_problem' in HttpRequest, so this case
-				prev_value, new_header = [v for v in value.split('\r\n')]
-				fixed_headers.append((header_name, prev_value))
-				new_name, new_value = [h for h in new_header.split(':')]
-				fixed_headers.append((new_name, new_value))
-				logger.info(
-					fr"Had to fix header entries, because \r\n was not correctly handled (malformed_value: {value}, new header: {new_header})")
-			else:
-				fixed_headers.append((header_name, value))
-		
-		# BaseHTTPRequestHandler seems to interpret headers as payload once an error occurs
-		# -> special handling required to retrieve them nontheless
-		if len(self.headers._payload) > 0:
-			# BaseHTTPRequestHandle has trouble parsing a header with a space between field name and colon
-			tmp_hdrs = re.compile(r"(?<=\w)(?:\r\n)+(?=\w|$)").split(self.headers._payload)
-			other_fields = [tuple(h.split(": ")) for h in tmp_hdrs if len(h) > 0]
-			diff = set(other_fields).difference(set(fixed_headers))
-			if len(diff) > 0:
-				if len(diff) == 2:
-					fixed_headers += diff
-				# split between header and value occurred => previous header has no actual value
-				elif len(diff) == 1 and len(fixed_headers[-1][
-												1]) == 0:  # TODO find reason for split and add it to value to keep original payload
-					hdr_name, _ = fixed_headers.pop()
-					hdr_val = '\n' + list(diff)[0][0]
-					fixed_headers.append((hdr_name, hdr_val))
-				logger.info(f"Augmented list of parsed headers, because {len(diff)} entries were missing: {diff}")
-		
-		self.headers._headers = fixed_headers
-
-
 class HttpRequest(HttpMessage):
+	"""
+	A request, which only keeps the raw request and the offsets of its headers and body into it. The path and the
+	headers are decoded from the raw request when accessed, so millions of requests can be held in memory.
+	"""
+	__slots__ = ('_method', '_version', '_parse_problems', '_fixed_headers', '_body', '_timestamp',
+				 '_problems', '_cookies')
+	
 	def __init__(self, raw_request: Union[bytes, str], src_ip: str, dst_ip: str):
-		# super().__init__(raw_request, client_address, server)
-		super().__init__(raw_request)
-		self._problems = {}
-		self._req = _HttpRequestHandler(raw_request)
-		self._headers = self._req.headers._headers
-		self.path = self._req.path
+		if isinstance(raw_request, str):
+			raw_request = raw_request.encode('iso-8859-1')
+		parsed = parse_request(raw_request)
+		super().__init__(raw_request, header_offsets(parsed.body_start, parsed.headers))
+		self._method = sys.intern(parsed.method)
+		self._version = sys.intern(parsed.version)
+		self._parse_problems = parsed.problems or None
+		self._fixed_headers: Optional[List[Tuple[str, str]]] = None  # only kept if they differ from the raw headers
+		self._body: Optional[bytes] = None  # only kept if set explicitly
 		self._timestamp = 0.
-
-		if self._req.error_code is not None:
-			self._problems['request'] = [RequestProblem(reason=self._req.error_message)]
-		
-		try:
-			self.body = raw_request[raw_request.index(b"\r\n\r\n") + 4:].rstrip()
-		except ValueError:
-			self.body = b''
-		
-		self._problems.update(evaluate_headers(True, self._headers))
+		# validation and cookie extraction are deferred until first accessed
+		self._problems: Optional[Dict[str, List]] = None
+		self._cookies: Optional[List] = None
+	
+	def _validate(self) -> None:
+		"""Evaluate the headers once, which also normalizes their names (see `_fix_problems`)"""
+		if self._problems is not None:
+			return
+		self._problems = {key: list(problems) for key, problems in (self._parse_problems or {}).items()}
+		self._parse_problems = None
+		headers = decode_headers(self._raw, self._offsets)
+		for hdr_name, hdr_problems in evaluate_headers(True, headers).items():
+			self._problems.setdefault(hdr_name, []).extend(hdr_problems)
 		if len(self._problems):
-			self._fix_problems(self._problems)
-		
-		self._cookies = self._extract_cookies()
+			fixed_headers = self._fix_problems(headers)
+			if fixed_headers != headers:
+				self._fixed_headers = fixed_headers
 	
-	def _fix_problems(self, problems):
-		headers = dict(self._headers)
+	def _fix_problems(self, headers: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+		headers = dict(headers)
 		for hdr_name, problems in self._problems.items():
 			for p in problems:
 				if p.code == HeaderProblem.MALFORMED_HEADER or \
@@ -121,13 +56,17 @@ class HttpRequest(HttpMessage):
 					del headers[p.headers]
 					# headers[p.headers.strip()] = hdr_val
 					headers[hdr_name] = hdr_val
-		self._headers = list(zip(headers.keys(), headers.values()))
+		return list(zip(headers.keys(), headers.values()))
+	
+	def get_cookies(self) -> List:
+		"""Name and value of every cookie of the request"""
+		if self._cookies is None:
+			self._cookies = self._extract_cookies()
+		return self._cookies
 	
 	def _extract_cookies(self) -> List:
 		cookies = []
-		raw_cookies = self._req.headers.get("cookie")
-		
-		if raw_cookies:
+		for raw_cookies in self.get_header_values('Cookie'):
 			for raw_cookie in raw_cookies.split(";"):
 				cookie_parts = raw_cookie.split("=")
 				cookie_name = cookie_parts[0].strip()
@@ -151,19 +90,29 @@ class HttpRequest(HttpMessage):
 	
 	@property
 	def method(self):  # use standard vocabulary for parts of the request
-		return self._req.command
+		return self._method
+	
+	@property
+	def path(self) -> str:
+		return parse_request_line(self._raw)[1]
 	
 	@property
 	def http_version(self):
-		return self._req.request_version
+		return self._version
 	
 	@property
 	def headers(self):
-		return self._headers
+		self._validate()
+		return self._fixed_headers if self._fixed_headers is not None else decode_headers(self._raw, self._offsets)
 	
-	def get_header(self, header_name: str) -> str:
-		"""Retrieve the value of the header with the given name"""
-		return next((hdr_value for hdr_name, hdr_value in self._headers if hdr_name == header_name), None)
+	@property
+	def parsed(self) -> ParsedRequest:
+		"""Parts of the request with their offsets into the raw request, which is parsed again"""
+		return parse_request(self._raw)
+	
+	@property
+	def body(self) -> bytes:
+		return self._body if self._body is not None else self._raw[self._offsets[0]:].rstrip()
 	
 	def get_body(self, as_string: bool = False) -> Optional[Union[bytes, str]]:
 		if as_string:
@@ -176,9 +125,10 @@ class HttpRequest(HttpMessage):
 			return self.body
 	
 	def set_body(self, body: bytes) -> None:
-		self.body = body
+		self._body = body
 	
 	def get_problems(self, problem_type: Optional[HeaderProblem] = None):
+		self._validate()
 		if problem_type is None:
 			return self._problems.values()
 		return [p for hdr_problems in self._problems.values()
@@ -1,43 +1,55 @@
-import io
+import sys
 from base64 import b64encode
-from typing import Optional
-from http.client import HTTPResponse
+from typing import Optional, List, Dict
+from logging import WARNING
 
 from .http_message import HttpMessage
-
-
-class _SocketMock:
-    def __init__(self, raw, encoding=None, errors=None, newline=None):
-        self._raw = raw
-        self._encoding = encoding
-        self._errors = errors
-        self._newline = newline
-
-    def makefile(self, mode):
-        buffer = io.BufferedReader(io.BytesIO(self._raw))
-        # self._encoding, self._errors, self._newline)
-        # text.mode = mode
-        return buffer
+from src.http_message.parsing import parse_response, ParsedResponse, RESPONSE_PROBLEMS, header_offsets, \
+    decode_headers
+from src.http_message.validation import evaluate_headers, ResponseProblem
 
 
 class HttpResponse(HttpMessage):
     """
+    A response, which is parsed by `parse_response`. Truncated or malformed responses are kept as far as they could
+    be parsed and their deviations are reported by `get_problems` like those of a request. Like `HttpRequest`, only
+    the raw response and the offsets of its headers and body are kept.
     """
+    __slots__ = ('_body', '_timestamp', 'status_code', 'reason', '_parse_problems', '_problems')
 
     def __init__(self, raw_response: bytes, timestamp: float = 0.,
                  status_code: int = 0, reason: str = ''):
-        super().__init__(raw_response)
-        self._raw_headers, self._raw_body = raw_response.split(b'\r\n\r\n', 1)
+        parsed = parse_response(raw_response)
+        super().__init__(raw_response, header_offsets(parsed.body_start, parsed.headers))
+        self._body: Optional[bytes] = None  # only kept if set separately from the raw headers
         self._timestamp = timestamp
-        self.status_code = status_code
-        self.reason = reason
+        self.status_code = parsed.status_code or status_code
+        self.reason = sys.intern(parsed.reason or reason)
+        self._parse_problems = parsed.problems or None
+        self._problems: Optional[Dict[str, List]] = None  # evaluated when first accessed
+
+    def _validate(self) -> None:
+        if self._problems is not None:
+            return
+        self._problems = {key: list(problems) for key, problems in (self._parse_problems or {}).items()}
+        self._parse_problems = None
+        for hdr_name, hdr_problems in evaluate_headers(False, self.headers).items():
+            self._problems.setdefault(hdr_name, []).extend(hdr_problems)
+        self._check_body_length()
 
-        sock = _SocketMock(self._raw_headers)
-        res = HTTPResponse(sock)
-        res.begin()
-        self.status_code = res.status
-        self._reason = res.reason
-        self._headers = res.headers._headers
+    def _check_body_length(self) -> None:
+        """Report a body, which is shorter than announced, e.g. if the capture is incomplete"""
+        problems = [p for p in self._problems.get(RESPONSE_PROBLEMS, [])
+                    if p.code != ResponseProblem.TRUNCATED_BODY]
+        content_length = self.get_header('Content-Length')
+        body_size = len(self.get_body())
+        if content_length is not None and content_length.isdigit() and int(content_length) > body_size:
+            problems.append(ResponseProblem(ResponseProblem.TRUNCATED_BODY,
+                                            f"Body has {body_size} of {content_length} bytes", WARNING))
+        if problems:
+            self._problems[RESPONSE_PROBLEMS] = problems
+        else:
+            self._problems.pop(RESPONSE_PROBLEMS, None)
 
     def get_time(self):
         return self._timestamp
@@ -47,13 +59,32 @@ class HttpResponse(HttpMessage):
 
     @property
     def headers(self):
-        return self._headers
+        return decode_headers(self._raw, self._offsets)
+
+    @property
+    def parsed(self) -> ParsedResponse:
+        """Parts of the response with their offsets into the raw response, which is parsed again"""
+        return parse_response(self._raw)
+
+    def get_problems(self, problem_type: Optional[int] = None):
+        self._validate()
+        if problem_type is None:
+            return self._problems.values()
+        return [p for hdr_problems in self._problems.values()
+                for p in hdr_problems if p.code == problem_type]
 
     def get_body(self) -> Optional[bytes]:
-        return self._raw_body
+        return self._body if self._body is not None else self._raw[self._offsets[0]:]
 
     def set_body(self, body: bytes) -> None:
-        self._raw_body = body
+        self._body = body
+        if self._problems is not None:
+            self._check_body_length()
+
+    def to_bytes(self) -> bytes:
+        # the body might have been set separately from the raw headers
+        # the raw headers are kept without the empty line, which terminates them
+        return self._raw[:self._offsets[0]].rstrip(b'\r\n') + b'\r\n\r\n' + self.get_body()
 
     def encode_base64(self) -> bytes:
-        return b64encode(self._raw)
+        return b64encode(self.to_bytes())
@@ -0,0 +1,291 @@
+import sys
+from array import array
+from logging import ERROR, WARNING, INFO
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from src.http_message.validation import HeaderProblem, RequestProblem, ResponseProblem
+
+# Single pass parser of the head of HTTP/1.x messages, which works on the raw bytes. Instead of rejecting or silently
+# repairing deviations from RFC 7230, the parser records them as problems, as these deviations are what we are looking
+# for (e.g. request smuggling). The positions of all parts are kept as offsets into the raw message.
+
+REQUEST_PROBLEMS = 'request'  # key of the problems, which don't concern a single header
+RESPONSE_PROBLEMS = 'response'
+_WHITESPACE = b' \t'
+_WHITESPACE_CHARS = frozenset(_WHITESPACE)
+_DEFAULT_VERSION = 'HTTP/0.9'  # a request line without version
+
+Span = Tuple[int, int]  # (start, end) offsets into the raw message
+MessageProblem = Union[HeaderProblem, RequestProblem, ResponseProblem]
+Problems = Dict[str, List[MessageProblem]]
+
+
+class HeaderField(NamedTuple):
+    name: str
+    value: str  # without surrounding whitespace; folded lines are joined by a single space
+    name_span: Span
+    value_span: Span  # includes any folded lines
+
+
+class ParsedRequest(NamedTuple):
+    method: str
+    target: str
+    version: str
+    request_line: Span
+    headers: List[HeaderField]
+    body_start: int  # length of the message if the end of the headers is missing
+    problems: Problems
+
+
+class ParsedResponse(NamedTuple):
+    version: str
+    status_code: int  # 0 if the status line is malformed
+    reason: str
+    status_line: Span
+    headers: List[HeaderField]
+    body_start: int  # length of the message if the end of the headers is missing
+    problems: Problems
+
+
+def _add(problems: Problems, key: str, problem: MessageProblem) -> None:
+    problems.setdefault(key, []).append(problem)
+
+
+def _add_message_problem(problems: Problems, is_request: bool, code: int, reason: str, severity: int = ERROR) -> None:
+    """Add a problem of the whole message, which is a RequestProblem or ResponseProblem"""
+    if is_request:
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(code, reason, severity))
+    else:
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(code, reason, severity))
+
+
+def _line_end(raw: bytes, pos: int, end: int, problems: Problems, is_request: bool) -> Tuple[int, int]:
+    """
+    :return: the end of the line starting at `pos` without and with its line terminator
+    """
+    lf = raw.find(b'\n', pos, end)
+    if lf < 0:
+        return end, end
+    if lf > pos and raw[lf - 1] == 13:  # CR
+        return lf - 1, lf + 1
+    key = REQUEST_PROBLEMS if is_request else RESPONSE_PROBLEMS
+    if not any(p.code == RequestProblem.BARE_LF for p in problems.get(key, [])):  # reported once
+        _add_message_problem(problems, is_request, RequestProblem.BARE_LF, f"Line at offset {pos} ends with LF only",
+                             WARNING)
+    return lf, lf + 1
+
+
+def _first_line(raw: bytes, problems: Problems, is_request: bool) -> Tuple[Span, int]:
+    """
+    Locate the request or status line, where empty lines in front of it are ignored (RFC 7230, section 3.5)
+    :return: the span of the line and the start of the next one
+    """
+    pos = 0
+    while raw.startswith(b'\r\n', pos) or raw.startswith(b'\n', pos):
+        pos += 2 if raw[pos] == 13 else 1
+    line_end, next_pos = _line_end(raw, pos, len(raw), problems, is_request)
+    if pos < line_end and raw[pos] in _WHITESPACE_CHARS:
+        _add_message_problem(problems, is_request, RequestProblem.LEADING_WHITESPACE,
+                             f"{'Request' if is_request else 'Status'} line starts with whitespace")
+    return (pos, line_end), next_pos
+
+
+def _parse_headers(raw: bytes, pos: int, problems: Problems, is_request: bool) -> Tuple[List[HeaderField], int]:
+    """
+    Parse the header lines starting at `pos`
+    :return: the header fields and the start of the body
+    """
+    end = len(raw)
+    has_nul = b'\x00' in raw  # checked once, so lines are only scanned for NUL bytes if there are any
+    has_cr = b'\r' in raw
+    headers: List[HeaderField] = []
+    body_start = -1
+    while pos < end:
+        line_end, next_pos = _line_end(raw, pos, end, problems, is_request)
+        if line_end == pos:  # empty line terminates the headers
+            body_start = next_pos
+            break
+        if has_cr:
+            cr = raw.find(b'\r', pos, line_end)
+            if cr >= 0:
+                _add_message_problem(problems, is_request, RequestProblem.BARE_CR, f"CR without LF at offset {cr}",
+                                     WARNING)
+        first = raw[pos]
+        if first in _WHITESPACE_CHARS:
+            if headers:  # obs-fold, i.e. the value continues on this line
+                previous = headers[-1]
+                continuation = raw[pos:line_end].strip(_WHITESPACE).decode('iso-8859-1')
+                headers[-1] = previous._replace(value=f"{previous.value} {continuation}".strip(),
+                                                value_span=(previous.value_span[0], line_end))
+                _add(problems, previous.name, HeaderProblem(HeaderProblem.OBS_FOLD, previous.name,
+                                                            "Header value is folded across multiple lines"))
+                pos = next_pos
+                continue
+            _add_message_problem(problems, is_request, RequestProblem.LEADING_WHITESPACE,
+                                 "First header line starts with whitespace")
+        colon = raw.find(b':', pos, line_end)
+        if colon < 0:
+            line = raw[pos:line_end].decode('iso-8859-1')
+            _add(problems, line, HeaderProblem(HeaderProblem.MISSING_COLON, line,
+                                               f"Header line '{line}' has no colon"))
+            pos = next_pos
+            continue
+        name = raw[pos:colon].decode('iso-8859-1')
+        value_start, value_end = colon + 1, line_end
+        while value_start < value_end and raw[value_start] in _WHITESPACE_CHARS:
+            value_start += 1
+        while value_end > value_start and raw[value_end - 1] in _WHITESPACE_CHARS:
+            value_end -= 1
+        value = raw[value_start:value_end].decode('iso-8859-1')
+        if colon > pos and raw[colon - 1] in _WHITESPACE_CHARS:
+            _add(problems, name, HeaderProblem(HeaderProblem.WHITESPACE_BEFORE_COLON, name,
+                                               f"Whitespace between header name '{name.strip()}' and colon"))
+        if has_nul and raw.find(b'\x00', pos, line_end) >= 0:
+            _add(problems, name, HeaderProblem(HeaderProblem.INVALID_CHARACTERS, name, "NUL bytes are not allowed"))
+        headers.append(HeaderField(name, value, (pos, colon), (value_start, value_end)))
+        pos = next_pos
+
+    if body_start < 0:
+        body_start = end
+        _add_message_problem(problems, is_request, RequestProblem.INCOMPLETE_HEADERS,
+                             "Headers are not terminated by an empty line", INFO)
+    return headers, body_start
+
+
+def parse_request(raw: bytes) -> ParsedRequest:
+    """
+    Parse the request line and headers of a request. The parser never fails: anything that doesn't fit into the
+    grammar of a request is reported as problem and parsing continues at the next line.
+    """
+    problems: Problems = {}
+    request_span, pos = _first_line(raw, problems, True)
+    request_line = raw[request_span[0]:request_span[1]].decode('iso-8859-1')
+    if '\x00' in request_line:
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        "Request line contains NUL bytes"))
+    method, target, version = _split_request_line(request_line, problems)
+    headers, body_start = _parse_headers(raw, pos, problems, True)
+    return ParsedRequest(method, target, version, request_span, headers, body_start, problems)
+
+
+def parse_request_line(raw: bytes) -> Tuple[str, str, str]:
+    """
+    Method, target and version of a request without parsing its headers, e.g. for views which only need metadata
+    """
+    problems: Problems = {}
+    request_span, _ = _first_line(raw, problems, True)
+    return _split_request_line(raw[request_span[0]:request_span[1]].decode('iso-8859-1'), problems)
+
+
+def parse_response(raw: bytes) -> ParsedResponse:
+    """
+    Parse the status line and headers of a response. Like `parse_request`, the parser never fails, so truncated
+    responses (e.g. of an incomplete capture) keep whatever could be parsed.
+    """
+    problems: Problems = {}
+    status_span, pos = _first_line(raw, problems, False)
+    status_line = raw[status_span[0]:status_span[1]].decode('iso-8859-1')
+    version, status_code, reason = _split_status_line(status_line, problems)
+    headers, body_start = _parse_headers(raw, pos, problems, False)
+    return ParsedResponse(version, status_code, reason, status_span, headers, body_start, problems)
+
+
+def count_header_names(headers: List[HeaderField]) -> int:
+    """
+    Number of distinct header names exactly as sent, so headers repeated with a different case (e.g. `Host` and
+    `host`, as used for request smuggling) are counted separately
+    """
+    return len({header.name for header in headers})
+
+
+def header_offsets(body_start: int, headers: List[HeaderField]) -> array:
+    """
+    Compact form of the parsed headers, which is kept instead of the parsed message: the start of the body followed by
+    the start and end of the name and of the value of every header
+    """
+    offsets = array('I', [body_start])
+    for header in headers:
+        offsets.extend((header.name_span[0], header.name_span[1], header.value_span[0], header.value_span[1]))
+    return offsets
+
+
+def decode_headers(raw: bytes, offsets: array) -> List[Tuple[str, str]]:
+    """Headers from their offsets (see `header_offsets`), where the names are interned as they repeat across messages"""
+    headers = []
+    for i in range(1, len(offsets), 4):
+        name = sys.intern(raw[offsets[i]:offsets[i + 1]].decode('iso-8859-1'))
+        headers.append((name, _decode_value(raw[offsets[i + 2]:offsets[i + 3]])))
+    return headers
+
+
+def header_value(raw: bytes, offsets: array, position: int) -> str:
+    """Value of the header at the given position of the offsets (see `header_offsets`)"""
+    i = 3 + 4 * position
+    return _decode_value(raw[offsets[i]:offsets[i + 1]])
+
+
+def _decode_value(value: bytes) -> str:
+    if b'\n' in value:  # folded lines are joined by a single space like in `_parse_headers`
+        return ' '.join(filter(None, (line.strip(b' \t\r').decode('iso-8859-1') for line in value.split(b'\n'))))
+    return value.decode('iso-8859-1')
+
+
+def _split_request_line(line: str, problems: Problems) -> Tuple[str, str, str]:
+    words = line.split()
+    if len(words) == 3:
+        method, target, version = words
+        if line.count(' ') != 2 or '\t' in line:
+            _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                            "Request line parts are not separated by single spaces",
+                                                            WARNING))
+    elif len(words) > 3:  # unencoded whitespace in the target
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        f"Request target contains whitespace: '{line}'"))
+        method, target, version = words[0], '%20'.join(words[1:-1]), words[-1]
+    elif len(words) == 2:
+        method, target, version = words[0], words[1], _DEFAULT_VERSION
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        f"Request line without HTTP version: '{line}'", WARNING))
+        return method, target, version
+    else:
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        f"Malformed request line: '{line}'"))
+        return (words[0] if words else ''), '', _DEFAULT_VERSION
+    if not _is_valid_version(version):
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        f"Bad request version '{version}'"))
+    elif version[5] != '1':
+        _add(problems, REQUEST_PROBLEMS, RequestProblem(RequestProblem.BAD_REQUESTLINE,
+                                                        f"Invalid HTTP version '{version}' for an HTTP/1.x request"))
+    return method, target, version
+
+
+def _is_valid_version(version: str) -> bool:
+    """HTTP-version = "HTTP/" DIGIT "." DIGIT"""
+    return len(version) == 8 and version.startswith('HTTP/') and version[5].isdigit() and version[6] == '.' and \
+        version[7].isdigit()
+
+
+def _split_status_line(line: str, problems: Problems) -> Tuple[str, int, str]:
+    """status-line = HTTP-version SP status-code SP reason-phrase, where the reason phrase may be empty"""
+    if not line:
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(ResponseProblem.BAD_STATUSLINE, "Missing status line"))
+        return '', 0, ''
+    parts = line.lstrip(' \t').split(' ', 2)
+    version = parts[0]
+    if not _is_valid_version(version):
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(ResponseProblem.BAD_STATUSLINE,
+                                                          f"Bad response version '{version}'"))
+    if len(parts) < 2 or len(parts[1]) != 3 or not parts[1].isdigit():
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(ResponseProblem.BAD_STATUSLINE,
+                                                          f"Malformed status line: '{line}'"))
+        return version, 0, ''
+    status_code = int(parts[1])
+    if not 100 <= status_code <= 599:
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(ResponseProblem.INVALID_STATUS,
+                                                          f"Status code {status_code} is out of range", WARNING))
+    if len(parts) < 3:
+        _add(problems, RESPONSE_PROBLEMS, ResponseProblem(ResponseProblem.BAD_STATUSLINE,
+                                                          "Status line without space before the reason phrase", INFO))
+        return version, status_code, ''
+    return version, status_code, parts[2].strip(' \t')
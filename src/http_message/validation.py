@@ -1,10 +1,11 @@
 import re
-from typing import List, Tuple, Union, Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Tuple, Union, Dict, Optional
 from dataclasses import dataclass
-import logging
 from logging import CRITICAL, ERROR, WARNING, INFO, NOTSET
 
-from src.http_message.HttpHeaders import generate_headers, HeaderConstraints
+from src.http_message.HttpHeaders import generate_headers, HeaderConstraints, HeaderProperty
 
 
 # TODO combine Requestproblem and HeaderProblem
@@ -12,12 +13,32 @@ from src.http_message.HttpHeaders import generate_headers, HeaderConstraints
 @dataclass
 class RequestProblem:
     BAD_REQUESTLINE = 1
+    LEADING_WHITESPACE = 12  # before the request line or the first header
+    BARE_LF = 13  # line terminated by LF instead of CRLF
+    BARE_CR = 14  # CR, which is not followed by LF
+    INCOMPLETE_HEADERS = 15  # no empty line after the headers
 
     code: int = BAD_REQUESTLINE
     reason: str = ''
     severity: int = ERROR  # use pythons logging levels [CRITICAL, ERROR, WARNING, INFO, NOTSET]
 
 
+@dataclass
+class ResponseProblem:
+    BAD_STATUSLINE = 16
+    INVALID_STATUS = 17  # status code outside of 100-599
+    TRUNCATED_BODY = 18  # body is shorter than its Content-Length
+    # same deviations of the message framing as for requests
+    LEADING_WHITESPACE = RequestProblem.LEADING_WHITESPACE
+    BARE_LF = RequestProblem.BARE_LF
+    BARE_CR = RequestProblem.BARE_CR
+    INCOMPLETE_HEADERS = RequestProblem.INCOMPLETE_HEADERS
+
+    code: int = BAD_STATUSLINE
+    reason: str = ''
+    severity: int = ERROR  # use pythons logging levels [CRITICAL, ERROR, WARNING, INFO, NOTSET]
+
+
 @dataclass
 class HeaderProblem:
     INVALID_VALUE = 2
@@ -27,6 +48,9 @@ class HeaderProblem:
     MALFORMED_HEADER = 6
     NONSTANDARD_HEADER = 7
     ATYPICAL_CAPITALIZATION = 8
+    OBS_FOLD = 9  # value continued on the next line (obsolete line folding)
+    WHITESPACE_BEFORE_COLON = 10
+    MISSING_COLON = 11
 
     code: int
     headers: Union[str, Tuple[str, str]]
@@ -34,6 +58,225 @@ class HeaderProblem:
     severity: int = ERROR  # use pythons logging levels [CRITICAL, ERROR, WARNING, INFO, NOTSET]
 
 
+# value char according to RFC7230 (tchar) and further characters found in common header values
+_TCHAR = r"!#$%&'*+-.^_`|~\w"
+_EXTRA_CHARS = r"/=,;:()"
+VALUE_PATTERN = re.compile(fr"^[\t ]?([ {_TCHAR}{_EXTRA_CHARS}]+)[\t ]*$")
+URI_PATTERN = re.compile(r"\w+:(\/?\/?)[^\s]+")
+CONFLICTING_HEADERS = [
+    ('Transfer-Encoding', 'Content-Length')
+]
+UNKNOWN_HEADER = "UNKNOWN_HEADER"  # key of the problems of non-standard headers
+
+Check = Callable[[str], Tuple[bool, Optional[str]]]
+Verdict = Tuple[str, Tuple[HeaderProblem, ...]]  # key of the problems and the problems of a single header field
+
+DEFAULT_CACHE_SIZE = 1 << 16  # verdicts per validator
+MAX_CACHED_VALUE = 512  # longer values (e.g. session cookies) are rarely repeated, thus not cached
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+
+class VerdictCache:
+    """
+    Bounded LRU cache of the verdicts of header fields by (name, value), as real traffic repeats the same fields over
+    and over. It may be used from multiple threads.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._verdicts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[Verdict]]:
+        """Verdicts of the given header fields (None if not cached), which are looked up at once for a message"""
+        with self._lock:
+            verdicts = list(map(self._verdicts.get, keys))
+            move_to_end = self._verdicts.move_to_end
+            hits = 0
+            for key, verdict in zip(keys, verdicts):
+                if verdict is not None:
+                    move_to_end(key)
+                    hits += 1
+            self._hits += hits
+            self._misses += len(keys) - hits
+            return verdicts
+
+    def put_many(self, verdicts: List[Tuple[Tuple[str, str], Verdict]]) -> None:
+        with self._lock:
+            self._verdicts.update(verdicts)
+            while len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+
+    def resize(self, max_size: int) -> None:
+        """Change the number of cached verdicts, where the least recently used ones are dropped"""
+        with self._lock:
+            self.max_size = max_size
+            while len(self._verdicts) > max_size:
+                self._verdicts.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._verdicts.clear()
+            self._hits = self._misses = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, len(self._verdicts), self.max_size)
+
+
+class HeaderValidator:
+    """
+    Compiled form of the header rules in `HttpHeaders` for either requests or responses. The rules are resolved once
+    into a check per header name and a table of the lower case names, so validating a message only does dict lookups
+    and runs precompiled patterns. The verdict of every header field is cached (see `VerdictCache`), while the checks
+    between the fields of a message (duplicates, conflicts) are done for every message. The rules aren't modified
+    after construction and the cache is synchronized, thus it is safe to share a validator between threads.
+    :param cache_size: number of cached verdicts, where 0 disables the cache
+    """
+
+    def __init__(self, is_request: bool, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.is_request = is_request
+        self.cache = VerdictCache(cache_size)
+        wellknown_hdrs = generate_headers(for_request=is_request)
+        self._checks: Dict[str, Optional[Check]] = {name: self._compile(constraints)
+                                                    for name, constraints in wellknown_hdrs.items()}
+        self._stripped_names = frozenset(self._checks)
+        self._conflicting_names = frozenset(name for names in CONFLICTING_HEADERS for name in names)
+        self._lower_names: Dict[str, str] = {}  # lower case name to standard capitalization
+        for name in wellknown_hdrs:
+            self._lower_names.setdefault(name.lower(), name)
+
+    @staticmethod
+    def _compile(constraints) -> Optional[Check]:
+        if constraints is None:
+            return None
+        if isinstance(constraints, HeaderConstraints):
+            return HeaderValidator._compile_constraints(constraints)
+        if isinstance(constraints, list):  # list of possible values
+            allowed = frozenset(constraints)
+            reason = ', '.join(constraints)
+            return lambda value: (True, None) if value in allowed else (False, f"'{value}' is not one of {reason}")
+        if callable(constraints):  # predicate function to validate header
+            return constraints
+        raise NotImplementedError
+
+    def _evaluate_field(self, hdr_name: str, value: str) -> Verdict:
+        """Problems of a single header field and the key they are reported under"""
+        hdr_problems = []
+        checks = self._checks
+        if hdr_name in checks:
+            check = checks[hdr_name]
+            if check is not None:
+                is_valid, reason = check(value)
+                if not is_valid:
+                    hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_VALUE, hdr_name, reason))
+            if VALUE_PATTERN.match(value) is None and URI_PATTERN.match(value) is None:
+                # TODO allow URI pattern only for specific headers (e.g. Referer,
+                hdr_problems.append(HeaderProblem(HeaderProblem.MALFORMED_HEADER, hdr_name,
+                                                  f"'{value}' is a malformed value for header'{hdr_name}'"))
+            if '\r\n' in value:
+                hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_CHARACTERS, hdr_name,
+                                                  f"'\\r\\n' are not allowed"))
+        elif hdr_name.strip() in self._stripped_names:  # header had 'just' malformed whitespaces
+            reason = f"Header name '{hdr_name}' must not contain leading or trailing whitespaces"
+            hdr_problems.append(HeaderProblem(HeaderProblem.MALFORMED_HEADER, hdr_name, reason))
+            hdr_name = hdr_name.strip()
+        else:
+            standard_cap = self._lower_names.get(hdr_name.lower())
+            if standard_cap is not None:
+                reason = f"Header '{hdr_name}' has an atypical capitalization; correct would be '{standard_cap}'"
+                hdr_problems.append(
+                    HeaderProblem(HeaderProblem.ATYPICAL_CAPITALIZATION, hdr_name, reason, WARNING))
+                hdr_name = standard_cap
+            else:
+                # TODO temporary workaround for unknown headers
+                hdr_problems.append(HeaderProblem(HeaderProblem.NONSTANDARD_HEADER, hdr_name, value, INFO))
+                hdr_name = UNKNOWN_HEADER
+        return hdr_name, tuple(hdr_problems)
+
+    @staticmethod
+    def _compile_constraints(constraints: HeaderConstraints) -> Check:
+        """Same check as `HeaderConstraints.is_valid` with its flags and allowed values resolved up front"""
+        numeric = bool(constraints._flags & HeaderProperty.NUMERIC)
+        if constraints.allowed_values is None:
+            allowed, patterns, allowed_str = None, [], ''
+        else:
+            allowed = frozenset(v for v in constraints.allowed_values if not isinstance(v, re.Pattern))
+            patterns = [v for v in constraints.allowed_values if isinstance(v, re.Pattern)]
+            allowed_str = ', '.join(v.pattern if isinstance(v, re.Pattern) else v for v in constraints.allowed_values)
+
+        def check(value: str) -> Tuple[bool, Optional[str]]:
+            if numeric and not value.isdigit():
+                return False, 'Value is not a valid number'
+            if allowed is not None and value not in allowed and not any(p.fullmatch(value) for p in patterns):
+                return False, f"'{value}' is not one of [{allowed_str}]"
+            return True, ''
+        return check
+
+    def evaluate(self, headers: List[Tuple[str, str]]) -> Dict[str, List[HeaderProblem]]:
+        """See `evaluate_headers`"""
+        problems: Dict[str, List[HeaderProblem]] = {}
+
+        if len({hdr_name.lower() for hdr_name, _ in headers}) < len(headers):  # only count if there are duplicates
+            for hdr_name, hdr_count in _check_duplicate_headers(headers).items():
+                if hdr_count > 1:
+                    problems[hdr_name] = [HeaderProblem(HeaderProblem.DUPLICATE_HEADERS, hdr_name,
+                                                        f"Header '{hdr_name}' found {hdr_count} times!")]
+
+        if self.cache.max_size > 0:
+            # header fields are looked up as (name, value), where long values are validated without caching
+            cacheable = [field for field in headers if len(field[1]) <= MAX_CACHED_VALUE]
+            cached = dict(zip(cacheable, self.cache.get_many(cacheable)))
+        else:
+            cached = {}
+        new_verdicts = []
+        for field in headers:
+            verdict = cached.get(field)
+            if verdict is None:
+                verdict = self._evaluate_field(*field)
+                if field in cached:
+                    new_verdicts.append((field, verdict))
+            key, hdr_problems = verdict
+            if len(hdr_problems) > 0:
+                problems[key] = list(hdr_problems)
+        if new_verdicts:
+            self.cache.put_many(new_verdicts)
+
+        if self._conflicting_names.isdisjoint([hdr_name for hdr_name, _ in headers]):
+            return problems
+        for hdr1, hdr2 in _check_conflicting_headers(headers):
+            problems[hdr1] = [HeaderProblem(HeaderProblem.CONFLICTING_HEADERS, (hdr1, hdr2),
+                                            f"'{hdr1}' and '{hdr2}' must not be set together")]
+        return problems
+
+
+_VALIDATORS = {True: HeaderValidator(True), False: HeaderValidator(False)}
+
+
+def get_validator(is_request: bool) -> HeaderValidator:
+    """The shared validator of request or response headers"""
+    return _VALIDATORS[is_request]
+
+
+def set_cache_size(max_size: int) -> None:
+    """Set the number of cached verdicts of each shared validator, where 0 disables caching"""
+    for validator in _VALIDATORS.values():
+        validator.cache.resize(max_size)
+
+
+def cache_stats() -> Dict[str, CacheStats]:
+    """Hits, misses and size of the verdict caches of the shared request and response validators"""
+    return {'request': _VALIDATORS[True].cache.stats(), 'response': _VALIDATORS[False].cache.stats()}
+
+
 def evaluate_headers(is_request: bool, headers: List[Tuple[str, str]]) -> Dict[str, List[HeaderProblem]]:
     """Standardize the given headers and evaluate, if there are any deviations from the RFC 7234 spec.
 	All deviations are collected in a dictionary, where the key is the header name and
@@ -43,80 +286,7 @@ def evaluate_headers(is_request: bool, headers: List[Tuple[str, str]]) -> Dict[s
     # invalid bytes (null bytes, etc.)
     # TODO handle non-standard (and not common) headers
     # Set-Cookie header may appear multiple times w/o being aggregated to a single entry
-    wellknown_hdrs = generate_headers(for_request=is_request)
-    problems: Dict[str, List[HeaderProblem]] = {}
-    # hdr_pattern = re.compile(r"(?P<name>[\w\-]+):[ \t]?(?P<value>.+)")
-    tchar = r"!#$%&'*+-.^_`|~\w"  # valid value char according to RFC7230
-    extrachars = r"/=,;:()"
-    value_pattern = re.compile(fr"^[\t ]?([ {tchar}{extrachars}]+?)[\t ]*$")
-    uri_pattern = re.compile(fr"\w+:(\/?\/?)[^\s]+")
-
-    # duplicate headers
-    hdr_frequency = _check_duplicate_headers(headers)
-    for hdr_name, hdr_count in [(hdr, hdr_count) for hdr, hdr_count in hdr_frequency.items() if hdr_count > 1]:
-        problems[hdr_name] = [HeaderProblem(HeaderProblem.DUPLICATE_HEADERS, hdr_name,
-                                            f"Header '{hdr_name}' found {hdr_count} times!")]
-
-    for hdr_name, value in headers:
-        hdr_problems = []
-        try:
-            hdr_contraints = wellknown_hdrs[hdr_name]
-            if hdr_contraints is not None:
-                if isinstance(hdr_contraints, HeaderConstraints):
-                    is_valid, reason = hdr_contraints.is_valid(value)
-                    if not is_valid:
-                        hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_VALUE, hdr_name, reason))
-                elif isinstance(hdr_contraints, list):  # list of possible values
-                    if value not in hdr_contraints:
-                        hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_VALUE, hdr_name,
-                                                          f"'{value}' is not one of {', '.join(hdr_contraints)}"))
-                elif callable(hdr_contraints):  # predicate function to validate header
-                    is_valid, reason = hdr_contraints(value)
-                    if not is_valid:
-                        hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_VALUE, hdr_name, reason))
-                else:
-                    raise NotImplementedError
-            m = value_pattern.match(value)
-            if m is None:
-                uri_match = uri_pattern.match(value)  # TODO allow URI pattern only for specific headers (e.g. Referer,
-                if uri_match is None:
-                    hdr_problems.append(HeaderProblem(HeaderProblem.MALFORMED_HEADER, hdr_name,
-                                                      f"'{value}' is a malformed value for header'{hdr_name}'"))
-            if '\r\n' in value:
-                hdr_problems.append(HeaderProblem(HeaderProblem.INVALID_CHARACTERS, hdr_name,
-                                                  f"'\\r\\n' are not allowed"))
-        except KeyError as exc:  # header is not well-known
-            if hdr_name.strip() in wellknown_hdrs:  # header had 'just' malformed whitespaces
-                reason = f"Header name '{hdr_name}' must not contain leading or trailing whitespaces"
-                hdr_problems.append(HeaderProblem(HeaderProblem.MALFORMED_HEADER, hdr_name, reason))
-                hdr_name = hdr_name.strip()
-            else:
-                standard_cap = _check_header_capitalization(hdr_name, list(wellknown_hdrs.keys()))
-                if standard_cap is not None:
-                    reason = f"Header '{hdr_name}' has an atypical capitalization; correct would be '{standard_cap}'"
-                    hdr_problems.append(
-                        HeaderProblem(HeaderProblem.ATYPICAL_CAPITALIZATION, hdr_name, reason, WARNING))
-                    hdr_name = standard_cap
-                else:
-                    # TODO temporary workaround for unknown headers
-                    hdr_problems.append(HeaderProblem(HeaderProblem.NONSTANDARD_HEADER, hdr_name, value, INFO))
-                    hdr_name = "UNKNOWN_HEADER"
-
-        if len(hdr_problems) > 0:
-            problems[hdr_name] = hdr_problems
-
-    conflicts = _check_conflicting_headers(headers)
-    for hdr1, hdr2 in conflicts:
-        problems[hdr1] = [HeaderProblem(HeaderProblem.CONFLICTING_HEADERS, (hdr1, hdr2),
-                                        f"'{hdr1}' and '{hdr2}' must not be set together")]
-    return problems
-
-
-def _check_header_capitalization(hdr_name: str, known_headers: List[str]) -> Optional[str]:
-    """Check if the case of the header is off and if so, what the 'standard' case should be"""
-    hdr_as_lower_case = hdr_name.lower()
-    correct_name = next((h for h in known_headers if h.lower() == hdr_as_lower_case), None)
-    return correct_name
+    return _VALIDATORS[is_request].evaluate(headers)
 
 
 def _check_duplicate_headers(headers: List[Tuple[str, str]]) -> Dict[str, int]:
@@ -125,8 +295,6 @@ def _check_duplicate_headers(headers: List[Tuple[str, str]]) -> Dict[str, int]:
     hdr_counts = {}
     case_mapping = {}
 
-    logging.info(f"checking for duplicates in {headers}")
-
     for hdr, _ in headers:
         hdr_lower = hdr.lower()
         hdr_counts[hdr_lower] = hdr_counts.get(hdr_lower, 0) + 1
@@ -144,9 +312,5 @@ def _check_conflicting_headers(headers: List[Tuple[str, str]]) -> List[Tuple[str
     """Check for headers that may no not appear in conjunction"""
     hdrs = dict(
         headers)  # temporary workaround; converting to dict may lead to unwanted behavior for duplicate headers
-    antagonists = [
-        ('Transfer-Encoding', 'Content-Length')
-    ]
-
-    conflicts = [(h1, h2) for h1, h2 in antagonists if h1 in hdrs and h2 in hdrs]
+    conflicts = [(h1, h2) for h1, h2 in CONFLICTING_HEADERS if h1 in hdrs and h2 in hdrs]
     return conflicts
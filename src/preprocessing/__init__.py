@@ -0,0 +1,3 @@
+from .columnar import parse_exchanges, exchanges_to_frame, header_column
+from .header_validation import header_table, validate_header_table
+from .signatures import Signature, SignatureMatcher, load_signatures, get_matcher, signature_features
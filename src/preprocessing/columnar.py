@@ -0,0 +1,172 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.http_message.http_exchange import HttpExchange
+from src.http_message.http_request import HTTP_METHODS
+from src.http_message.parsing import count_header_names, parse_request, parse_response
+from src.http_message.validation import evaluate_headers
+from src.preprocessing.signatures import SignatureMatcher
+
+# Columnar conversion of exchanges for the analysis with pandas. The raw messages are parsed straight into
+# preallocated numpy buffers, where strings are stored as codes of their categories, so neither a dict nor a message
+# object is kept per row.
+
+# src_ip, dst_ip, timestamp, request, response, rtt, status code and response size (used if there is no response)
+Row = Tuple[str, str, float, bytes, Optional[bytes], float, Optional[int], Optional[int]]
+INITIAL_SIZE = 1 << 12
+
+_NUMERIC_COLUMNS = {
+    'timestamp': np.float64,
+    '#_headers': np.int16,
+    'request_size': np.int32,
+    'response_size': np.int32,
+    'status_code': np.int16,
+    'rtt': np.float64,
+    'request_problems': np.uint32,  # bit `code` is set for every problem code of the request
+    'response_problems': np.uint32,
+}
+_NULLABLE_COLUMNS = {'response_size': 'Int32', 'status_code': 'Int16'}  # may be missing without response
+_CATEGORICAL_COLUMNS = ['source_ip', 'destination_ip', 'method', 'path', 'version']
+_COLUMN_ORDER = ['source_ip', 'destination_ip', 'timestamp', 'method', 'path', 'version', '#_headers', 'request_size',
+                 'response_size', 'status_code', 'rtt', 'request_problems', 'response_problems']
+
+
+class _Categories:
+    """Codes of the distinct values of a categorical column in order of their first occurrence"""
+
+    def __init__(self, initial: Sequence[str] = ()):
+        self.codes: Dict[str, int] = {value: code for code, value in enumerate(initial)}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def to_categorical(self, codes: np.ndarray) -> pd.Categorical:
+        return pd.Categorical.from_codes(codes, categories=list(self.codes))
+
+
+def header_column(header_name: str) -> str:
+    """Name of the column of a header, e.g. 'user_agent' for the User-Agent header"""
+    return header_name.lower().replace('-', '_')
+
+
+def _problem_flags(problems: Dict[str, List]) -> int:
+    flags = 0
+    for hdr_problems in problems.values():
+        for p in hdr_problems:
+            flags |= 1 << p.code
+    return flags
+
+
+def parse_exchanges(rows: Iterable[Row], size_hint: int = 0, header_columns: Sequence[str] = (),
+                    validate: bool = True, signatures: Optional[SignatureMatcher] = None) -> pd.DataFrame:
+    """
+    Parse the raw messages of the exchanges into a DataFrame with one row per exchange. Strings become categorical
+    columns, status code and response size are nullable integers, which are taken from the row for exchanges without
+    response (e.g. from an access log) and are missing if unknown.
+    :param rows: source and destination IP, timestamp, raw request, raw response (or None), rtt, status code and
+        response size (or None) of every exchange
+    :param size_hint: expected number of rows, for which the buffers are allocated up front (they grow as needed)
+    :param header_columns: headers, whose (first) value of the request is added as categorical column
+        (see `header_column` for the name of the column)
+    :param validate: include the problems found by `evaluate_headers` in the problem flags of the requests and not
+        only those of the parser. The problem flags of the responses are always those of the parser.
+    :param signatures: scan the requests for these signatures and add the number of signatures found per category
+        as column `<category>_signatures`
+    """
+    size = max(size_hint, 1) if size_hint else INITIAL_SIZE
+    numeric = {name: np.zeros(size, dtype) for name, dtype in _NUMERIC_COLUMNS.items()}
+    signature_columns = [f'{category}_signatures' for category in signatures.categories] if signatures else []
+    numeric.update({column: np.zeros(size, np.uint8) for column in signature_columns})
+    missing = {name: np.zeros(size, np.bool_) for name in _NULLABLE_COLUMNS}
+    categories = {name: _Categories(HTTP_METHODS if name == 'method' else ()) for name in _CATEGORICAL_COLUMNS}
+    header_names = {header_name.lower(): header_column(header_name) for header_name in header_columns}
+    categories.update({column: _Categories() for column in header_names.values()})
+    codes = {name: np.full(size, -1, np.int32) for name in categories}
+
+    n = 0
+    for src_ip, dst_ip, timestamp, raw_request, raw_response, rtt, status_code, response_size in rows:
+        if n == size:  # grow all buffers by doubling their size
+            size *= 2
+            numeric = {name: _resize(buffer, size, 0) for name, buffer in numeric.items()}
+            missing = {name: _resize(buffer, size, False) for name, buffer in missing.items()}
+            codes = {name: _resize(buffer, size, -1) for name, buffer in codes.items()}
+
+        request = parse_request(raw_request)
+        codes['source_ip'][n] = categories['source_ip'].code(src_ip)
+        codes['destination_ip'][n] = categories['destination_ip'].code(dst_ip)
+        codes['method'][n] = categories['method'].code(request.method)
+        codes['path'][n] = categories['path'].code(request.target)
+        codes['version'][n] = categories['version'].code(request.version)
+        names = set()
+        for header in request.headers:
+            name = header.name.strip().lower()
+            column = header_names.get(name)
+            if column is not None and name not in names:
+                codes[column][n] = categories[column].code(header.value)
+            names.add(name)
+        numeric['#_headers'][n] = count_header_names(request.headers)  # like `HttpExchange.num_headers`
+        numeric['timestamp'][n] = timestamp
+        numeric['rtt'][n] = rtt
+        numeric['request_size'][n] = len(raw_request)
+        flags = _problem_flags(request.problems)
+        if validate:
+            flags |= _problem_flags(evaluate_headers(True, [(h.name, h.value) for h in request.headers]))
+        numeric['request_problems'][n] = flags
+        if signatures is not None:
+            hits = 0
+            for field_hits in signatures.scan_request(raw_request, request).values():
+                hits |= field_hits
+            for category, count in signatures.category_counts(hits).items():
+                numeric[f'{category}_signatures'][n] = count
+
+        if raw_response is None:
+            for name, value in (('status_code', status_code), ('response_size', response_size)):
+                if value is None:
+                    missing[name][n] = True
+                else:
+                    numeric[name][n] = value
+        else:
+            response = parse_response(raw_response)
+            numeric['status_code'][n] = response.status_code
+            numeric['response_size'][n] = len(raw_response)
+            numeric['response_problems'][n] = _problem_flags(response.problems)
+        n += 1
+
+    columns = {}
+    for name in _COLUMN_ORDER:
+        if name in numeric:
+            values = numeric[name][:n]
+            if name in _NULLABLE_COLUMNS:
+                values = pd.array(values, dtype=_NULLABLE_COLUMNS[name])
+                values[missing[name][:n]] = pd.NA
+            columns[name] = values
+        else:
+            columns[name] = categories[name].to_categorical(codes[name][:n])
+    for column in header_names.values():
+        columns[column] = categories[column].to_categorical(codes[column][:n])
+    for column in signature_columns:
+        columns[column] = numeric[column][:n]
+    return pd.DataFrame(columns)
+
+
+def _resize(buffer: np.ndarray, size: int, fill) -> np.ndarray:
+    resized = np.full(size, fill, buffer.dtype)
+    resized[:len(buffer)] = buffer
+    return resized
+
+
+def exchanges_to_frame(exchanges: Iterable[HttpExchange], header_columns: Sequence[str] = (),
+                       validate: bool = True, signatures: Optional[SignatureMatcher] = None) -> pd.DataFrame:
+    """
+    DataFrame of the exchanges (see `parse_exchanges`), which is built from their raw messages, so exchanges that
+    haven't been parsed yet (see `HttpExchange`) are not parsed as objects
+    """
+    size_hint = len(exchanges) if hasattr(exchanges, '__len__') else 0
+    rows = ((e.src_ip, e.dst_ip, e.timestamp, e.get_raw_request(), e.get_raw_response(), e.rtt, e.status_code,
+             e.response_size) for e in exchanges)
+    return parse_exchanges(rows, size_hint, header_columns, validate, signatures)
@@ -0,0 +1,182 @@
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from src.http_message.HttpHeaders import HeaderConstraints, HeaderProperty, generate_headers
+from src.http_message.http_exchange import HttpExchange
+from src.http_message.parsing import parse_request
+from src.http_message.validation import CONFLICTING_HEADERS, UNKNOWN_HEADER, URI_PATTERN, VALUE_PATTERN, \
+    HeaderProblem, WARNING, INFO, ERROR
+
+# Validation of the headers of a whole corpus at once. The headers are given in long format, i.e. one row per header
+# field with the id of its exchange, and the rules of `evaluate_headers` are applied as column operations. A header
+# field is validated by its name and value only, so every distinct field is validated once, no matter how often it
+# occurs in the corpus.
+
+PROBLEM_COLUMNS = ['exchange_id', 'key', 'name', 'code', 'severity', 'reason']
+
+
+def header_table(exchanges: Iterable[HttpExchange]) -> pd.DataFrame:
+    """
+    Long format of the request headers of the exchanges with the columns `exchange_id`, `name` and `value`, where the
+    id is the position of the exchange, i.e. the index of its row in `exchanges_to_frame`
+    """
+    ids: List[int] = []
+    names: List[str] = []
+    values: List[str] = []
+    for exchange_id, exchange in enumerate(exchanges):
+        for header in parse_request(exchange.get_raw_request()).headers:
+            ids.append(exchange_id)
+            names.append(header.name)
+            values.append(header.value)
+    return pd.DataFrame({'exchange_id': np.array(ids, np.int64), 'name': names, 'value': values})
+
+
+def validate_header_table(headers: pd.DataFrame, is_request: bool = True) -> pd.DataFrame:
+    """
+    Validate the header fields of many messages at once with the same rules as `evaluate_headers`: the constraints
+    of `HttpHeaders`, malformed values, whitespaces and capitalization of the names, duplicate and conflicting headers.
+    :param headers: one row per header field with the columns `exchange_id`, `name` and `value`, in the order of the
+        fields within each message (see `header_table`)
+    :param is_request: validate with the rules of request or response headers
+    :return: one row per problem with the columns `exchange_id`, `key` (the key of the problem in the result of
+        `evaluate_headers`), `name` (the name of the header field as sent), `code`, `severity` and `reason`, which can
+        be joined back to the exchanges on `exchange_id`. Unlike `evaluate_headers`, which keeps only the problems
+        found last for a key, all problems are listed.
+    """
+    if len(headers) == 0:
+        return pd.DataFrame(columns=PROBLEM_COLUMNS)
+    # header fields, names and exchanges are handled by their codes, so only the distinct strings are processed
+    exchange_ids = headers['exchange_id'].to_numpy()
+    name_codes, names = pd.factorize(headers['name'])
+    value_codes, values = pd.factorize(headers['value'])
+    n_values = len(values)
+    field_ids, fields = pd.factorize(name_codes.astype(np.int64) * n_values + value_codes)
+    names, values = np.asarray(names, dtype=object), np.asarray(values, dtype=object)
+    # object columns, as the patterns are applied with python's `re` (and not the regex engine of pyarrow)
+    fields = pd.DataFrame({'name': pd.Series(names[fields // n_values], dtype=object),
+                           'value': pd.Series(values[fields % n_values], dtype=object)})
+
+    by_field = _field_problems(fields, is_request).set_index('field_id')
+    per_row = pd.DataFrame({'exchange_id': exchange_ids, 'field_id': field_ids, 'position': np.arange(len(headers))})
+    per_row = per_row[np.isin(field_ids, by_field.index.to_numpy())]
+    problems = per_row.merge(by_field, left_on='field_id', right_index=True).drop(columns='field_id')
+
+    frames = [problems, _duplicate_problems(exchange_ids, name_codes, names),
+              _conflict_problems(exchange_ids, name_codes, names)]
+    problems = pd.concat([f for f in frames if len(f) > 0] or [frames[0]], ignore_index=True)
+    problems = problems.sort_values(['exchange_id', 'position'], kind='stable', ignore_index=True)
+    problems['code'] = problems['code'].astype(np.int8)
+    problems['severity'] = problems['severity'].astype(np.int8)
+    problems['key'] = problems['key'].astype('category')
+    problems['name'] = problems['name'].astype('category')
+    return problems[PROBLEM_COLUMNS]
+
+
+def _problems(field_ids, keys, names, code: int, reasons, severity: int = ERROR) -> pd.DataFrame:
+    problems = pd.DataFrame({'key': keys, 'name': names, 'code': code, 'severity': severity, 'reason': reasons},
+                            index=pd.Index(field_ids, name='field_id'))
+    return problems.reset_index()
+
+
+def _field_problems(fields: pd.DataFrame, is_request: bool) -> pd.DataFrame:
+    """Problems of the distinct header fields (see `HeaderValidator._evaluate_field`) by their id"""
+    wellknown_hdrs = generate_headers(for_request=is_request)
+    lower_names = {}  # lower case name to standard capitalization
+    for name in wellknown_hdrs:
+        lower_names.setdefault(name.lower(), name)
+
+    names, values = fields['name'], fields['value']
+    known = names.isin(wellknown_hdrs.keys())
+    stripped = names.str.strip()
+    whitespaces = ~known & stripped.isin(wellknown_hdrs.keys())
+    standard_caps = names.str.lower().map(lower_names).astype(object)
+    atypical = ~known & ~whitespaces & standard_caps.notna()
+    nonstandard = ~known & ~whitespaces & ~atypical
+
+    frames = []
+    known_fields = fields[known]
+    for name, group in known_fields.groupby('name', sort=False):
+        invalid, reasons = _constraint_violations(wellknown_hdrs[name], group['value'])
+        if invalid.any():
+            frames.append(_problems(group.index[invalid.to_numpy()], name, name, HeaderProblem.INVALID_VALUE,
+                                    reasons[invalid]))
+
+    known_values = values[known]
+    malformed = ~known_values.str.match(VALUE_PATTERN.pattern) & ~known_values.str.match(URI_PATTERN.pattern)
+    malformed = malformed[malformed].index
+    frames.append(_problems(malformed, names[malformed], names[malformed], HeaderProblem.MALFORMED_HEADER,
+                            "'" + values[malformed] + "' is a malformed value for header'" + names[malformed] + "'"))
+    line_breaks = known_values.str.contains('\r\n', regex=False)
+    line_breaks = line_breaks[line_breaks].index
+    frames.append(_problems(line_breaks, names[line_breaks], names[line_breaks], HeaderProblem.INVALID_CHARACTERS,
+                            "'\\r\\n' are not allowed"))
+
+    idx = whitespaces[whitespaces].index
+    frames.append(_problems(idx, stripped[idx], names[idx], HeaderProblem.MALFORMED_HEADER,
+                            "Header name '" + names[idx] + "' must not contain leading or trailing whitespaces"))
+    idx = atypical[atypical].index
+    frames.append(_problems(idx, standard_caps[idx], names[idx], HeaderProblem.ATYPICAL_CAPITALIZATION,
+                            "Header '" + names[idx] + "' has an atypical capitalization; correct would be '"
+                            + standard_caps[idx] + "'", WARNING))
+    idx = nonstandard[nonstandard].index
+    frames.append(_problems(idx, UNKNOWN_HEADER, names[idx], HeaderProblem.NONSTANDARD_HEADER, values[idx], INFO))
+
+    # the problems of a field are in the same order as in `evaluate_headers`
+    return pd.concat(frames, ignore_index=True).sort_values('field_id', kind='stable')
+
+
+def _constraint_violations(constraints, values: pd.Series):
+    """Mask of the values violating the constraints of their header and the reasons (see `HeaderValidator._compile`)"""
+    if constraints is None:
+        return pd.Series(False, index=values.index), None
+    if isinstance(constraints, HeaderConstraints):
+        invalid = pd.Series(False, index=values.index)
+        reasons = pd.Series('', index=values.index, dtype=object)
+        if constraints._flags & HeaderProperty.NUMERIC:
+            invalid = ~values.str.isdigit()
+            reasons[invalid] = 'Value is not a valid number'
+        if constraints.allowed_values is not None:
+            patterns = [v for v in constraints.allowed_values if not isinstance(v, str)]
+            not_allowed = ~invalid & ~values.isin([v for v in constraints.allowed_values if isinstance(v, str)])
+            for pattern in patterns:
+                not_allowed &= ~values.str.fullmatch(pattern.pattern, flags=pattern.flags)
+            allowed_str = ', '.join(v if isinstance(v, str) else v.pattern for v in constraints.allowed_values)
+            reasons[not_allowed] = "'" + values[not_allowed] + f"' is not one of [{allowed_str}]"
+            invalid |= not_allowed
+        return invalid, reasons
+    if isinstance(constraints, list):  # list of possible values
+        return ~values.isin(constraints), "'" + values + "' is not one of " + ', '.join(constraints)
+    if callable(constraints):  # predicate function, which is called once per distinct value
+        verdicts = values.map(constraints)
+        return ~verdicts.str[0].astype(bool), verdicts.str[1]
+    raise NotImplementedError
+
+
+def _duplicate_problems(exchange_ids: np.ndarray, name_codes: np.ndarray, names: np.ndarray) -> pd.DataFrame:
+    """Header names occurring more than once (case-insensitive) in a message, reported with their first spelling"""
+    lower_codes, lower_names = pd.factorize(pd.Series(names, dtype=object).str.lower())
+    exchange_codes, _ = pd.factorize(exchange_ids)
+    groups = exchange_codes.astype(np.int64) * max(len(lower_names), 1) + lower_codes[name_codes]
+    _, first, counts = np.unique(groups, return_index=True, return_counts=True)
+    first, counts = first[counts > 1], counts[counts > 1]
+    first_names = pd.Series(names[name_codes[first]], dtype=object)
+    counts = pd.Series(counts.astype(str), dtype=object)
+    return pd.DataFrame({'exchange_id': exchange_ids[first], 'position': -1, 'key': first_names, 'name': first_names,
+                         'code': HeaderProblem.DUPLICATE_HEADERS, 'severity': ERROR,
+                         'reason': "Header '" + first_names + "' found " + counts + " times!"})
+
+
+def _conflict_problems(exchange_ids: np.ndarray, name_codes: np.ndarray, names: np.ndarray) -> pd.DataFrame:
+    """Messages containing headers that must not be set together"""
+    codes = {name: code for code, name in enumerate(names)}
+    frames = []
+    for hdr1, hdr2 in CONFLICTING_HEADERS:
+        if hdr1 not in codes or hdr2 not in codes:
+            continue
+        both = np.intersect1d(exchange_ids[name_codes == codes[hdr1]], exchange_ids[name_codes == codes[hdr2]])
+        frames.append(pd.DataFrame({'exchange_id': both, 'position': len(name_codes), 'key': hdr1, 'name': hdr1,
+                                    'code': HeaderProblem.CONFLICTING_HEADERS, 'severity': ERROR,
+                                    'reason': f"'{hdr1}' and '{hdr2}' must not be set together"}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PROBLEM_COLUMNS)
@@ -0,0 +1,193 @@
+import codecs
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
+from urllib.parse import unquote_to_bytes
+
+from src.http_message.http_exchange import HttpExchange
+from src.http_message.parsing import ParsedRequest, parse_request
+
+# Matching of attack signatures (e.g. SQL injection keywords, traversal sequences, smuggling markers) in requests.
+# All signatures are compiled into a single Aho-Corasick automaton, which is turned into a dense transition table, so
+# scanning a field costs two list lookups per byte, no matter how many signatures there are.
+
+DEFAULT_SIGNATURE_FILE = Path(__file__).with_name('signatures.txt')
+FIELDS = ('path', 'query', 'headers', 'body')  # parts of a request that are scanned
+
+
+class Signature(NamedTuple):
+    name: str  # '<category>.<name>', e.g. 'sqli.union_select'
+    token: bytes
+    fields: frozenset = frozenset(FIELDS)  # fields in which the token is searched
+
+    @property
+    def category(self) -> str:
+        return self.name.split('.', 1)[0]
+
+
+def load_signatures(path: Union[str, Path] = DEFAULT_SIGNATURE_FILE) -> List[Signature]:
+    """
+    Read the signatures from a file with one signature per line: `<category>.<name>[@<field>,...] <token>`, where the
+    fields (see `FIELDS`) restrict where the token is searched. The token is the rest of the line and may contain
+    escape sequences like `\\r\\n` or `\\x20`. Empty lines and lines starting with '#' are ignored.
+    """
+    signatures = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(maxsplit=1)
+            if len(parts) < 2:
+                raise ValueError(f"{path}:{line_no}: missing token of signature '{parts[0]}'")
+            name, fields = parts[0].partition('@')[::2]
+            fields = frozenset(fields.split(',')) if fields else frozenset(FIELDS)
+            if not fields <= frozenset(FIELDS):
+                raise ValueError(f"{path}:{line_no}: unknown fields {', '.join(sorted(fields - frozenset(FIELDS)))}")
+            signatures.append(Signature(name, codecs.escape_decode(parts[1].encode('utf-8'))[0], fields))
+    return signatures
+
+
+class SignatureMatcher:
+    """
+    Finds which signatures occur in a field. The tokens are matched case-insensitively (ASCII) on the raw bytes. The
+    hits of a scan are a bit mask, where bit i is set if the i-th signature occurs (see `names`).
+    """
+
+    def __init__(self, signatures: Iterable[Signature]):
+        self.signatures = list(signatures)
+        self.categories = sorted({s.category for s in self.signatures})
+        self._field_masks = {field: sum(1 << i for i, s in enumerate(self.signatures) if field in s.fields)
+                             for field in FIELDS}
+        self._category_masks = {category: sum(1 << i for i, s in enumerate(self.signatures) if s.category == category)
+                                for category in self.categories}
+        self._compile()
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path] = DEFAULT_SIGNATURE_FILE) -> 'SignatureMatcher':
+        return cls(load_signatures(path))
+
+    def _compile(self) -> None:
+        """
+        Build the automaton. Bytes are mapped to classes first (lower case, bytes which don't occur in any token share
+        class 0), which keeps the rows of the transition table short.
+        """
+        tokens = [s.token.lower() for s in self.signatures]
+        if not all(tokens):
+            raise ValueError("Signatures must not be empty")
+        symbols = sorted({b for token in tokens for b in token})
+        class_of = {b: c for c, b in enumerate(symbols, 1)}
+        self._classes = bytes(class_of.get(b, 0) for b in bytes(range(256)).lower())
+        width = len(symbols) + 1
+
+        # trie of the tokens
+        goto: List[Dict[int, int]] = [{}]
+        outputs = [0]
+        for i, token in enumerate(tokens):
+            state = 0
+            for b in token:
+                c = class_of[b]
+                if c not in goto[state]:
+                    goto[state][c] = len(goto)
+                    goto.append({})
+                    outputs.append(0)
+                state = goto[state][c]
+            outputs[state] |= 1 << i
+
+        # failure links in breadth first order, which resolve into the transitions of the missing edges
+        delta = [[0] * width for _ in goto]
+        fail = [0] * len(goto)
+        queue = deque()
+        for c, state in goto[0].items():
+            delta[0][c] = state
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[fail[state]]
+            for c in range(width):
+                target = goto[state].get(c)
+                if target is None:
+                    delta[state][c] = delta[fail[state]][c]
+                else:
+                    delta[state][c] = target
+                    fail[target] = delta[fail[state]][c]
+                    queue.append(target)
+
+        # number the states with outputs last, so a single comparison tells whether a state has outputs, and store
+        # them multiplied by the width, i.e. as the start of their row in the flat table
+        order = sorted(range(len(goto)), key=lambda s: outputs[s] != 0)
+        number = {state: n * width for n, state in enumerate(order)}
+        self._table = [number[delta[state][c]] for state in order for c in range(width)]
+        self._accepting = sum(1 for s in order if outputs[s] == 0) * width
+        self._outputs = {number[s]: outputs[s] for s in order if outputs[s] != 0}
+
+    def scan(self, data: bytes) -> int:
+        """Bit mask of the signatures occurring in the data"""
+        table, accepting, outputs = self._table, self._accepting, self._outputs
+        state = 0
+        hits = 0
+        for c in data.translate(self._classes):
+            state = table[state + c]
+            if state >= accepting:
+                hits |= outputs[state]
+        return hits
+
+    def scan_request(self, raw_request: bytes, parsed: Optional[ParsedRequest] = None) -> Dict[str, int]:
+        """
+        Hits of the signatures in every field of a request (see `FIELDS`), where path and query are percent-decoded
+        and every header value is scanned on its own
+        :param parsed: the parsed request, if it has been parsed already
+        """
+        request = parse_request(raw_request) if parsed is None else parsed
+        path, _, query = request.target.encode('iso-8859-1').partition(b'?')
+        header_hits = 0
+        for header in request.headers:
+            header_hits |= self.scan(raw_request[header.value_span[0]:header.value_span[1]])
+        return {
+            'path': self.scan(unquote_to_bytes(path)) & self._field_masks['path'],
+            'query': self.scan(unquote_to_bytes(query.replace(b'+', b' '))) & self._field_masks['query'],
+            'headers': header_hits & self._field_masks['headers'],
+            'body': self.scan(raw_request[request.body_start:]) & self._field_masks['body'],
+        }
+
+    def names(self, hits: int) -> List[str]:
+        """Names of the signatures in the bit mask of a scan"""
+        return [s.name for i, s in enumerate(self.signatures) if hits >> i & 1]
+
+    def category_counts(self, hits: int) -> Dict[str, int]:
+        """Number of signatures of every category in the bit mask of a scan"""
+        return {category: bin(hits & mask).count('1') for category, mask in self._category_masks.items()}
+
+    def features(self, exchange: HttpExchange) -> Dict[str, Any]:
+        """
+        Signature features of the request of an exchange: the names of the signatures found and the fields they were
+        found in (both comma separated) and the number of signatures per category (as `<category>_signatures`). The
+        keys and types only depend on the signatures, thus this can be used as `feature_fn` of `write_exchanges`.
+        """
+        field_hits = self.scan_request(exchange.get_raw_request())
+        hits = 0
+        for field_hit in field_hits.values():
+            hits |= field_hit
+        features: Dict[str, Any] = {
+            'signatures': ','.join(self.names(hits)),
+            'signature_fields': ','.join(field for field in FIELDS if field_hits[field]),
+        }
+        for category, count in self.category_counts(hits).items():
+            features[f'{category}_signatures'] = count
+        return features
+
+
+_MATCHER: Optional[SignatureMatcher] = None
+
+
+def get_matcher() -> SignatureMatcher:
+    """The shared matcher of the default signatures, which is built on first use"""
+    global _MATCHER
+    if _MATCHER is None:
+        _MATCHER = SignatureMatcher.from_file()
+    return _MATCHER
+
+
+def signature_features(exchange: HttpExchange) -> Dict[str, Any]:
+    """Signature features of an exchange with the default signatures (see `SignatureMatcher.features`)"""
+    return get_matcher().features(exchange)
@@ -5,6 +5,8 @@ from typing import Callable, List, Optional
 
 import pandas as pd
 
+from src.datasource.sniffing import format_suffix
+
 _DATA_DIR = Path('./data/')
 
 
@@ -12,7 +14,7 @@ _DATA_DIR = Path('./data/')
 #     return ['.pcap, .csv']
 
 def get_supported_filetypes(available_types: Optional[List[str]] = None) -> List[str]:
-    supported_types = ['.pcap', '.pcapng', '.csv']
+    supported_types = ['.pcap', '.pcapng', '.csv', '.har', '.log', '.parquet']
     if available_types is not None:
         return [f for f in available_types if f in supported_types]
     return supported_types
@@ -21,7 +23,7 @@ def get_supported_filetypes(available_types: Optional[List[str]] = None) -> List
 def filter_supported_datasets(datasets: List[str], allowed_exts: Optional[List[str]] = None) -> List[str]:
     if allowed_exts is None:
         allowed_exts = get_supported_filetypes()
-    return [ds for ds in datasets if Path(ds).suffix in allowed_exts]
+    return [ds for ds in datasets if format_suffix(ds) in allowed_exts]  # compressed datasets are supported too
 
 
 def get_available_datasets() -> List[str]:
@@ -7,9 +7,11 @@ import pandas as pd
 
 import datasource
 import src.utils as utils
+from src.preprocessing import exchanges_to_frame
 
 
 DATA_DIR = Path('data')
+HEADER_COLUMNS = ['Content-Length', 'Content-Type', 'User-Agent']  # request headers added as columns
 
 
 @st.cache(show_spinner=False)
@@ -20,7 +22,7 @@ def load_data(files: List[str], src_dir: Path = DATA_DIR) -> pd.DataFrame:
 
 @st.cache
 def to_dataframe(data: List, ignored_cols: Optional[List] = None) -> pd.DataFrame:
-    df = pd.DataFrame([exchange.to_series() for exchange in data])
+    df = exchanges_to_frame(data, header_columns=HEADER_COLUMNS)
     if ignored_cols is not None:
         df = df.drop(ignored_cols, axis=1)
     # return df[['source_ip', 'destination_ip', 'timestamp']]
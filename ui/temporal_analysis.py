@@ -22,7 +22,7 @@ def align_sessions(df: pd.DataFrame, id_attr: str = 'source_ip') -> pd.DataFrame
 	traces = df.groupby([id_attr])
 	df['ts_offset'] = traces.timestamp.transform(lambda x: x - x.min())
 	df = df[['source_ip', 'destination_ip', 'timestamp', 'ts_offset', 'method', 'path', '#_headers', 'content_length',
-			 'content-type', 'user_agent', 'status_code', 'rtt']]
+			 'content_type', 'user_agent', 'status_code', 'rtt']]
 	return df
 
 